@@ -0,0 +1,215 @@
+#archive: the saved MOSMIX snapshots as one store that can be queried by station, issue time, valid time and element.
+#Copyright (C) 2022 makischu
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+#download_kml (dir_kmz) keeps every kmz with a _%Y%m%d_%H%M suffix. after a year that is tens of thousands of files, and
+#every question about the past ("how good was Rad1h for 10836 one day ahead, in march?") would mean unzipping and parsing
+#all of them again. the archive parses every file once:
+# chunks/000001.npz  compressed columns (np.savez_compressed), never changed once written: 'valid' (datetime64 UTC) and one
+#                    float32 column per element (NaN where dwd says '-'). rows: station by station, run by run.
+# index.bin          one fixed size record per (chunk, station, issue time): rows [start, stop) in the chunk and the range
+#                    of valid times. only appended. a query selects records first, then opens only the chunks (and in them
+#                    only the columns) it needs - npz members are decompressed on access.
+# sources.txt        names of the ingested files, so that ingesting the folder again only takes the new ones.
+#the issue time is dwd:IssueTime from the kml (the download time in the file name is later, and local time); files without
+#it get the first time step - 1 h, which is what MOSMIX does. a run that is already in the archive (same station and
+#issue time, e.g. downloaded twice) is skipped.
+
+import datetime as dt
+import glob
+import os
+import numpy as np
+import dwd2csv
+import pipeline
+
+
+index_dtype = np.dtype([('chunk', '<i4'), ('station', 'S8'), ('issue', '<M8[s]'), ('valid_min', '<M8[s]'), ('valid_max', '<M8[s]'),
+                        ('start', '<i8'), ('stop', '<i8')])
+
+#datetime (naive = UTC, or with tzinfo), 'YYYY-MM-DD[THH:MM]' or datetime64 >>> datetime64[s] UTC
+def to_datetime64(t):
+    if isinstance(t, dt.datetime) and t.tzinfo is not None:
+        return np.datetime64(int(t.timestamp()), 's')
+    return np.datetime64(t, 's')
+
+#rows of all ranges [start, stop) as one index array
+def ranges(start, stop):
+    n = stop - start
+    return np.repeat(start - np.cumsum(n) + n, n) + np.arange(n.sum())
+
+class Archive:
+    def __init__(self, archive_dir='./data/archive', elements=pipeline.default_elements):
+        self.archive_dir = archive_dir
+        self.elements = list(elements)
+        self.index_filename = os.path.join(archive_dir, 'index.bin')
+        self.sources_filename = os.path.join(archive_dir, 'sources.txt')
+        os.makedirs(os.path.join(archive_dir, 'chunks'), exist_ok=True)
+        self._index = None
+        self._index_size = None
+
+    def chunk_filename(self, chunk):
+        return os.path.join(self.archive_dir, 'chunks', '%06d.npz' % chunk)
+
+    #all index records. re-read only if the file has grown (e.g. another process has ingested).
+    def index(self):
+        size = os.path.getsize(self.index_filename) if os.path.exists(self.index_filename) else 0
+        if size != self._index_size:
+            self._index = np.fromfile(self.index_filename, dtype=index_dtype) if size else np.zeros(0, dtype=index_dtype)
+            self._index_size = size
+        return self._index
+
+    def sources(self):
+        if not os.path.exists(self.sources_filename):
+            return set()
+        with open(self.sources_filename, 'r') as file:
+            return set(line.strip() for line in file if line.strip())
+
+    #take kmz/kml files into the archive (only the own elements, and only stations if given). files are taken in the given
+    #order; the chunks are written whenever chunk_rows rows have come together. a file that does not parse completely
+    #(truncated kml, broken zip) is reported and not recorded, so a later ingest tries it again.
+    def ingest(self, filenames, stations=None, chunk_rows=2**20):
+        stats = {'files': 0, 'skipped': 0, 'runs': 0, 'rows': 0, 'chunks': 0}
+        known = self.sources()
+        index = self.index()
+        seen = set(zip(index['station'].tolist(), index['issue'].astype(np.int64).tolist()))
+        pending, names, rows = [], [], 0
+        for filename in filenames:
+            name = os.path.basename(filename)
+            if name in known:
+                stats['skipped'] += 1
+                continue
+            try:
+                timestamps, stationArrays = dwd2csv.scanKML_columnar(filename, self.elements, stations, np.float32, strict=True)
+                issue = dwd2csv.kml_issue_time(filename)
+                if issue is None and len(timestamps):
+                    issue = timestamps[0] - np.timedelta64(1, 'h')
+            except Exception as e:
+                print(filename + ': ' + str(e))
+                continue
+            for station, values in stationArrays.items():
+                key = (station.encode('iso-8859-1'), int(issue.astype(np.int64)))
+                if key in seen:
+                    continue
+                seen.add(key)
+                pending.append((key[0], issue, timestamps, values))
+                rows += len(timestamps)
+                stats['runs'] += 1
+            names.append(name)
+            known.add(name)
+            stats['files'] += 1
+            if rows >= chunk_rows:
+                stats['rows'] += self._write_chunk(pending, names)
+                stats['chunks'] += 1
+                pending, names, rows = [], [], 0
+        if pending or names:
+            stats['rows'] += self._write_chunk(pending, names)
+            stats['chunks'] += 1 if pending else 0
+        return stats
+
+    #all files of a folder that look like saved snapshots, oldest first (the suffix sorts by time).
+    def ingest_dir(self, folder, pattern='MOSMIX_*.km[lz]', stations=None, chunk_rows=2**20):
+        filenames = sorted(glob.glob(os.path.join(folder, pattern)), key=lambda f: os.path.basename(f)[-17:])
+        return self.ingest(filenames, stations, chunk_rows)
+
+    #chunk first, then its index records, then the names of the files: after a crash in between, the files are
+    #simply ingested again (an orphaned chunk is never referenced).
+    def _write_chunk(self, pending, names):
+        n = 0
+        if pending:
+            pending.sort(key=lambda run: (run[0], run[1]))
+            lengths = np.array([ len(run[2]) for run in pending ], dtype=np.int64)
+            stop = np.cumsum(lengths)
+            n = int(stop[-1]) if len(stop) else 0
+            values = np.concatenate([ run[3] for run in pending ], axis=1)
+            columns = {'valid': np.concatenate([ run[2] for run in pending ])}
+            for i, key in enumerate(self.elements):
+                columns[key] = values[i]
+            chunk = max([ int(os.path.basename(f)[:6]) for f in glob.glob(os.path.join(self.archive_dir, 'chunks', '*.npz')) ] + [0]) + 1
+            filename = self.chunk_filename(chunk)
+            with open(filename + '.tmp', 'wb') as file:
+                np.savez_compressed(file, **columns)
+            os.replace(filename + '.tmp', filename)
+            records = np.zeros(len(pending), dtype=index_dtype)
+            records['chunk'] = chunk
+            records['station'] = [ run[0] for run in pending ]
+            records['issue'] = [ run[1] for run in pending ]
+            records['valid_min'] = [ run[2][0] if len(run[2]) else run[1] for run in pending ]
+            records['valid_max'] = [ run[2][-1] if len(run[2]) else run[1] for run in pending ]
+            records['start'] = stop - lengths
+            records['stop'] = stop
+            with open(self.index_filename, 'ab') as file:
+                records.tofile(file)
+        with open(self.sources_filename, 'a') as file:
+            file.writelines(name + '\n' for name in names)
+        return n
+
+    #forecasts as columns: station, issue, valid (datetime64 UTC), lead (hours) and the elements (float64, NaN if missing).
+    #stations: list or None (all). valid, issue: (start, end), end excluded. lead_hours: (min, max), both included.
+    #e.g. query(['10836'], ['Rad1h'], valid=('2022-03-01', '2022-04-01'), lead_hours=(24, 48))
+    def query(self, stations=None, elements=None, valid=None, issue=None, lead_hours=None):
+        elements = self.elements if elements is None else list(elements)
+        index = self.index()
+        mask = np.ones(len(index), dtype=bool)
+        if stations is not None:
+            mask &= np.isin(index['station'], np.array([ s.encode('iso-8859-1') for s in stations ], dtype='S8'))
+        if issue is not None:
+            mask &= (index['issue'] >= to_datetime64(issue[0])) & (index['issue'] < to_datetime64(issue[1]))
+        if valid is not None:
+            valid = (to_datetime64(valid[0]), to_datetime64(valid[1]))
+            mask &= (index['valid_max'] >= valid[0]) & (index['valid_min'] < valid[1])
+        if lead_hours is not None:
+            lead = (np.timedelta64(int(lead_hours[0]*3600), 's'), np.timedelta64(int(lead_hours[1]*3600), 's'))
+            mask &= (index['valid_max'] - index['issue'] >= lead[0]) & (index['valid_min'] - index['issue'] <= lead[1])
+        selected = index[mask]
+        parts = []
+        for chunk in np.unique(selected['chunk']):
+            records = selected[selected['chunk'] == chunk]
+            rows = ranges(records['start'], records['stop'])
+            lengths = records['stop'] - records['start']
+            with np.load(self.chunk_filename(chunk)) as data:
+                part = {'station': np.repeat(records['station'], lengths), 'issue': np.repeat(records['issue'], lengths), 'valid': data['valid'][rows]}
+                keep = np.ones(len(rows), dtype=bool)
+                if valid is not None:
+                    keep &= (part['valid'] >= valid[0]) & (part['valid'] < valid[1])
+                if lead_hours is not None:
+                    keep &= (part['valid'] - part['issue'] >= lead[0]) & (part['valid'] - part['issue'] <= lead[1])
+                rows = rows[keep]
+                part = { key: col[keep] for key, col in part.items() }
+                for key in elements:
+                    part[key] = data[key][rows].astype(np.float64) if key in data.files else np.full(len(rows), np.nan)
+            parts.append(part)
+        columns = {'station': np.array([], dtype='S8'), 'issue': np.array([], dtype='datetime64[s]'), 'valid': np.array([], dtype='datetime64[s]')}
+        columns.update({ key: np.array([]) for key in elements })
+        if parts:
+            columns = { key: np.concatenate([ part[key] for part in parts ]) for key in parts[0] }
+        columns['station'] = columns['station'].astype(str)
+        columns['lead'] = (columns['valid'] - columns['issue']).astype(np.float64) / 3600
+        return columns
+
+#per station and valid time only the newest run (e.g. what was known at the time, with query(lead_hours=...)).
+def latest(columns):
+    order = np.lexsort((columns['issue'], columns['valid'], columns['station']))
+    station, valid = columns['station'][order], columns['valid'][order]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = (station[1:] != station[:-1]) | (valid[1:] != valid[:-1])
+    return { key: col[order[last]] for key, col in columns.items() }
+
+
+if __name__ == "__main__":
+    # example usage: take the kmz files that download_kml saved (dir_kmz) into the archive, then ask it something.
+    archive = Archive('./data/archive')
+    print(archive.ingest_dir('./data'))
+    columns = archive.query(['10836'], ['Rad1h'], valid=('2022-03-01', '2022-04-01'), lead_hours=(24, 48))
+    print(str(len(columns['valid'])) + ' values, mean Rad1h ' + str(np.nanmean(columns['Rad1h']) if len(columns['valid']) else '-'))
@@ -0,0 +1,235 @@
+#backtest: compare the pv estimation with what the inverters really did, and fit the plant parameters to it.
+#Copyright (C) 2022 makischu
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+#the constants of csv2pv (efficiency, temperature coefficient, eps of calc_pv_T, the 0.5 diffuse share when Neff is
+#missing) are picked by hand. with the archived forecasts (archive.py) and a log of the inverters they can be checked:
+# - forecast_inputs: Rad1h, Neff, TTT for a whole period from the archive, as the pipeline would have combined and
+#   interpolated them - per valid hour the newest run within lead_hours (e.g. (24, 48): what was known a day ahead).
+# - load_measurements: the inverter log on the same time grid (mean of the logged values around each sample).
+# - Backtest: the model of csv2pv.evaluate_plants, but the sun geometry is computed once and only the parameters
+#   change - one evaluation of a year at 5 minutes is a few numpy operations on arrays x samples.
+#   score/monthly: rmse, mae, bias and energy ratio (estimated / measured), for the whole period or per month.
+#   fit: least squares (scipy) of efficiency, temp_coeff, eps and diffuse_default per array.
+#   sweep: the error for a grid of parameter values, optionally distributed to a process pool.
+#the fitted parameters are written into a copy of the plant configuration, which can be saved as plants.json.
+
+import copy
+import itertools
+import json
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import csv2csv
+import csv2pv
+import pipeline
+import archive
+
+
+fit_keys = ['efficiency', 'temp_coeff', 'eps', 'diffuse_default']
+parameter_bounds = {'efficiency': (0.01, 1.0), 'temp_coeff': (-0.02, 0.0), 'eps': (0.1, 1.0), 'diffuse_default': (0.0, 1.0)}
+
+#the model inputs (t on the fine grid, Rad1h, Neff, TTT) from the archive, for start <= t <= end (datetimes, UTC).
+#stations as in pipeline.combine. lead_hours: (min, max) or None (newest run of all).
+#hours no archived run covers (missing runs, lead_hours) are NaN, and so are their samples (see csv2csv.connected_ranges).
+def forecast_inputs(store, stations, start, end, lead_hours=None, resolution_in_minutes=5):
+    grid = np.arange(archive.to_datetime64(start), archive.to_datetime64(end) + np.timedelta64(1, 'h'), np.timedelta64(1, 'h'))
+    elements = ['Rad1h', 'Neff', 'TTT']
+    forecasts = {}
+    for station in pipeline.needed_stations(stations):
+        found = archive.latest(store.query([station], elements, (grid[0], grid[-1] + np.timedelta64(1, 's')), None, lead_hours))
+        pos = np.searchsorted(grid, found['valid'])
+        forecasts[station] = {'t': grid}
+        for key in elements:
+            forecasts[station][key] = np.full(len(grid), np.nan)
+            forecasts[station][key][pos] = found[key]
+    columns = pipeline.combine(forecasts, stations)
+    return csv2csv.interpolate_columns({ key: columns[key] for key in ['t'] + elements }, resolution_in_minutes)
+
+#logged values (t_log: datetime64 or datetimes) >>> mean over (t - resolution/2, t + resolution/2] per sample of t,
+#NaN where nothing was logged.
+def resample(t_log, values, t, resolution_in_minutes=5):
+    t_log = np.asarray(t_log) if np.asarray(t_log).dtype.kind == 'M' else csv2csv.to_datetime64(t_log)
+    step = np.timedelta64(60*resolution_in_minutes, 's')
+    idx = np.ceil((t_log.astype('datetime64[s]') - t[0] - step/2) / step).astype(np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    ok = (idx >= 0) & (idx < len(t)) & ~np.isnan(values)
+    counts = np.bincount(idx[ok], minlength=len(t))
+    with np.errstate(invalid='ignore'):
+        return np.bincount(idx[ok], values[ok], minlength=len(t)) / counts
+
+#inverter log (csv with ';' and a column 't', or a columnar file, see csv2csv.load_data_columns) >>> {column: values on t}.
+#columns: the power columns (W), named like the output of evaluate_plants ('pv<inverter>P'). timestamps without
+#timezone are taken as local time.
+def load_measurements(filename, t, columns, resolution_in_minutes=5):
+    log = csv2csv.load_data_columns(filename, columns, ['t'])
+    return { key: resample(log['t'], np.where(log[key] == '-', np.nan, log[key]).astype(np.float64) if log[key].dtype == object else log[key], t, resolution_in_minutes)
+             for key in columns if key in log }
+
+#the power columns of a plant configuration ('pv<inverter>P').
+def power_columns(plants):
+    return csv2pv.pv_columns(plants)['P']
+
+#error measures over the samples where both are known. energy: estimated / measured energy.
+def score(estimated, measured):
+    ok = ~np.isnan(estimated) & ~np.isnan(measured)
+    d = estimated[ok] - measured[ok]
+    n = int(np.count_nonzero(ok))
+    if not n:
+        return {'n': 0, 'rmse': np.nan, 'mae': np.nan, 'bias': np.nan, 'energy': np.nan}
+    total = np.sum(measured[ok])
+    return {'n': n, 'rmse': float(np.sqrt(np.mean(d*d))), 'mae': float(np.mean(np.abs(d))), 'bias': float(np.mean(d)),
+            'energy': float(np.sum(estimated[ok]) / total) if total else np.nan}
+
+
+class Backtest:
+    #t, Rad1h, Neff, TTT: model inputs on the fine grid (see forecast_inputs). measured: {power column: values on t}.
+    def __init__(self, t, Rad1h, Neff, TTT, measured, plants=None, resolution_in_minutes=5, cache_dir='./data/cache'):
+        self.plants = copy.deepcopy(plants or csv2pv.default_plants)
+        self.t = np.asarray(t)
+        self.rad_W = np.asarray(Rad1h, dtype=np.float64) / 3.6
+        self.Neff = np.asarray(Neff, dtype=np.float64)
+        self.TTT = np.asarray(TTT, dtype=np.float64)
+        self.sites = []
+        self.arrays = []
+        for site in self.plants['sites']:
+            inverters = [ inverter for inverter in site['inverters'] if inverter['arrays'] ]
+            arrays = [ array for inverter in inverters for array in inverter['arrays'] ]
+            if not arrays:
+                continue
+            geometry = [ (a['azimut'], a['elevat'], csv2pv.load_shading(a.get('shading'))) for a in arrays ]
+            az, el, direct = csv2pv.solar_geometry(self.t, geometry, resolution_in_minutes, tuple(site.get('location', csv2pv.location)), cache_dir)
+            counts = np.array([ len(inverter['arrays']) for inverter in inverters ])
+            self.sites.append({'first': len(self.arrays), 'count': len(arrays), 'direct': direct, 'starts': np.cumsum(counts) - counts,
+                               'limit': np.array([ [inverter.get('limit', np.inf)] for inverter in inverters ]),
+                               'columns': [ 'pv'+inverter['name']+'P' for inverter in inverters ]})
+            self.arrays += arrays
+        estimated = self.predict()
+        self.measured = { key: np.asarray(col, dtype=np.float64) for key, col in measured.items() if key in estimated }
+        #the samples that count: both known. only the inputs decide where the estimation is NaN, not the parameters.
+        self.valid = { key: ~np.isnan(estimated[key]) & ~np.isnan(col) for key, col in self.measured.items() }
+
+    #parameter vector (keys x arrays, flat) of the current configuration.
+    def parameters(self, keys=fit_keys):
+        return np.concatenate([ [ a.get(key, csv2pv.array_parameter_defaults.get(key)) for a in self.arrays ] for key in keys ]).astype(np.float64)
+
+    #estimated power per inverter (as evaluate_plants, unrounded) with the parameters x (None: as configured).
+    def predict(self, x=None, keys=fit_keys):
+        params = csv2pv.array_parameters(self.arrays)
+        if x is not None:
+            x = np.asarray(x, dtype=np.float64).reshape(len(keys), len(self.arrays))
+            for k, key in enumerate(keys):
+                params[csv2pv.array_parameter_keys.index(key)] = x[k][:, None]
+        columns = {}
+        for site in self.sites:
+            p = [ param[site['first']:site['first']+site['count']] for param in params ]
+            E, T, pwr = csv2pv.arrays_power(self.rad_W, self.Neff, self.TTT, site['direct'], *p, rounded=False)
+            pwr = np.minimum(np.add.reduceat(pwr, site['starts'], axis=0), site['limit'])
+            columns.update(zip(site['columns'], pwr))
+        return columns
+
+    #estimated - measured, over all valid samples of all inverters (for least squares).
+    def residuals(self, x=None, keys=fit_keys):
+        estimated = self.predict(x, keys)
+        return np.concatenate([ estimated[key][ok] - self.measured[key][ok] for key, ok in self.valid.items() ])
+
+    def rmse(self, x=None, keys=fit_keys):
+        r = self.residuals(x, keys)
+        return float(np.sqrt(np.mean(r*r))) if len(r) else np.nan
+
+    #{power column: score} for the whole period.
+    def score(self, x=None, keys=fit_keys):
+        estimated = self.predict(x, keys)
+        return { key: score(estimated[key], col) for key, col in self.measured.items() }
+
+    #{power column: {'YYYY-MM': score}}: the same per month, all months in one pass (bincount over the month index).
+    def monthly(self, x=None, keys=fit_keys):
+        estimated = self.predict(x, keys)
+        months = self.t.astype('datetime64[M]')
+        labels, month = np.unique(months, return_inverse=True)
+        result = {}
+        for key, col in self.measured.items():
+            ok = ~np.isnan(estimated[key]) & ~np.isnan(col)
+            d = np.where(ok, estimated[key] - col, 0)
+            n = np.bincount(month, ok, len(labels))
+            e = np.bincount(month, np.where(ok, estimated[key], 0), len(labels))
+            m = np.bincount(month, np.where(ok, col, 0), len(labels))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                stats = {'n': n.astype(int), 'rmse': np.sqrt(np.bincount(month, d*d, len(labels)) / n), 'mae': np.bincount(month, np.abs(d), len(labels)) / n,
+                         'bias': np.bincount(month, d, len(labels)) / n, 'energy': e / m}
+            result[key] = { str(label): { name: values[i].item() for name, values in stats.items() } for i, label in enumerate(labels) }
+        return result
+
+    #least squares fit of the parameters keys (per array), within parameter_bounds. returns the fitted configuration
+    #(a copy) and the parameter vector.
+    def fit(self, keys=fit_keys, x0=None):
+        from scipy.optimize import least_squares
+        x0 = self.parameters(keys) if x0 is None else np.asarray(x0, dtype=np.float64)
+        lower = np.repeat([ parameter_bounds[key][0] for key in keys ], len(self.arrays))
+        upper = np.repeat([ parameter_bounds[key][1] for key in keys ], len(self.arrays))
+        result = least_squares(self.residuals, np.clip(x0, lower, upper), bounds=(lower, upper), x_scale='jac', args=(keys,))
+        return self.with_parameters(result.x, keys), result.x
+
+    #the configuration with the parameters x (a copy, e.g. to save as plants.json).
+    def with_parameters(self, x, keys=fit_keys):
+        plants = copy.deepcopy(self.plants)
+        arrays = [ array for site in plants['sites'] for inverter in site['inverters'] if inverter['arrays'] for array in inverter['arrays'] ]
+        x = np.asarray(x, dtype=np.float64).reshape(len(keys), len(arrays))
+        for k, key in enumerate(keys):
+            for i, array in enumerate(arrays):
+                array[key] = float(x[k, i])
+        return plants
+
+    #rmse for every combination of values (grid: {key: values}, a value applies to all arrays), best first.
+    #workers > 1: the combinations are distributed to a process pool (each worker gets the backtest once).
+    def sweep(self, grid, workers=None, chunksize=16):
+        keys = list(grid.keys())
+        combinations = list(itertools.product(*[ grid[key] for key in keys ]))
+        if workers and workers > 1 and len(combinations) > chunksize:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_sweep_init, initargs=(self, keys)) as pool:
+                errors = list(pool.map(_sweep_rmse, combinations, chunksize=chunksize))
+        else:
+            errors = [ self.rmse(np.repeat(values, len(self.arrays)), keys) for values in combinations ]
+        order = np.argsort(errors)
+        return [ (dict(zip(keys, combinations[i])), errors[i]) for i in order ]
+
+#the backtest of a sweep, once per worker process.
+_sweep = None
+def _sweep_init(backtest, keys):
+    global _sweep
+    _sweep = (backtest, keys)
+
+def _sweep_rmse(values):
+    backtest, keys = _sweep
+    return backtest.rmse(np.repeat(values, len(backtest.arrays)), keys)
+
+
+if __name__ == "__main__":
+    # example usage: my stations and plants, the archive (see archive.py) and a log of my inverter ('t', 'pvWestP' in W)
+    # for one year; forecasts as they were known one day ahead. prints the errors before and after the fit.
+    import datetime as dt
+    plants = csv2pv.load_plants('./plants.json') if os.path.exists('./plants.json') else csv2pv.default_plants
+    start, end = dt.datetime(2022, 1, 1, tzinfo=dt.timezone.utc), dt.datetime(2022, 12, 31, tzinfo=dt.timezone.utc)
+    inputs = forecast_inputs(archive.Archive('./data/archive'), csv2csv.default_stations, start, end, lead_hours=(24, 48))
+    measured = load_measurements('./data/inverter_log.csv', inputs['t'], power_columns(plants))
+    backtest = Backtest(inputs['t'], inputs['Rad1h'], inputs['Neff'], inputs['TTT'], measured, plants)
+    for key, months in backtest.monthly().items():
+        for month, s in months.items():
+            print(key+' '+month+': rmse '+str(round(s['rmse']))+' W, energy '+str(round(s['energy'], 2)))
+    fitted, x = backtest.fit()
+    print('before: '+str(backtest.score()))
+    print('after:  '+str(backtest.score(x)))
+    with open('./data/plants_fitted.json', 'w') as file:
+        json.dump(fitted, file, indent=4)
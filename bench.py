@@ -0,0 +1,1259 @@
+#bench: Simple benchmarks for the processing steps, on synthetic data.
+#Copyright (C) 2022 makischu
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# usage: python bench.py [name ...]   (without names: run all)
+# the synthetic files are written to ./data/bench and reused on later runs.
+
+import datetime as dt
+import io
+import math
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import time
+import numpy as np
+from zipfile import ZipFile, ZIP_DEFLATED
+
+import dwd2csv
+import csv2csv
+import csv2pv
+import columnstore
+import stationcatalog
+import geolookup
+import stationlist2csv
+import pipeline
+import archive
+import backtest
+
+bench_dir = './data/bench'
+kml_elements = ['Rad1h','Neff','N','DD','FF','FX1','PPPP','DRR1','RR1c','RRad1','SunD1','SunD','TTT','Td','ww','WPc11']
+
+
+#write a kml file that looks like a MOSMIX all_stations file (same structure, random values).
+#ids: station names (default: station_id of 0..n_stations-1).
+#values(s, el, times, rnd) instead of uniform random numbers: the value strings of station s, element el.
+def make_synthetic_kml(filename, n_stations=5400, n_steps=240, elements=kml_elements, missing_every=7, t0=None, seed=42, ids=None, values=None):
+    rnd = random.Random(seed)
+    ids = ids or [ station_id(s) for s in range(n_stations) ]
+    t0 = t0 or dt.datetime(2022, 9, 1, 10, tzinfo=dt.timezone.utc)
+    with open(filename, 'w') as f:
+        f.write('<?xml version="1.0" encoding="ISO-8859-1" standalone="yes"?>\n')
+        f.write('<kml:kml xmlns:dwd="'+dwd2csv.KML_NS['dwd']+'" xmlns:gx="'+dwd2csv.KML_NS['gx']+'" xmlns:xal="'+dwd2csv.KML_NS['xal']
+                +'" xmlns:kml="'+dwd2csv.KML_NS['kml']+'" xmlns:atom="'+dwd2csv.KML_NS['atom']+'">\n')
+        f.write('<kml:Document><kml:ExtendedData><dwd:ProductDefinition>\n')
+        f.write('<dwd:IssueTime>'+(t0-dt.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%S.000Z')+'</dwd:IssueTime><dwd:ForecastTimeSteps>\n')
+        times = [ t0+dt.timedelta(hours=i) for i in range(n_steps) ]
+        for t in times:
+            f.write('<dwd:TimeStep>'+t.strftime('%Y-%m-%dT%H:%M:%S.000Z')+'</dwd:TimeStep>\n')
+        f.write('</dwd:ForecastTimeSteps></dwd:ProductDefinition></kml:ExtendedData>\n')
+        for s, name in enumerate(ids):
+            f.write('<kml:Placemark><kml:name>'+name+'</kml:name><kml:description>STATION'+str(s)+'</kml:description><kml:ExtendedData>\n')
+            for e, el in enumerate(elements):
+                if values:
+                    strings = values(s, el, times, rnd)
+                elif missing_every and (s+e) % missing_every == 0:
+                    strings = ['-']*n_steps
+                else:
+                    strings = ['%.2f' % rnd.uniform(0, 1000) for i in range(n_steps)]
+                f.write('<dwd:Forecast dwd:elementName="'+el+'"><dwd:value>     '+'     '.join(strings)+'</dwd:value></dwd:Forecast>\n')
+            f.write('</kml:ExtendedData><kml:Point><kml:coordinates>10.0,48.0,500.0</kml:coordinates></kml:Point></kml:Placemark>\n')
+        f.write('</kml:Document></kml:kml>\n')
+    return filename
+
+def station_id(i):
+    return '%05d' % (10000+i)
+
+#kml -> kmz (as dwd delivers it)
+def make_synthetic_kmz(filename_kml):
+    filename_kmz = filename_kml[:-4] + '.kmz'
+    with ZipFile(filename_kmz, 'w', ZIP_DEFLATED) as z:
+        z.write(filename_kml, os.path.basename(filename_kml))
+    return filename_kmz
+
+#test/MOSMIX_L_fixture.kmz (committed; delete it to regenerate): the three default stations, the MOSMIX_L run of
+#2022-09-01 03 UTC, 72 hours with plausible values. Q491 has no Rad1h; 10850 lacks it on the morning of 09-02, and both
+#Rad1h stations lack it around noon of 09-03, so there the refined Rad1h is NaN.
+fixture_kmz = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test', 'MOSMIX_L_fixture.kmz')
+fixture_missing = {'10850': [(dt.datetime(2022, 9, 2, 6), dt.datetime(2022, 9, 2, 9))],
+                   '10836': [(dt.datetime(2022, 9, 3, 10), dt.datetime(2022, 9, 3, 13))]}
+fixture_missing['10850'] += fixture_missing['10836']
+
+#plausible values instead of uniform random numbers (see make_synthetic_kml): Rad1h follows the sun (0 at night),
+#clouds and temperature vary over the day.
+def daylight_values(s, el, times, rnd):
+    hours = np.array([ t.hour + t.minute/60 for t in times ])
+    day = np.array([ t.day for t in times ])
+    sun = np.clip(np.sin(np.pi*(hours - 5.0)/13.5), 0, None) * (hours > 5.0) * (hours < 18.5)
+    clouds = np.clip(40 + 35*np.sin(day + hours/5 + s) + rnd.uniform(-10, 10), 0, 100)
+    if el == 'Rad1h':
+        v = 2600*sun*(1 - 0.6*clouds/100)
+        v[v < 1] = 0
+    else:
+        v = {'Neff': clouds, 'N': np.clip(clouds + 5, 0, 100), 'DD': (200 + 40*np.sin(hours/4 + day)) % 360, 'FF': 3 + 2*sun,
+             'FX1': 6 + 4*sun, 'PPPP': 101300 + 200*np.sin(day + hours/12), 'DRR1': 0*hours, 'RR1c': 0*hours, 'RRad1': 0*hours,
+             'SunD1': 3600*sun*(1 - clouds/100), 'SunD': 0*hours, 'TTT': 284 + 9*sun, 'Td': 280 + 2*sun, 'ww': 0*hours + 2, 'WPc11': 0*hours}[el]
+    return [ '%.2f' % x for x in v ]
+
+def _fixture_values(s, el, times, rnd):
+    station = csv2csv.default_stations['Rad1h'][0][s] if s < 2 else csv2csv.default_stations['base']
+    values = daylight_values(s, el, times, rnd)
+    if el == 'Rad1h':
+        if station == csv2csv.default_stations['base']:
+            return ['-']*len(times)
+        for a, b in fixture_missing.get(station, []):
+            values = [ '-' if a <= t.replace(tzinfo=None) <= b else v for t, v in zip(times, values) ]
+    return values
+
+def make_fixture_kmz(filename=fixture_kmz):
+    if not os.path.exists(filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        ids = list(csv2csv.default_stations['Rad1h'][0]) + [csv2csv.default_stations['base']]
+        make_synthetic_kml(filename[:-4]+'.kml', t0=dt.datetime(2022, 9, 1, 4, tzinfo=dt.timezone.utc), n_steps=72, ids=ids, values=_fixture_values)
+        make_synthetic_kmz(filename[:-4]+'.kml')
+        os.remove(filename[:-4]+'.kml')
+    return filename
+
+def synthetic_kml(n_stations=5400, n_steps=240):
+    os.makedirs(bench_dir, exist_ok=True)
+    filename = os.path.join(bench_dir, 'MOSMIX_synthetic_'+str(n_stations)+'_'+str(n_steps)+'.kml')
+    if not os.path.exists(filename):
+        make_synthetic_kml(filename, n_stations, n_steps)
+    return filename
+
+
+#run fn(*args) in a fresh process and report wall time and peak RSS of that process.
+def _measure_child(queue, fn, args):
+    t = time.perf_counter()
+    fn(*args)
+    t = time.perf_counter() - t
+    queue.put((t, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024))
+
+def measure(fn, *args):
+    queue = multiprocessing.Queue()
+    p = multiprocessing.Process(target=_measure_child, args=(queue, fn, args))
+    p.start()
+    seconds, rss_mb = queue.get()
+    p.join()
+    return seconds, rss_mb
+
+def report(name, seconds, rss_mb=None):
+    line = '{:<40s} {:9.3f} s'.format(name, seconds)
+    if rss_mb is not None:
+        line += ' {:9.1f} MB peak RSS'.format(rss_mb)
+    print(line)
+
+#the comparisons are checks as well: a wrong result must not exit 0.
+def check(ok, what):
+    print(what+': '+('ok' if ok else 'FAILED'))
+    if not ok:
+        raise AssertionError(what)
+
+
+def _kml_parse_dom(filename):
+    dwd2csv.parseKML(dwd2csv.read_kml(filename), ['Rad1h'])
+
+def _kml_parse_stream(filename):
+    dwd2csv.parseKML_stream(filename, ['Rad1h'])
+
+def _kml_parse_stream_one(filename):
+    dwd2csv.parseKML_stream(filename, ['Rad1h'], [station_id(100)])
+
+#parseKML (full dom) vs. iterparseKML (streaming) on an all_stations sized file.
+def bench_kml():
+    filename = synthetic_kml()
+    print('# kml: '+filename+' ('+str(os.path.getsize(filename)//2**20)+' MB)')
+    report('parseKML', *measure(_kml_parse_dom, filename))
+    report('parseKML_stream', *measure(_kml_parse_stream, filename))
+    report('parseKML_stream (1 station)', *measure(_kml_parse_stream_one, filename))
+
+def _kml_all_stream(filename):
+    dwd2csv.parseKML_stream(filename, kml_elements)
+
+def _kml_all_columnar(filename):
+    dwd2csv.parseKML_columnar(filename, kml_elements)
+
+#all elements of all stations kept in ram: lists of strings vs. one float array per station.
+def bench_columnar():
+    filename = synthetic_kml()
+    print('# kml: '+filename+', '+str(len(kml_elements))+' elements')
+    report('parseKML_stream (strings)', *measure(_kml_all_stream, filename))
+    report('parseKML_columnar (float64)', *measure(_kml_all_columnar, filename))
+
+def _kmz_text(filename_kmz):
+    with open(filename_kmz, 'rb') as file:
+        kmz_content = file.read()
+    kml_content, kml_filename, kmz_filename = dwd2csv.extract_kml(kmz_content, filename_kmz)
+    dwd2csv.parseKML(kml_content, ['Rad1h'])
+
+def _kmz_stream(filename_kmz):
+    with open(filename_kmz, 'rb') as file:
+        kmz_content = file.read()
+    dwd2csv.parseKML_stream(dwd2csv.open_kmz(kmz_content), ['Rad1h'])
+
+#downloaded kmz content in ram: unzip+decode+parseKML vs. streaming the zip member into the parser.
+def bench_kmz():
+    filename = synthetic_kml()
+    filename_kmz = filename[:-4] + '.kmz'
+    if not os.path.exists(filename_kmz):
+        make_synthetic_kmz(filename)
+    print('# kmz: '+filename_kmz+' ('+str(os.path.getsize(filename_kmz)//2**20)+' MB, '+str(os.path.getsize(filename)//2**20)+' MB unzipped)')
+    report('extract_kml + parseKML', *measure(_kmz_text, filename_kmz))
+    report('open_kmz + parseKML_stream', *measure(_kmz_stream, filename_kmz))
+
+
+#a local stand-in for opendata.dwd.de: the files below directory over http, on a thread. paths as on dwd's server,
+#so base_url can be passed to the download functions. the first request for a path containing one of fail_first
+#is answered with 503 (the session has to retry it). requests counts the GET requests per path.
+def serve_directory(directory, fail_first=()):
+    import functools
+    import http.server
+    import threading
+    requests = {}
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def do_GET(self):
+            requests[self.path] = requests.get(self.path, 0) + 1
+            if requests[self.path] == 1 and any(name in self.path for name in fail_first):
+                self.send_error(503)
+                return
+            super().do_GET()
+        def log_message(self, format, *args):
+            pass
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(Handler, directory=directory))
+    server.requests = requests
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:'+str(server.server_address[1])
+
+#single_stations kmz files (one synthetic station each) in dwd's directory layout. the kml of the broken stations is truncated.
+def synthetic_server_tree(stations, broken=(), n_steps=240, name='server', missing_every=7):
+    directory = os.path.join(bench_dir, name)
+    for station in list(stations) + list(broken):
+        path = os.path.join(directory, 'MOSMIX_L', 'single_stations', station, 'kml')
+        filename = os.path.join(path, 'MOSMIX_L_LATEST_'+station+'.kml')
+        if os.path.exists(filename[:-4]+'.kmz'):
+            continue
+        os.makedirs(path, exist_ok=True)
+        make_synthetic_kml(filename, 1, n_steps, missing_every=missing_every, seed=int(station), ids=[station])
+        if station in broken:
+            with open(filename, 'rb') as file:
+                content = file.read()
+            with open(filename, 'wb') as file:
+                file.write(content[:len(content)//2])
+        make_synthetic_kmz(filename)
+        os.remove(filename)
+    return directory
+
+def fresh_dir(name):
+    directory = os.path.join(bench_dir, name)
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+    return directory
+
+#download_many (mode 'single') against a local http server: 20 stations (one answered with 503 first), a station
+#the server does not have (404) and one with a truncated kml. all of them have to end up in results or errors.
+def bench_download():
+    import xml.etree.ElementTree as ET
+    import requests
+    stations = [ station_id(i) for i in range(20) ]
+    missing, broken = station_id(98), station_id(99)
+    server, base_url = serve_directory(synthetic_server_tree(stations, [broken]), fail_first=[stations[3]])
+    dir_csv = fresh_dir('download')
+    print('# download: '+str(len(stations))+' stations + 2 failing from a local http server, '+str(len(kml_elements))+' elements')
+    try:
+        t, (results, errors) = timeit(dwd2csv.download_many, stations+[missing, broken], kml_elements, dir_csv, None, None, 8, None, 10, base_url, None, 'single', repeat=1)
+        report('download_many (8 workers)', t)
+        check(sorted(results) == stations, 'results for every station on the server')
+        check(server.requests.get('/MOSMIX_L/single_stations/'+stations[3]+'/kml/MOSMIX_L_LATEST_'+stations[3]+'.kmz') == 2, 'retry after 503')
+        kmz = os.path.join(bench_dir, 'server', 'MOSMIX_L', 'single_stations', stations[0], 'kml', 'MOSMIX_L_LATEST_'+stations[0]+'.kmz')
+        timestamps, stationValues = dwd2csv.parseKML_stream(kmz, kml_elements)
+        data = csv2csv.load_data(results[stations[0]][0], kml_elements)
+        check(len(data) == len(timestamps) and [ line['Rad1h'] for line in data ] == [ '-' if v == '-' else float(v) for v in stationValues[stations[0]]['Rad1h'] ], 'csv content')
+        check(sorted(errors) == [missing, broken], 'errors for the failing stations only')
+        check(isinstance(errors[missing], requests.HTTPError) and errors[missing].response.status_code == 404, 'missing station: 404')
+        check(isinstance(errors[broken], ET.ParseError), 'truncated kml: the parse error ('+str(errors[broken])+')')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+#the same server, twice with a KmzCache: the first pass downloads everything, the second only gets 304 (http.server
+#answers If-Modified-Since). download_kml returns the kml it extracted on the first pass.
+def bench_cache():
+    stations = [ station_id(i) for i in range(20) ]
+    directory = synthetic_server_tree(stations)
+    server, base_url = serve_directory(directory)
+    dir_csv = fresh_dir('download')
+    cache = dwd2csv.KmzCache(fresh_dir('download_cache'))
+    size = sum(os.path.getsize(os.path.join(directory, 'MOSMIX_L', 'single_stations', s, 'kml', 'MOSMIX_L_LATEST_'+s+'.kmz')) for s in stations)
+    print('# cache: '+str(len(stations))+' stations from a local http server, downloaded twice')
+    try:
+        t_miss, (results, errors) = timeit(dwd2csv.download_many, stations, kml_elements, dir_csv, None, None, 8, None, 10, base_url, cache, 'single', repeat=1)
+        report('download_many (empty cache)', t_miss)
+        check(len(results) == len(stations) and not errors, 'first pass: all stations')
+        check(cache.stats() == {'hits': 0, 'misses': len(stations), 'bytes_downloaded': size, 'bytes_saved': 0}, 'first pass: all misses '+str(cache.stats()))
+        t_hit, (results, errors) = timeit(dwd2csv.download_many, stations, kml_elements, dir_csv, None, None, 8, None, 10, base_url, cache, 'single', repeat=1)
+        report('download_many (304)', t_hit)
+        check(len(results) == len(stations) and not errors, 'second pass: all stations')
+        check(cache.stats() == {'hits': len(stations), 'misses': len(stations), 'bytes_downloaded': size, 'bytes_saved': size}, 'second pass: all hits '+str(cache.stats()))
+        url = dwd2csv.mosmix_url(stations[0], base_url)
+        kml_new = dwd2csv.download_kml(url, cache=cache)[0]
+        kml_cached = dwd2csv.download_kml(url, cache=cache)[0]
+        check(len(kml_new) > 0 and kml_cached is kml_new, 'download_kml on 304: the kml extracted before')
+        #other elements, other format: on 304 the files are extracted again from the cached kmz, not kept.
+        for elements, ext in [(['Rad1h', 'TTT'], '.csv'), (['Rad1h', 'TTT'], '.npy')]:
+            results, errors = dwd2csv.download_many(stations, elements, dir_csv, None, None, 8, None, 10, base_url, cache, 'single', ext)
+            filename = results[stations[0]][0]
+            columns = csv2csv.load_data_columns(filename, elements)
+            check(not errors and filename.endswith(ext) and list(columns) == ['t'] + elements,
+                  '304 with elements '+','.join(elements)+' as '+ext+': extracted again')
+        check(cache.stats()['misses'] == len(stations), 'no further downloads '+str(cache.stats()))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+#download_many from the all_stations file of the local server (500 synthetic stations), explicitly (mode 'all') and
+#via all_stations_threshold (mode 'auto'). a station that is not in the file has to end up in the errors.
+def bench_all_stations():
+    stations = [ station_id(i) for i in range(0, 500, 2) ]
+    missing = station_id(999)
+    directory = synthetic_server_tree(stations[:10])
+    path = os.path.join(directory, 'MOSMIX_L', 'all_stations', 'kml')
+    if not os.path.exists(os.path.join(path, 'MOSMIX_L_LATEST.kmz')):
+        os.makedirs(path, exist_ok=True)
+        make_synthetic_kml(os.path.join(path, 'MOSMIX_L_LATEST.kml'), 500, 240)
+        make_synthetic_kmz(os.path.join(path, 'MOSMIX_L_LATEST.kml'))
+        os.remove(os.path.join(path, 'MOSMIX_L_LATEST.kml'))
+    url_all = '/MOSMIX_L/all_stations/kml/MOSMIX_L_LATEST.kmz'
+    server, base_url = serve_directory(directory)
+    print('# all_stations: '+str(len(stations))+' of 500 stations + 1 missing from a local http server')
+    try:
+        dir_csv = fresh_dir('download')
+        t, (results, errors) = timeit(dwd2csv.download_many, stations+[missing], kml_elements, dir_csv, None, None, 8, None, 10, base_url, None, 'all', repeat=1)
+        report('download_many (all)', t)
+        check(sorted(results) == stations, 'results for every station in the file')
+        check(list(errors) == [missing] and 'not included' in str(errors[missing]), 'missing station in errors')
+        timestamps, stationValues = dwd2csv.parseKML_stream(os.path.join(path, 'MOSMIX_L_LATEST.kmz'), kml_elements, [stations[7]])
+        data = csv2csv.load_data(results[stations[7]][0], kml_elements)
+        check([ line['TTT'] for line in data ] == [ '-' if v == '-' else float(v) for v in stationValues[stations[7]]['TTT'] ], 'csv content')
+        check(server.requests == {url_all: 1}, 'mode all: one all_stations download, nothing else')
+        threshold = dwd2csv.all_stations_threshold
+        try:
+            dwd2csv.all_stations_threshold = 10
+            server.requests.clear()
+            results, errors = dwd2csv.download_many(stations[:9], kml_elements, fresh_dir('download'), base_url=base_url, mode='auto')
+            check(len(results) == 9 and not errors and url_all not in server.requests, 'mode auto below the threshold: single_stations')
+            server.requests.clear()
+            results, errors = dwd2csv.download_many(stations[:10]+[missing], kml_elements, fresh_dir('download'), base_url=base_url, mode='auto')
+            check(len(results) == 10 and list(errors) == [missing] and server.requests == {url_all: 1}, 'mode auto from the threshold on: all_stations')
+        finally:
+            dwd2csv.all_stations_threshold = threshold
+    finally:
+        server.shutdown()
+        server.server_close()
+
+#hourly rows like csv2csv.parse returns them: Rad1h as a daily bell curve (0 at night), some columns with '-'.
+def synthetic_rows(hours=240, seed=42):
+    rnd = random.Random(seed)
+    t0 = dt.datetime(2022, 6, 1, 0, tzinfo=dt.timezone.utc)
+    rows = []
+    for i in range(hours):
+        h = i % 24
+        row = {'t': t0 + dt.timedelta(hours=i)}
+        for el in kml_elements:
+            row[el] = round(rnd.uniform(0, 100), 2)
+        row['Rad1h'] = round(max(0.0, 3000*(1-((h-12.5)/8)**2)) * rnd.uniform(0.3, 1.0), 2) if 5 <= h <= 20 else 0.0
+        row['DD'] = round(rnd.uniform(0, 360), 2)
+        row['TTT'] = round(rnd.uniform(270, 300), 2)
+        if i % 11 == 0:
+            row['Neff'] = '-'
+        if i % 3 != 0:
+            row['RR1c'] = '-'
+        rows.append(row)
+    return rows
+
+#compare two lists of dicts exactly (floats bitwise, '-' as '-').
+def identical(rows1, rows2):
+    return len(rows1) == len(rows2) and all(r1 == r2 for r1, r2 in zip(rows1, rows2))
+
+#largest absolute difference between two lists of dicts (floats only; other values must be equal).
+def max_deviation(rows1, rows2):
+    if len(rows1) != len(rows2):
+        return float('inf')
+    dev = 0.0
+    for r1, r2 in zip(rows1, rows2):
+        for key, v1 in r1.items():
+            v2 = r2[key]
+            if isinstance(v1, float) and isinstance(v2, float):
+                dev = max(dev, abs(v1-v2))
+            elif v1 != v2:
+                return float('inf')
+    return dev
+
+def timeit(fn, *args, repeat=3):
+    best = None
+    for i in range(repeat):
+        t = time.perf_counter()
+        result = fn(*args)
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best, result
+
+#interpolate_rowwise (original) vs. interpolate (vectorized), 240h x 16 columns.
+def bench_interpolate():
+    rows = synthetic_rows()
+    print('# interpolate: '+str(len(rows))+' hours x '+str(len(kml_elements))+' columns')
+    for resolution in [15, 5, 1]:
+        t_row, ref = timeit(csv2csv.interpolate_rowwise, [dict(r) for r in rows], resolution)
+        t_vec, res = timeit(csv2csv.interpolate, [dict(r) for r in rows], resolution)
+        t_col, col = timeit(csv2csv.interpolate_columns, csv2csv.rows_to_columns(rows), resolution)
+        report('interpolate_rowwise ('+str(resolution)+' min)', t_row)
+        report('interpolate ('+str(resolution)+' min)', t_vec)
+        report('interpolate_columns ('+str(resolution)+' min)', t_col)
+        print('speedup '+str(round(t_row/t_vec, 1))+'x (rows), '+str(round(t_row/t_col, 1))+'x (columns)')
+        dev = max_deviation(ref, res)
+        check(dev < 1e-9, 'same as interpolate_rowwise (max deviation '+str(dev)+')')
+        dev = max_deviation(ref, csv2csv.columns_to_rows(col))
+        check(dev < 1e-9, 'interpolate_columns the same (max deviation '+str(dev)+')')
+
+#the dense equation system of the Rad1h fit, exactly as interpolate_rowwise builds it.
+def rad1h_fit_dense(Rvalues):
+    iLen = len(Rvalues)+1
+    d = 2*(iLen-1)
+    A = np.zeros((d,d))
+    b = np.zeros((d,1))
+    A[0:2,0:3]  = np.array([[ 1/4,    -1/4,   1],[ 1/2,     1/2,   -1]])
+    A[-2:,-3:]  = np.array([[ 1/4, 1, -1/4     ],[ 1/2,  1, 1/2      ]])
+    for j in range(1,iLen-2):
+        A[j*2:j*2+2,2*j-1:2*j+3] = np.array([[ 1/4, 1, -1/4,   1],[ 1/2,  1, 1/2,   -1]])
+    b[0::2, 0] = 2*np.asarray(Rvalues)
+    return np.linalg.solve(A, b)[:,0]
+
+#Rad1h fit: dense solve (original) vs. banded solve, for connected ranges of growing length (polar summer, batch reprocessing).
+def bench_rad1h_fit():
+    rnd = np.random.default_rng(42)
+    print('# rad1h fit: dense vs. banded solver')
+    for n in [16, 240, 960, 2400]:
+        R = rnd.uniform(10, 3000, n)
+        t_dense, x_dense = timeit(rad1h_fit_dense, R)
+        t_band, x_band = timeit(csv2csv._rad1h_fit, R)
+        dev = np.max(np.abs(x_dense-x_band))/np.max(np.abs(x_dense))
+        report('dense  ('+str(n)+' values)', t_dense)
+        report('banded ('+str(n)+' values)', t_band)
+        check(dev < 1e-9, 'same as the dense solve (relative deviation '+str(dev)+')')
+
+#stations x hours x columns, like synthetic_rows but as one array (NaN for '-').
+def synthetic_batch(n_stations=500, hours=240, seed=42):
+    rnd = np.random.default_rng(seed)
+    t = np.datetime64('2022-06-01T00:00:00') + np.arange(hours)*np.timedelta64(1, 'h')
+    values = rnd.uniform(0, 100, (n_stations, hours, len(kml_elements)))
+    h = np.arange(hours) % 24
+    bell = np.clip(3000*(1-((h-12.5)/8)**2), 0, None) * ((h >= 5) & (h <= 20))
+    values[:, :, kml_elements.index('Rad1h')] = np.round(bell * rnd.uniform(0.3, 1.0, (n_stations, hours)), 2)
+    values[:, :, kml_elements.index('DD')] = rnd.uniform(0, 360, (n_stations, hours))
+    values[:, ::11, kml_elements.index('Neff')] = np.nan
+    return t, values
+
+def _interpolate_each(t, values):
+    results = []
+    for s in range(values.shape[0]):
+        columns = {'t': t}
+        columns.update({ key: values[s, :, c] for c, key in enumerate(kml_elements) })
+        results.append(csv2csv.interpolate_columns(columns))
+    return results
+
+#many stations: one interpolate_columns call per station vs. interpolate_batch (optionally on a process pool).
+#one untimed run of each first (allocation of the output on first touch), then best of 3.
+def bench_batch():
+    n = 500
+    t, values = synthetic_batch(n)
+    workers = max(2, os.cpu_count() or 1)    #at least 2, so that the pool is checked as well
+    print('# batch: '+str(n)+' stations x '+str(len(t))+' hours x '+str(len(kml_elements))+' columns, 5 min')
+    ref = _interpolate_each(t, values)
+    t_each, _ = timeit(_interpolate_each, t, values)
+    report('interpolate_columns per station', t_each)
+    print('{:>52.0f} stations/s'.format(n/t_each))
+    csv2csv.interpolate_batch(t, values, kml_elements)
+    t_batch, (t_interp, interp) = timeit(csv2csv.interpolate_batch, t, values, kml_elements)
+    report('interpolate_batch', t_batch)
+    print('{:>52.0f} stations/s'.format(n/t_batch))
+    csv2csv.interpolate_batch(t, values, kml_elements, workers=workers)
+    t_pool, (_, interp_pool) = timeit(lambda: csv2csv.interpolate_batch(t, values, kml_elements, workers=workers))
+    report('interpolate_batch ('+str(workers)+' workers)', t_pool)
+    print('{:>52.0f} stations/s'.format(n/t_pool))
+    same = np.array_equal(t_interp, ref[0]['t'])
+    same &= all(np.array_equal(interp[s, :, c], ref[s][key], equal_nan=True) for s in range(n) for c, key in enumerate(kml_elements))
+    check(same, 'interpolate_batch identical to interpolate_columns per station')
+    check(np.array_equal(interp_pool, interp, equal_nan=True), 'process pool identical')
+
+#the scalar sunpos function that csv2pv used before (transcribed from the source referenced there), as reference.
+def sunpos_scalar(when, location, refraction):
+    year, month, day, hour, minute, second, timezone = when
+    latitude, longitude = location
+    rad, deg = math.radians, math.degrees
+    sin, cos, tan = math.sin, math.cos, math.tan
+    asin, atan2 = math.asin, math.atan2
+    rlat = rad(latitude)
+    rlon = rad(longitude)
+    greenwichtime = hour - timezone + minute / 60 + second / 3600
+    daynum = (367 * year - 7 * (year + (month + 9) // 12) // 4 + 275 * month // 9 + day - 730531.5 + greenwichtime / 24)
+    mean_long = daynum * 0.01720279239 + 4.894967873
+    mean_anom = daynum * 0.01720197034 + 6.240040768
+    eclip_long = (mean_long + 0.03342305518 * sin(mean_anom) + 0.0003490658504 * sin(2 * mean_anom))
+    obliquity = 0.4090877234 - 0.000000006981317008 * daynum
+    rasc = atan2(cos(obliquity) * sin(eclip_long), cos(eclip_long))
+    decl = asin(sin(obliquity) * sin(eclip_long))
+    sidereal = 4.894961213 + 6.300388099 * daynum + rlon
+    hour_ang = sidereal - rasc
+    elevation = asin(sin(decl) * sin(rlat) + cos(decl) * cos(rlat) * cos(hour_ang))
+    azimuth = atan2(-cos(decl) * cos(rlat) * sin(hour_ang), sin(decl) - sin(rlat) * sin(elevation))
+    into_range = lambda x, lo, hi: ((((x - lo) % (hi - lo)) + (hi - lo)) % (hi - lo)) + lo
+    azimuth = into_range(deg(azimuth), 0, 360)
+    elevation = into_range(deg(elevation), -180, 180)
+    if refraction:
+        targ = rad((elevation + (10.3 / (elevation + 5.11))))
+        elevation += (1.02 / tan(targ)) / 60
+    return (round(azimuth, 2), round(elevation, 2))
+
+def _sunpos_each(ts):
+    return [ sunpos_scalar((t.year, t.month, t.day, t.hour, t.minute, t.second, 0), csv2pv.location, False) for t in ts ]
+
+def _tiltfactor_each(ts, Neff):
+    return [ csv2pv.calc_tiltfactor(t, n, 270, 20) for t, n in zip(ts, Neff) ]
+
+#a year of 5 minute samples: scalar sunpos/calc_tiltfactor per sample vs. the array variants.
+def bench_sunpos():
+    t64 = np.datetime64('2022-01-01T00:00:00') + np.arange(0, 365*24*12)*np.timedelta64(5, 'm')
+    ts = [ dt.datetime.fromtimestamp(s, dt.timezone.utc) for s in t64.astype(np.int64).tolist() ]
+    Neff = np.random.default_rng(42).uniform(0, 100, len(ts))
+    print('# sunpos: '+str(len(ts))+' samples')
+    t_scalar, ref = timeit(_sunpos_each, ts, repeat=1)
+    t_array, (az, el) = timeit(csv2pv.sunpos_array, t64)
+    ref = np.array(ref)
+    report('sunpos (scalar, per sample)', t_scalar)
+    report('sunpos_array', t_array)
+    dev_az, dev_el = np.max(np.abs(np.mod(az-ref[:, 0]+180, 360)-180)), np.max(np.abs(el-ref[:, 1]))
+    check(dev_az <= 0.01+1e-9 and dev_el <= 0.01+1e-9, 'same as the scalar sunpos (max deviation: azimuth '+str(dev_az)+', elevation '+str(dev_el)+')')
+    n = len(ts)//10
+    t_scalar, ref = timeit(_tiltfactor_each, ts[:n], Neff[:n], repeat=1)
+    t_array, tcf = timeit(csv2pv.calc_tiltfactor_array, t64[:n], Neff[:n], 270, 20)
+    report('calc_tiltfactor ('+str(n)+')', t_scalar)
+    report('calc_tiltfactor_array ('+str(n)+')', t_array)
+    dev = np.max(np.abs(tcf-np.array(ref)))
+    check(dev < 1e-6, 'same as calc_tiltfactor (max deviation '+str(dev)+')')
+
+#solar geometry for a 240h forecast at 1 minute, 10 plants: computed per run vs. looked up in the precomputed table.
+def bench_solar_table():
+    plants = [ (90+20*i, 10+3*i) for i in range(10) ]
+    t = np.datetime64('2022-06-01T00:00') + np.arange(240*60)*np.timedelta64(1, 'm')
+    cache_dir = os.path.join(bench_dir, 'cache')
+    print('# solar geometry: '+str(len(t))+' samples, '+str(len(plants))+' plants')
+    t_build, _ = timeit(csv2pv.load_solar_table, 2022, 1, plants, None, cache_dir, repeat=1)
+    t_calc, ref = timeit(csv2pv.solar_geometry, t, plants, 1, None, cache_dir, False)
+    t_table, res = timeit(csv2pv.solar_geometry, t, plants, 1, None, cache_dir, True)
+    report('load_solar_table (first run: build)', t_build)
+    report('solar_geometry (computed)', t_calc)
+    report('solar_geometry (table lookup)', t_table)
+    check(all(np.array_equal(a, b) for a, b in zip(ref, res)), 'table lookup identical to the computed geometry')
+
+
+#one site, n_arrays on ceil(n_arrays/4) inverters.
+def synthetic_plants(n_arrays):
+    arrays = [ {'name': 'A'+str(i), 'azimut': 90+(i*7)%180, 'elevat': 10+i%40, 'area': 10.0, 'efficiency': 0.2, 'temp_coeff': -0.0037, 'shading': None} for i in range(n_arrays) ]
+    inverters = [ {'name': 'I'+str(k), 'limit': 8000, 'arrays': arrays[k*4:(k+1)*4]} for k in range((n_arrays+3)//4) ]
+    return {'sites': [ {'name': 'Bench', 'location': list(csv2pv.location), 'inverters': inverters} ]}
+
+def bench_plants():
+    t = np.datetime64('2022-06-01T00:00') + np.arange(240)*np.timedelta64(1, 'h')
+    rng = np.random.default_rng(42)
+    Rad1h, Neff, TTT = rng.uniform(0, 3000, len(t)), rng.uniform(0, 100, len(t)), rng.uniform(270, 300, len(t))
+    cache_dir = os.path.join(bench_dir, 'cache')
+    print('# pv model: '+str(len(t))+' samples')
+    for n in [1, 10, 100]:
+        plants = synthetic_plants(n)
+        csv2pv.evaluate_plants(t, Rad1h, Neff, TTT, plants, 5, cache_dir)     #build the solar table first
+        seconds, _ = timeit(csv2pv.evaluate_plants, t, Rad1h, Neff, TTT, plants, 5, cache_dir)
+        report('evaluate_plants, '+str(n)+' arrays', seconds)
+    #the columns plot_my_latest_csv takes from the configuration are the ones evaluate_plants writes.
+    for plants in [None, csv2pv.load_plants('./plants_example.json')]:
+        columns = csv2pv.evaluate_plants(t, Rad1h, Neff, TTT, plants, 5, cache_dir)
+        names = csv2pv.pv_columns(plants)
+        check(sorted(names['E'] + names['P'] + names['T']) == sorted(columns), 'pv_columns '+', '.join(names['P']))
+
+
+#a year of 1-minute samples; the shading variants only differ in the lookup after the tilt factor.
+def bench_shading():
+    t = np.arange(np.datetime64('2022-01-01T00:00'), np.datetime64('2023-01-01T00:00'), np.timedelta64(1, 'm'))
+    az, el = csv2pv.sunpos_array(t)
+    rng = np.random.default_rng(42)
+    horizon = {'horizon': csv2pv.resample_horizon(np.arange(0, 360, 5), rng.uniform(0, 15, 72))}
+    both = dict(horizon, raster=rng.uniform(0, 1, (360, 90)))
+    print('# shading: '+str(len(t))+' samples (one year, 1 minute)')
+    tcf = {}
+    for name, shading in [('none', None), ('rule (225, 17)', (225, 17)), ('horizon profile', horizon), ('horizon+raster', both)]:
+        seconds, tcf[name] = timeit(csv2pv.direct_tiltfactor_array, az, el, 270, 20, shading)
+        report('direct_tiltfactor_array, '+name, seconds)
+    seconds, factor = timeit(csv2pv.shading_factor, az, el, both)
+    report('shading_factor only, horizon+raster', seconds)
+    sel = slice(None, None, 37)
+    ref = np.array([ _shading_python(a, e, both['horizon'], both['raster']) for a, e in zip(az[sel].tolist(), el[sel].tolist()) ])
+    check(np.array_equal(factor[sel], ref), 'shading_factor same as per-sample lookup')
+    check(np.array_equal(tcf['horizon+raster'], tcf['none']*factor), 'horizon+raster: unshaded factor * shading_factor')
+    rule = tcf['none'].copy()
+    rule[(az > 225) & (el < 17)] = 0
+    check(np.array_equal(tcf['rule (225, 17)'], rule), 'rule (225, 17)')
+
+#shading_factor for one sample, plain python: horizon bin and raster cell by truncating az and el.
+def _shading_python(az, el, horizon, raster):
+    factor = 0.0 if el < horizon[int(az*len(horizon)/360.0) % len(horizon)] else 1.0
+    n_az, n_el = raster.shape
+    return factor * raster[int(az*n_az/360.0) % n_az, min(max(int(el*n_el/90.0), 0), n_el-1)]
+
+
+#a refresh of the forecast in which only a few hours changed (one connected Rad1h range and the temperature of the
+#same day): full interpolation + pv evaluation vs. the incremental versions, which reuse the previous run.
+def _full_run(columns, plants, cache_dir):
+    interp = csv2csv.interpolate_columns(columns, 1)
+    return interp, csv2pv.evaluate_plants(interp['t'], interp['Rad1h'], interp['Neff'], interp['TTT'], plants, 1, cache_dir)
+
+def _incremental_run(columns, previous, pv_previous, plants, cache_dir):
+    interp, recomputed = csv2csv.interpolate_incremental(columns, previous, 1)
+    pv, state = csv2pv.evaluate_plants_incremental(interp['t'], interp['Rad1h'], interp['Neff'], interp['TTT'], pv_previous, plants, 1, cache_dir)
+    return interp, pv, state
+
+def bench_incremental():
+    t, values = synthetic_batch(1)
+    cache_dir = os.path.join(bench_dir, 'cache')
+    columns = {'t': t}
+    columns.update({ key: values[0, :, c] for c, key in enumerate(kml_elements) })
+    changed = dict(columns)
+    for key in ['Rad1h', 'TTT']:
+        changed[key] = columns[key].copy()
+    day = slice(24*3+6, 24*3+20)
+    changed['Rad1h'][day] = np.round(changed['Rad1h'][day] * 0.8, 2)
+    changed['TTT'][day] += 1.5
+    print('# incremental refresh: '+str(len(t))+' hours, 1 min, 14 hours of Rad1h/TTT changed')
+    for n in [1, 20]:
+        plants = synthetic_plants(n)
+        interp, _, pv_state = _incremental_run(columns, None, None, plants, cache_dir)
+        t_full, (ref, ref_pv) = timeit(_full_run, changed, plants, cache_dir)
+        report('full, '+str(n)+' arrays', t_full)
+        t_inc, (res, res_pv, state) = timeit(_incremental_run, changed, (columns, interp), pv_state, plants, cache_dir)
+        report('incremental, '+str(n)+' arrays', t_inc)
+        t_none, _ = timeit(_incremental_run, columns, (columns, interp), pv_state, plants, cache_dir)
+        report('incremental, nothing changed, '+str(n)+' arrays', t_none)
+        same = all(np.array_equal(ref[key], res[key], equal_nan=True) for key in ref if key != 't')
+        same &= all(np.array_equal(ref_pv[key], res_pv[key], equal_nan=True) for key in ref_pv)
+        print('samples evaluated: '+str(int(state['evaluated'].sum()))+' of '+str(len(state['evaluated'])))
+        check(same, 'incremental identical to full')
+
+#stage output round trip: 240 h x 16 columns on the 5 minute grid (the refined file), written and read again.
+def _roundtrip(filename, data, columns_only=False):
+    csv2csv.save_data(filename, data)
+    if columns_only:
+        return csv2csv.load_data_columns(filename, kml_elements, ['t', 'tLocal'])
+    return csv2csv.load_data(filename, kml_elements, ['t', 'tLocal'])
+
+def bench_storage():
+    data = csv2csv.addlocaldate(csv2csv.interpolate(synthetic_rows(240)))
+    os.makedirs(bench_dir, exist_ok=True)
+    print('# storage: '+str(len(data))+' rows x '+str(len(data[0]))+' columns (240 h, 5 min)')
+    formats = ['.csv', '.npy']
+    try:
+        import pyarrow
+        formats += ['.parquet', '.feather']
+    except ImportError:
+        print('(pyarrow not installed: no parquet/feather)')
+    for ext in formats:
+        filename = os.path.join(bench_dir, 'storage'+ext)
+        seconds, _ = timeit(_roundtrip, filename, data)
+        report('save_data + load_data '+ext, seconds)
+        seconds, _ = timeit(_roundtrip, filename, data, True)
+        report('save_data + load_data_columns '+ext, seconds)
+        seconds, _ = timeit(csv2csv.load_data_columns, filename, kml_elements, ['t', 'tLocal'])
+        report('load_data_columns '+ext, seconds)
+        print('{:>48.0f} kB'.format(os.path.getsize(filename)/1024))
+        #power as int with '-' where Rad1h is missing (as csv2pv.add_columns writes it): numbers again after loading.
+        t0 = dt.datetime(2022, 9, 1, tzinfo=dt.timezone.utc)
+        rows = [ {'t': t0 + dt.timedelta(minutes=5*i), 'Rad1h': v if v == '-' else float(v), 'pvWestP': v} for i, v in enumerate([0, 604, '-', 1200, '-']) ]
+        filename = os.path.join(bench_dir, 'storage_gaps'+ext)
+        csv2csv.save_data(filename, rows)
+        loaded = csv2csv.load_data(filename, ['Rad1h', 'pvWestP'])
+        check([ line['pvWestP'] for line in loaded ] == [0.0, 604.0, '-', 1200.0, '-'], ext+': int column with gaps stays numeric')
+        columns = csv2csv.load_data_columns(filename, ['Rad1h', 'pvWestP'])
+        check(columns['pvWestP'].dtype == np.float64 and np.array_equal(columns['pvWestP'], [0, 604, np.nan, 1200, np.nan], equal_nan=True), ext+': float64 column, NaN for -')
+
+
+#reading the refined csv (t and tLocal per row): dateutil per cell, as parse did it before, vs. parse_dates.
+def _parse_dateutil(content, floatColumns, dateColumns):
+    import dateutil.parser as dp
+    csv_data = csv2csv.split(content)
+    for linedict in csv_data:
+        for el in dateColumns:
+            linedict[el] = dp.parse(linedict[el])
+        for el in floatColumns:
+            try:
+                linedict[el] = float(linedict[el])
+            except:
+                continue
+    return csv_data
+
+def bench_parse():
+    data = csv2csv.addlocaldate(csv2csv.interpolate(synthetic_rows(240)))
+    os.makedirs(bench_dir, exist_ok=True)
+    filename = os.path.join(bench_dir, 'refined.csv')
+    csv2csv.save(filename, data)
+    content = csv2csv.load(filename)
+    print('# parse: refined csv, '+str(len(data))+' rows, dateColumns t and tLocal')
+    t_old, ref = timeit(_parse_dateutil, content, kml_elements, ['t', 'tLocal'])
+    report('dateutil per cell', t_old)
+    t_new, res = timeit(lambda: csv2csv.parse(csv2csv.split(content), kml_elements, ['t', 'tLocal']))
+    report('parse (fromisoformat per column)', t_new)
+    check(ref == res, 'identical to dateutil')
+
+
+#many stations combined per site: weighted mean of all float columns, one hour missing in every other station.
+def bench_merge():
+    n = 50
+    datasets = [ synthetic_rows(240, seed) for seed in range(n) ]
+    for k in range(1, n, 2):
+        del datasets[k][k]
+    weights = csv2csv.inverse_distance_weights(np.arange(1, n+1))
+    print('# merge: '+str(n)+' stations x 240 hours x '+str(len(kml_elements))+' columns')
+    seconds, rows = timeit(csv2csv.merge_stations, datasets, kml_elements, weights, repeat=1)
+    report('merge_stations', seconds)
+    print(str(len(rows))+' rows')
+    _check_merge_gap()
+
+#two Rad1h stations with staggered hours (one without hours 30..40, the other without 36..50 and every other hour of
+#100..110) onto a base station without Rad1h: 36..40 have no Rad1h at all. interpolate must not fail on that, the
+#samples of these hours are '-', everything else is the same as with 0 there (NaN breaks the fit like a 0).
+def _check_merge_gap():
+    a, b, base = synthetic_rows(240, 1), synthetic_rows(240, 2), synthetic_rows(240, 3)
+    a = [ line for i, line in enumerate(a) if not 30 <= i <= 40 ]
+    b = [ line for i, line in enumerate(b) if not 36 <= i <= 50 ]
+    for line in a[90:110:2] + b[85:95:2]:
+        line['Rad1h'] = '-'
+    for line in base:
+        line['Rad1h'] = '-'
+    data = csv2csv.overwrite(base, csv2csv.merge_stations([a, b], ['Rad1h']), ['Rad1h'])
+    gap = [ i for i, line in enumerate(data) if line['Rad1h'] == '-' ]
+    check(gap == list(range(36, 41)), 'merged Rad1h: no value for hours 36..40 only')
+    interp = csv2csv.interpolate(data)
+    zero = csv2csv.interpolate([ dict(line, Rad1h=0.0) if line['Rad1h'] == '-' else line for line in data ])
+    nan = [ i for i, line in enumerate(interp) if line['Rad1h'] == '-' ]
+    check(nan == list(range(35*12, 40*12)), 'interpolated Rad1h: \'-\' for the samples of hours 36..40')
+    check(all(l1['Rad1h'] == l2['Rad1h'] for l1, l2 in zip(interp, zero) if l1['Rad1h'] != '-'), 'all other samples as with 0 in the gap')
+
+
+#nearest stations for many plant locations: KD-tree on the unit sphere vs. haversine to every station.
+def bench_stations():
+    rng = np.random.default_rng(42)
+    n, m, k = 6000, 10000, 3
+    lat, lon = rng.uniform(-60, 75, n), rng.uniform(-180, 180, n)
+    catalog = stationcatalog.StationCatalog([ 'S'+str(i) for i in range(n) ], ['']*n, lat, lon, np.zeros(n), ['Rad1h'], rng.random((n, 1)) < 0.3)
+    qlat, qlon = rng.uniform(47, 55, m), rng.uniform(6, 15, m)
+    print('# stations: '+str(n)+' stations, '+str(m)+' locations, k='+str(k)+' offering Rad1h')
+    t_build, _ = timeit(lambda: stationcatalog.StationCatalog(catalog.ids, catalog.names, lat, lon, catalog.elevation, ['Rad1h'], catalog.offers)._tree('Rad1h'), repeat=1)
+    report('build index', t_build)
+    t_tree, (ids, dist) = timeit(catalog.nearest, qlat, qlon, k, 'Rad1h')
+    report('nearest, all locations', t_tree)
+    print('{:>48.1f} us/location'.format(t_tree/m*1e6))
+    sel = catalog.offers[:, 0]
+    def brute():
+        d = stationcatalog.haversine_km(qlat[:, None], qlon[:, None], lat[sel][None, :], lon[sel][None, :])
+        return np.sort(d, axis=1)[:, :k]
+    t_brute, ref = timeit(brute, repeat=1)
+    report('haversine to every station', t_brute)
+    check(np.allclose(ref, dist), 'same distances as haversine to every station')
+    _check_catalog_cache(lat, lon, catalog.offers[:, 0])
+
+#mosmix_stations.cfg layout (fixed columns, degrees and minutes) and a stationoffers csv, for the stations given.
+def write_station_cfg(filename, lat, lon):
+    degmin = lambda v: np.sign(v)*(np.trunc(np.abs(v)) + np.round((np.abs(v) % 1)*60)/100)
+    with open(filename, 'w') as file:
+        file.write('TABLE NAME\n'+'='*80+'\n')
+        for i, (la, lo) in enumerate(zip(degmin(lat).tolist(), degmin(lon).tolist())):
+            file.write('{:<12s}{:<6s}{:5s}{:<20s} {:7.2f}{:8.2f} {:5d}\n'.format('', 'S'+str(i), '', 'STATION'+str(i), la, lo, 100))
+
+def write_stationoffers(filename, elements, offers):
+    with open(filename, 'w') as file:
+        file.write(';'.join(['stationid'] + elements)+'\n')
+        for i, row in enumerate(offers):
+            file.write(';'.join(['S'+str(i)] + [ '1' if o else '0' for o in row ])+'\n')
+
+#stationcatalog.catalog keeps the parsed catalogue as npz: it must only be reused for the same cfg and offers file.
+def _check_catalog_cache(lat, lon, offers):
+    directory = fresh_dir('catalog')
+    cfg, csv_offers, npz = [ os.path.join(directory, name) for name in ['mosmix_stations.cfg', 'stationoffers.csv', 'stations.npz'] ]
+    write_station_cfg(cfg, lat, lon)
+    write_stationoffers(csv_offers, ['Rad1h'], offers[:, None])
+    t_parse, cat = timeit(stationcatalog.catalog, cfg, None, npz, repeat=1)
+    report('catalog (parse cfg)', t_parse)
+    check(len(cat) == len(lat) and cat.elements == [], 'catalog without offers')
+    t_cached, cat = timeit(stationcatalog.catalog, cfg, csv_offers, npz, repeat=1)
+    check(cat.elements == ['Rad1h'] and np.array_equal(cat.offers[:, 0], offers), 'cached without offers, asked with: built again')
+    check(len(cat.nearest(50, 10, 2, 'Rad1h')[0]) == 2, 'nearest station offering Rad1h')
+    t_cached, cat = timeit(stationcatalog.catalog, cfg, csv_offers, npz)
+    report('catalog (cached npz)', t_cached)
+    check(cat.elements == ['Rad1h'] and np.array_equal(cat.offers[:, 0], offers), 'same inputs: from the cache')
+    write_stationoffers(csv_offers, ['Rad1h', 'TTT'], np.stack((~offers, offers), axis=1))
+    os.utime(csv_offers, (os.path.getmtime(npz)+10, os.path.getmtime(npz)+10))
+    cat = stationcatalog.catalog(cfg, csv_offers, npz)
+    check(cat.elements == ['Rad1h', 'TTT'] and np.array_equal(cat.offers[:, 0], ~offers), 'changed offers file: built again')
+    check(stationcatalog.catalog(cfg, None, npz).elements == [], 'offers no longer given: built again')
+
+
+#reverse geocoding of ~6000 stations: country polygons (natural earth, if in ./data, else synthetic ones of similar size)
+#with bounding box prefilter and vectorized ray casting, checked against a plain python ray casting.
+def synthetic_countries(n=240, vertices=400, seed=42):
+    rng = np.random.default_rng(seed)
+    features = []
+    phi = np.linspace(0, 2*np.pi, vertices, endpoint=False)
+    for i in range(n):
+        clat, clon = -60 + (i // 20) * 11 + 5, -180 + (i % 20) * 18 + 9
+        r = rng.uniform(2, 5) * (1 + 0.3*np.sin(rng.integers(3, 9)*phi + rng.uniform(0, 6)))
+        ring = np.stack((clon + 1.6*r*np.cos(phi), clat + r*np.sin(phi)), axis=1)
+        features.append(('c'+str(i), 'Country '+str(i), 'Europe', [ring]))
+    return features
+
+def _inside_python(x, y, ring):
+    inside = False
+    for j in range(len(ring)):
+        x0, y0 = ring[j-1]
+        x1, y1 = ring[j]
+        if (y0 > y) != (y1 > y) and x < (x1-x0)*(y-y0)/(y1-y0) + x0:
+            inside = not inside
+    return inside
+
+def bench_geolookup():
+    filename = './data/ne_50m_admin_0_countries.geojson'
+    if os.path.exists(filename):
+        t_build, index = timeit(geolookup.load_countries, filename, repeat=1)
+        source = filename
+    else:
+        features = synthetic_countries()
+        t_build, index = timeit(geolookup.CountryIndex, features, repeat=1)
+        source = 'synthetic'
+    rng = np.random.default_rng(42)
+    n = 6000
+    lat, lon = rng.uniform(-60, 75, n), rng.uniform(-180, 180, n)
+    print('# geolookup: '+str(n)+' stations, '+str(len(index.features))+' countries ('+source+'), '+str(sum(len(e) for e in index.edges))+' edges')
+    report('load/build index', t_build)
+    t_pip, found = timeit(index.contains, lat, lon)
+    report('point in polygon, all stations', t_pip)
+    t_all, _ = timeit(index.resolve, lat, lon)
+    report('incl. nearest border fallback', t_all)
+    if source == 'synthetic':
+        m = 300
+        ref = np.full(m, -1)
+        for i in range(m):
+            for f, (cc, country, continent, rings) in enumerate(features):
+                if _inside_python(lon[i], lat[i], rings[0]):
+                    ref[i] = f
+                    break
+        check(np.array_equal(ref, found[:m]), 'same as python ray casting')
+    print('stations in a country: '+str(np.count_nonzero(found >= 0)))
+    import warnings
+    geolookup._warned_no_countries = False
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        places = geolookup.resolve(lat[:10], lon[:10]) + geolookup.resolve(lat[10:20], lon[10:20])
+    check(len(caught) == 1 and 'no country polygons' in str(caught[0].message), 'without polygons: warned once')
+    check(places == [('-', '-', '-')]*20, 'without polygons: \'-\'')
+    #station_cfg_to_umap_csv without polygons: nominatim for every station (here a stand-in, no network), as before.
+    directory = fresh_dir('geolookup')
+    cfg = os.path.join(directory, 'mosmix_stations.cfg')
+    with open(cfg, 'w') as file:
+        for ids, nam, lat, lon in [('10836', 'STOETTEN', '48.40', '9.52'), ('10850', 'UELM', '48.23', '9.57'), ('Q491', 'GUENZBURG', '48.27', '10.16')]:
+            file.write(' '*12 + ids.ljust(11) + nam.ljust(21) + lat.rjust(7) + lon.rjust(8) + '\n')
+    asked = []
+    online_lookup = geolookup.online_lookup
+    geolookup.online_lookup = lambda lat, lon: asked.append((lat, lon)) or ('de', 'Germany', 'Europe')
+    try:
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter('always')
+            stationlist2csv.station_cfg_to_umap_csv(cfg, os.path.join(directory, 'online.csv'), None, os.path.join(directory, 'missing.geojson'), filename_cache=None)
+            stationlist2csv.station_cfg_to_umap_csv(cfg, os.path.join(directory, 'offline.csv'), None, os.path.join(directory, 'missing.geojson'), False, None)
+    finally:
+        geolookup.online_lookup = online_lookup
+    with open(os.path.join(directory, 'online.csv')) as file:
+        lines = file.read().splitlines()
+    check(len(asked) == 3 and [ line.split(';')[6] for line in lines[1:] ] == ['Europe']*3, 'without polygons: online lookup for every station')
+    try:
+        import pandas
+    except ImportError:
+        print('(pandas not installed: filter_stations not checked)')
+        return
+    try:
+        stationlist2csv.filter_stations(os.path.join(directory, 'offline.csv'), os.path.join(directory, 'filtered.csv'))
+        refused = False
+    except Exception as e:
+        refused = 'continent' in str(e)
+    check(refused and not os.path.exists(os.path.join(directory, 'filtered.csv')), 'filter_stations: no empty output without continents')
+
+
+#station offers (any/all values per station and element) on an all_stations sized file:
+#xml parser + python loop over every value string (as before) vs. raw scan + vectorized presence matrix.
+def _stationoffers_loop(filename, elements):
+    timestamps, stationValues = dwd2csv.parseKML_stream(filename, elements)
+    stations = {}
+    for stationName, stationData in stationValues.items():
+        stationDict = {}
+        for el in elements:
+            dataExistsOnce = False
+            dataExistsAll = len(stationData[el]) > 0
+            for val in stationData[el]:
+                if val != '-':
+                    dataExistsOnce = True
+                else:
+                    dataExistsAll = False
+            stationDict[el] = (dataExistsOnce, dataExistsAll)
+        stations[stationName] = stationDict
+    return stations
+
+def bench_stationoffers():
+    filename = synthetic_kml()
+    for elements in [['Rad1h'], kml_elements]:
+        print('# stationoffers: '+filename+', '+str(len(elements))+' elements')
+        t_loop, ref = timeit(_stationoffers_loop, filename, elements, repeat=1)
+        report('parseKML_stream + loop', t_loop)
+        t_scan, offers = timeit(stationlist2csv.mosmix_stationoffers, elements, None, filename, repeat=1)
+        report('mosmix_stationoffers (scan)', t_scan)
+        check(ref == offers, 'same offers')
+
+
+#cold start of the entry points (what a cron job pays before any work is done): python -X importtime in a fresh
+#interpreter, best of repeat. heavy: which of the big optional packages got imported along.
+heavy_modules = ['matplotlib', 'pandas', 'scipy', 'requests', 'geopy', 'country_converter']
+entry_modules = ['dwd2csv', 'csv2csv', 'csv2pv', 'stationlist2csv', 'pipeline', 'mosmixd']
+
+def import_time(module, repeat=3):
+    import subprocess
+    best = None
+    for i in range(repeat):
+        stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import '+module], capture_output=True, text=True).stderr
+        times = {}
+        for line in stderr.splitlines():
+            parts = line.split('|')
+            if len(parts) == 3 and parts[1].strip().isdigit():
+                times[parts[2].strip()] = int(parts[1])
+        if best is None or times.get(module, 0) < best[0]:
+            best = (times.get(module, 0), [ m for m in heavy_modules if m in times ])
+    return best
+
+def bench_startup():
+    print('# startup: python -X importtime -c "import <module>", cumulative, best of 3')
+    for module in entry_modules:
+        us, heavy = import_time(module)
+        report(module, us/1e6)
+        print('{:>48s}'.format('heavy: '+(', '.join(heavy) or '-')))
+
+
+#the whole chain for one site (2 Rad1h stations + base station, 16 elements, 240 h, pv at 5 min), from a local kmz:
+#as the scripts do it (csv per station >>> refined csv >>> pvest csv, each stage parsing the file of the one before)
+#vs. pipeline.run (columns passed on in ram, only the pvest file is written).
+def _file_chain(kmz, stations, start, directory):
+    ids = pipeline.needed_stations(stations)
+    timestamps, stationValues = dwd2csv.parseKML_stream(dwd2csv.open_kmz(kmz), kml_elements, ids)
+    filenames = {}
+    for station in ids:
+        filenames[station] = os.path.join(directory, 'mosmix_'+station+'.csv')
+        dwd2csv.save_station(filenames[station], station, timestamps, stationValues[station])
+    date_start, date_end = pipeline.horizon(3, start)
+    rad_ids, rad_weights = stations['Rad1h']
+    dataRad1h = csv2csv.merge_stations([ csv2csv.load_data(filenames[station], ['Rad1h']) for station in rad_ids ], ['Rad1h'], rad_weights)
+    dataBase = csv2csv.load_data(filenames[stations['base']], kml_elements)
+    data = csv2csv.limit(csv2csv.overwrite(dataBase, dataRad1h, ['Rad1h']), date_start, date_end)
+    data = csv2csv.addlocaldate(csv2csv.interpolate(data))
+    csv2csv.save_data(os.path.join(directory, 'mosmix_refined.csv'), data)
+    data = csv2csv.load_data(os.path.join(directory, 'mosmix_refined.csv'), ['Rad1h','Neff','N','DD','FF','PPPP','TTT'], ['t', 'tLocal'])
+    data = csv2pv.add_pv_power_array(data)
+    csv2csv.save_data(os.path.join(directory, 'mosmix_pvest.csv'), data)
+    return data
+
+def bench_pipeline():
+    filename = os.path.join(bench_dir, 'MOSMIX_synthetic_3_240.kml')
+    if not os.path.exists(filename):
+        make_synthetic_kml(filename, n_stations=3, n_steps=240)
+    kmz = filename[:-4] + '.kmz'
+    if not os.path.exists(kmz):
+        make_synthetic_kmz(filename)
+    stations = {'Rad1h': ([station_id(0), station_id(2)], None), 'base': station_id(1)}
+    start = dt.datetime(2022, 9, 2)
+    print('# pipeline: '+kmz+', 3 stations, '+str(len(kml_elements))+' elements, 3 days at 5 min')
+    t_files, rows = timeit(_file_chain, kmz, stations, start, bench_dir)
+    report('stages via csv files', t_files)
+    t_mem, result = timeit(pipeline.run, stations, None, 5, 3, start, [kmz], 'L', kml_elements)
+    report('pipeline.run (no files)', t_mem)
+    for ext in ['.npy', '.csv']:
+        out = os.path.join(bench_dir, 'pipeline_pvest'+ext)
+        t_out, _ = timeit(pipeline.run, stations, None, 5, 3, start, [kmz], 'L', kml_elements, None, None, out)
+        report('pipeline.run (pvest '+ext+')', t_out)
+    p = np.array([ np.nan if isinstance(line['pvWestP'], str) else line['pvWestP'] for line in rows ])
+    check(len(p) == len(result['pvWestP']), 'same samples')
+    dev = np.nanmax(np.abs(p - result['pvWestP']))
+    check(dev <= 1, 'same pvWestP (max deviation '+str(dev)+' W, csv rounds the refined inputs)')
+    bench_pipeline_fixture()
+
+#the committed fixture (see make_fixture_kmz) end to end, as in the README: the default stations, --start 2022-09-01.
+#where no station has Rad1h the result is NaN (no fit across the gap), everywhere else it is a number.
+def bench_pipeline_fixture():
+    import contextlib
+    kmz = make_fixture_kmz()
+    stations = csv2csv.default_stations
+    start = dt.datetime(2022, 9, 1)
+    print('# pipeline: '+os.path.relpath(kmz)+', default stations, 3 days at 5 min')
+    rows = _file_chain(kmz, stations, start, fresh_dir('pipeline_fixture'))
+    result = pipeline.run(stations, None, 5, 3, start, [kmz], 'L', kml_elements)
+    p = np.array([ np.nan if isinstance(line['pvWestP'], str) else line['pvWestP'] for line in rows ])
+    check(len(p) == len(result['pvWestP']) and np.array_equal(np.isnan(p), np.isnan(result['pvWestP'])), 'fixture: same samples, same gaps')
+    check(np.nanmax(np.abs(p - result['pvWestP'])) <= 1, 'fixture: same pvWestP')
+    #the pv result of the rows (power as int, '-' without Rad1h) through .npy and back.
+    filename = os.path.join(bench_dir, 'pipeline_fixture', 'mosmix_pvest.npy')
+    csv2csv.save_data(filename, rows)
+    loaded = csv2csv.load_data(filename)
+    check(columnstore.load_columns(filename)['pvWestP'].dtype == np.float64 and
+          [ line['pvWestP'] for line in loaded ] == [ v if v == '-' else float(v) for v in (line['pvWestP'] for line in rows) ], 'fixture: pv result with gaps through .npy')
+    t = result['t']
+    gap = (t > np.datetime64('2022-09-03T09:00')) & (t <= np.datetime64('2022-09-03T14:00'))
+    nan = np.isnan(result['Rad1h'])
+    check(nan.any() and not nan[~gap].any(), 'fixture: Rad1h NaN only where no station has it ('+str(nan.sum())+' samples)')
+    check(np.array_equal(np.isnan(result['pvWestP']), nan) and np.nanmax(result['pvWestP']) > 0, 'fixture: pv follows Rad1h')
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        pipeline.main(['--kmz', kmz, '--start', '2022-09-01'])
+    check(out.getvalue().replace('\r\n', '\n') == pipeline.to_csv(result).replace('\r\n', '\n'), 'fixture: pipeline.py --kmz ... --start 2022-09-01')
+    #--site without station offers: a clear error instead of "'Rad1h' is not in list".
+    missing = os.path.join(bench_dir, 'pipeline_fixture', 'stationoffers.csv')
+    errors = []
+    for site in [lambda: pipeline.main(['--site', '48.4', '9.9', '--offers', missing, '--kmz', kmz]),
+                 lambda: csv2csv.site_stations(stationcatalog.StationCatalog(['10836', 'Q491'], ['A', 'B'], [48.4, 48.45], [9.87, 10.27], [0, 0]), 48.4, 9.9)]:
+        try:
+            site()
+            errors.append('')
+        except Exception as e:
+            errors.append(str(e))
+    check('station offers' in errors[0] and missing in errors[0], '--site without offers file: '+errors[0])
+    check('station offers' in errors[1] and 'Rad1h' in errors[1], 'catalogue without offers: '+errors[1])
+
+
+#mosmixd against the local server: a first refresh runs the pipeline (same result as pipeline.run on the served kmz
+#files), the second only gets 304s. the http endpoints serve that result; in run_daemon a missing station is counted
+#as an error.
+def bench_daemon():
+    import json
+    import threading
+    import urllib.request
+    import mosmixd
+    stations = { 'Rad1h': ([station_id(0), station_id(2)], None), 'base': station_id(1) }
+    ids = pipeline.needed_stations(stations)
+    directory = synthetic_server_tree(ids, name='server_daemon', missing_every=0)
+    server, base_url = serve_directory(directory)
+    cache_dir = fresh_dir('daemon_cache')
+    start = dt.datetime(2022, 9, 2)
+    print('# daemon: '+str(len(ids))+' stations from a local http server, 3 days at 5 min')
+    try:
+        service = mosmixd.ForecastService(pipeline.Pipeline(stations, None, 5, 3, cache_dir), 'L', kml_elements, None, cache_dir, base_url)
+        t_new, updated = timeit(service.refresh, start, repeat=1)
+        report('refresh (new run)', t_new)
+        check(updated and service.runs == 1, 'first refresh: new result')
+        kmz_files = [ os.path.join(directory, 'MOSMIX_L', 'single_stations', s, 'kml', 'MOSMIX_L_LATEST_'+s+'.kmz') for s in ids ]
+        expected = pipeline.run(stations, None, 5, 3, start, kmz_files, 'L', kml_elements, cache_dir=cache_dir)
+        check(sorted(expected) == sorted(service.latest) and all(np.array_equal(expected[k], service.latest[k], equal_nan=expected[k].dtype.kind == 'f') for k in expected),
+              'same result as pipeline.run on the served files')
+        check(not np.isnan(service.latest['Rad1h']).all(), 'Rad1h from the served files')
+        t_poll, updated = timeit(service.refresh, start, repeat=1)
+        report('refresh (304)', t_poll)
+        check(not updated and service.runs == 1 and service.cache.stats()['hits'] == len(ids), 'second refresh: 304, no new run '+str(service.cache.stats()))
+        http = mosmixd.make_server(service, port=0)
+        threading.Thread(target=http.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:'+str(http.server_address[1])
+        try:
+            status = json.loads(urllib.request.urlopen(url+'/status').read())
+            check(status['runs'] == 1 and status['errors'] == 0, '/status')
+            check(urllib.request.urlopen(url+'/forecast.csv').read().decode('utf-8') == pipeline.to_csv(service.latest), '/forecast.csv')
+            check(len(json.loads(urllib.request.urlopen(url+'/forecast').read())['t']) == len(service.latest['t']), '/forecast')
+        finally:
+            http.shutdown()
+            http.server_close()
+        missing = { 'Rad1h': ([station_id(0), station_id(98)], None), 'base': station_id(1) }
+        failing = mosmixd.ForecastService(pipeline.Pipeline(missing, None, 5, 3, cache_dir), 'L', kml_elements, None, cache_dir, base_url)
+        stop = threading.Event()
+        thread = threading.Thread(target=mosmixd.run_daemon, args=(failing, 0, 0.05, 24*60, stop))
+        thread.start()
+        for _ in range(100):
+            if failing.snapshot()[1]['errors'] >= 2:
+                break
+            time.sleep(0.05)
+        stop.set()
+        thread.join()
+        latest, status = failing.snapshot()
+        check(latest is None and status['errors'] >= 2 and '404' in status['last_error'], 'run_daemon: missing station counted as error, retried')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+#90 days of MOSMIX_L runs (4 a day, 5 stations, as download_kml saves them) and the question
+#"Rad1h of one station, valid in one month, lead 24-48 h": parse all kmz files again vs. the archive.
+def archive_snapshots(days=90, n_stations=5, name='archive_kmz', values=None):
+    directory = os.path.join(bench_dir, name)
+    os.makedirs(directory, exist_ok=True)
+    filenames = []
+    for k in range(days*4):
+        t0 = dt.datetime(2022, 3, 1, 4, tzinfo=dt.timezone.utc) + dt.timedelta(hours=6*k)
+        filename = os.path.join(directory, 'MOSMIX_L_LATEST_'+(t0 + dt.timedelta(hours=2)).strftime('%Y%m%d_%H%M')+'.kmz')
+        if not os.path.exists(filename):
+            make_synthetic_kml(filename[:-4]+'.kml', n_stations, 240, t0=t0, seed=k, values=values)
+            make_synthetic_kmz(filename[:-4]+'.kml')
+            os.remove(filename[:-4]+'.kml')
+        filenames.append(filename)
+    return filenames
+
+def _query_files(filenames, station, valid, lead_hours):
+    parts = []
+    for filename in filenames:
+        timestamps, stationArrays = dwd2csv.scanKML_columnar(filename, ['Rad1h'], [station])
+        issue = dwd2csv.kml_issue_time(filename)
+        lead = (timestamps - issue).astype(np.float64) / 3600
+        m = (timestamps >= valid[0]) & (timestamps < valid[1]) & (lead >= lead_hours[0]) & (lead <= lead_hours[1])
+        parts.append(stationArrays[station][0][m])
+    return np.concatenate(parts)
+
+def bench_archive():
+    filenames = archive_snapshots()
+    store = os.path.join(bench_dir, 'archive')
+    if os.path.exists(store):
+        shutil.rmtree(store)
+    kmz_mb = sum(os.path.getsize(f) for f in filenames)/2**20
+    print('# archive: '+str(len(filenames))+' kmz files, 5 stations, '+str(len(kml_elements))+' elements ('+str(round(kmz_mb, 1))+' MB)')
+    store = archive.Archive(store, kml_elements)
+    t_ingest, stats = timeit(store.ingest, filenames, repeat=1)
+    report('ingest', t_ingest)
+    chunks = os.path.join(store.archive_dir, 'chunks')
+    store_mb = (os.path.getsize(store.index_filename) + sum(os.path.getsize(os.path.join(chunks, f)) for f in os.listdir(chunks)))/2**20
+    print('{:>48s}'.format(str(stats['rows'])+' rows, '+str(stats['chunks'])+' chunks, '+str(round(store_mb, 1))+' MB'))
+    station, valid, lead_hours = station_id(3), (np.datetime64('2022-04-01'), np.datetime64('2022-05-01')), (24, 48)
+    t_files, ref = timeit(_query_files, filenames, station, valid, lead_hours, repeat=1)
+    report('parse all kmz files', t_files)
+    t_query, columns = timeit(store.query, [station], ['Rad1h'], valid, None, lead_hours)
+    report('archive.query', t_query)
+    got = columns['Rad1h'][np.lexsort((columns['valid'], columns['issue']))]
+    check(len(got) == len(ref) and np.allclose(got, ref, equal_nan=True, atol=0.01), 'same values ('+str(len(got))+')')
+    bench_archive_broken(filenames[0])
+
+#a snapshot that arrived truncated (kml cut in the middle, or the kmz itself cut): not recorded, and the good file of the
+#same name is taken on the next ingest.
+def bench_archive_broken(filename):
+    directory = fresh_dir('archive_broken')
+    name = os.path.basename(filename)
+    with ZipFile(filename) as z:
+        kml = z.read(z.namelist()[0])
+    store = archive.Archive(os.path.join(directory, 'archive'), kml_elements)
+    cut_kml = os.path.join(directory, 'cut_kml', name)
+    os.makedirs(os.path.dirname(cut_kml))
+    with ZipFile(cut_kml, 'w', ZIP_DEFLATED) as z:
+        z.writestr(name[:-4]+'.kml', kml[:kml.find(b'</kml:Placemark>', len(kml)//2) + len('</kml:Placemark>')])
+    cut_kmz = os.path.join(directory, 'cut_kmz', name)
+    os.makedirs(os.path.dirname(cut_kmz))
+    with open(filename, 'rb') as src, open(cut_kmz, 'wb') as dst:
+        dst.write(src.read()[:os.path.getsize(filename)//2])
+    for broken in [cut_kml, cut_kmz]:
+        stats = store.ingest([broken])
+        check(stats['files'] == 0 and stats['runs'] == 0 and not store.sources() and len(store.index()) == 0,
+              'truncated '+os.path.basename(os.path.dirname(broken))[4:]+': not recorded')
+    stats = store.ingest([filename])
+    check(stats['files'] == 1 and stats['runs'] == 5 and store.sources() == {name}, 'the good file afterwards: ingested')
+
+#one year at 5 min (105120 samples), hourly inputs from a simple clear sky * cloud model, and a "measured" log made
+#with other parameters (plus noise): the scalar model per sample vs. one vectorized evaluation, the fit, and a sweep.
+def synthetic_year(seed=42):
+    rng = np.random.default_rng(seed)
+    t = np.arange(np.datetime64('2022-01-01T00:00:00'), np.datetime64('2023-01-01T01:00:00'), np.timedelta64(1, 'h'))
+    az, el = csv2pv.sunpos_array(t - np.timedelta64(30, 'm'))
+    cloud = np.clip(np.repeat(rng.uniform(0, 100, len(t)//24+1), 24)[:len(t)] + rng.normal(0, 15, len(t)), 0, 100)
+    Rad1h = np.round(np.where(el > 0, 3600*np.sin(np.radians(np.maximum(el, 0)))*(1-0.7*cloud/100), 0), 2)
+    Neff = np.where(rng.random(len(t)) < 0.03, np.nan, np.round(cloud, 1))
+    TTT = 283.15 - 12*np.cos(2*np.pi*(t - t[0]).astype(np.float64)/(365*86400)) + 5*np.sin(np.radians(np.maximum(el, 0)))
+    return csv2csv.interpolate_columns({'t': t, 'Rad1h': Rad1h, 'Neff': Neff, 'TTT': TTT}, 5)
+
+def _calc_pvpower_each(t, Rad1h, Neff, TTT):
+    return [ csv2pv.calc_pvpower(ts, r, n, T) for ts, r, n, T in zip(t, Rad1h, Neff, TTT) ]
+
+def bench_backtest():
+    inputs = synthetic_year()
+    t, Rad1h, Neff, TTT = inputs['t'], inputs['Rad1h'], inputs['Neff'], inputs['TTT']
+    true = {'efficiency': 0.17, 'temp_coeff': -0.0045, 'eps': 0.7, 'diffuse_default': 0.35}
+    plants = csv2pv.default_plants
+    measured_plants = backtest.Backtest(t, Rad1h, Neff, TTT, {}, plants).with_parameters(list(true.values()))
+    measured = csv2pv.evaluate_plants(t, Rad1h, Neff, TTT, measured_plants)
+    measured = {'pvWestP': measured['pvWestP'] + np.random.default_rng(1).normal(0, 20, len(t))}
+    print('# backtest: one year at 5 min ('+str(len(t))+' samples), plant West')
+    n = 2000
+    t_scalar, _ = timeit(_calc_pvpower_each, csv2csv.to_datetime(t[:n]), Rad1h[:n], np.nan_to_num(Neff[:n], nan=-1), TTT[:n], repeat=1)
+    report('calc_pvpower per sample (extrapolated)', t_scalar*len(t)/n)
+    t_init, bt = timeit(backtest.Backtest, t, Rad1h, Neff, TTT, measured, plants, repeat=1)
+    report('Backtest (sun geometry)', t_init)
+    t_predict, _ = timeit(bt.predict)
+    report('Backtest.predict', t_predict)
+    t_fit, (fitted, x) = timeit(bt.fit, repeat=1)
+    report('Backtest.fit (4 parameters)', t_fit)
+    print('{:>48s}'.format('true: '+', '.join(str(v) for v in true.values())))
+    print('{:>48s}'.format('fitted: '+', '.join(str(round(v, 4)) for v in x)))
+    print('{:>48s}'.format('rmse '+str(round(bt.rmse()))+' W >>> '+str(round(bt.rmse(x)))+' W'))
+    check(bt.rmse(x) < 25 and np.allclose(x, list(true.values()), rtol=0.05), 'fit recovers the parameters of the log (noise 20 W)')
+    grid = {'efficiency': np.linspace(0.15, 0.21, 13), 'temp_coeff': np.linspace(-0.006, -0.002, 9)}
+    for workers in sorted(set([1, os.cpu_count() or 1])):
+        t_sweep, best = timeit(bt.sweep, grid, workers, repeat=1)
+        report('Backtest.sweep (117 points, '+str(workers)+' workers)', t_sweep)
+    bench_backtest_gaps()
+
+#an archive with missing runs (two days of snapshots not there, Rad1h with nights): forecast_inputs has hours without
+#Rad1h. those samples are NaN (the Rad1h fit stops at the gap) and the backtest only scores the others.
+def bench_backtest_gaps():
+    filenames = archive_snapshots(20, 3, 'archive_gaps_kmz', daylight_values)
+    kept = filenames[:32] + filenames[40:]
+    store = archive.Archive(fresh_dir('archive_gaps'), kml_elements)
+    store.ingest(kept)
+    stations = {'Rad1h': ([station_id(0), station_id(1)], None), 'base': station_id(2)}
+    start, end = dt.datetime(2022, 3, 3, tzinfo=dt.timezone.utc), dt.datetime(2022, 3, 19, tzinfo=dt.timezone.utc)
+    print('# backtest: '+str(len(kept))+' of '+str(len(filenames))+' runs archived, lead 24-48 h')
+    t_inputs, inputs = timeit(backtest.forecast_inputs, store, stations, start, end, (24, 48), repeat=1)
+    report('forecast_inputs (16 days)', t_inputs)
+    hours = np.arange(archive.to_datetime64(start), archive.to_datetime64(end) + np.timedelta64(1, 'h'), np.timedelta64(1, 'h'))
+    covered = np.zeros(len(hours), dtype=bool)
+    for filename in kept:
+        issue = dwd2csv.kml_issue_time(filename)
+        lead = (hours - issue) / np.timedelta64(1, 'h')
+        covered |= (lead >= 24) & (lead <= 48)
+    t = inputs['t']
+    hour = np.ceil((t - hours[0]) / np.timedelta64(1, 'h')).astype(np.int64)
+    nan = np.isnan(inputs['Rad1h'])
+    check(not covered.all() and np.array_equal(nan, ~covered[hour]), 'Rad1h NaN exactly in the hours no run covers ('+str(np.count_nonzero(~covered))+' h)')
+    pv = csv2pv.evaluate_plants(t, inputs['Rad1h'], inputs['Neff'], inputs['TTT'])['pvWestP']
+    bt = backtest.Backtest(t, inputs['Rad1h'], inputs['Neff'], inputs['TTT'], {'pvWestP': pv})
+    result = bt.score()['pvWestP']
+    check(0 < result['n'] == np.count_nonzero(~np.isnan(pv)) < len(t) and result['rmse'] < 1, 'backtest scores the samples outside the gap')
+
+
+benchmarks = {'kml': bench_kml, 'columnar': bench_columnar, 'kmz': bench_kmz, 'download': bench_download, 'cache': bench_cache, 'all_stations': bench_all_stations, 'interpolate': bench_interpolate, 'rad1h_fit': bench_rad1h_fit, 'batch': bench_batch, 'sunpos': bench_sunpos, 'solar_table': bench_solar_table, 'plants': bench_plants, 'shading': bench_shading, 'incremental': bench_incremental, 'storage': bench_storage, 'parse': bench_parse, 'merge': bench_merge, 'stations': bench_stations, 'geolookup': bench_geolookup, 'stationoffers': bench_stationoffers, 'startup': bench_startup, 'pipeline': bench_pipeline, 'daemon': bench_daemon, 'archive': bench_archive, 'backtest': bench_backtest}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(benchmarks.keys())
+    for name in names:
+        benchmarks[name]()
@@ -0,0 +1,89 @@
+#columnstore: typed columnar files for the intermediate results of the stages (raw, refined, pvest).
+#Copyright (C) 2022 makischu
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+#the csv files between the stages are nice to look at, but expensive: every cell is formatted on save and parsed on load.
+#here a file is just a dict of equally long numpy columns with their native types:
+# float64 (NaN where dwd says '-'), datetime64 (UTC, seconds), strings.
+#the format follows the file extension:
+# .npy      one structured array (one field per column), memory-mapped on load: no parsing, no copy. numpy only.
+# .parquet, .feather  via pandas (needs pyarrow), for other tools.
+#csv stays the export format, see csv2csv.save_data/load_data.
+
+import datetime as dt
+import os
+import numpy as np
+
+
+columnar_extensions = ['.npy', '.parquet', '.feather']
+
+def is_columnar(filename):
+    return os.path.splitext(filename)[1].lower() in columnar_extensions
+
+#one column >>> typed numpy array. datetimes (timezone-aware) become datetime64[s] UTC, numbers (float or int,
+#'-' as NaN) float64, everything else strings.
+def typed_column(values):
+    values = np.asarray(values) if not isinstance(values, np.ndarray) else values
+    if values.dtype.kind in 'fMU':
+        return values.astype('datetime64[s]') if values.dtype.kind == 'M' else values
+    if len(values) and all(isinstance(v, dt.datetime) for v in values):
+        return np.array([ int(v.timestamp()) for v in values ], dtype=np.int64).astype('datetime64[s]')
+    if all((isinstance(v, (float, int)) and not isinstance(v, bool)) or (isinstance(v, str) and v == '-') for v in values):
+        return np.array([ np.nan if isinstance(v, str) else v for v in values ], dtype=np.float64)
+    return values.astype(str)
+
+#dict of columns >>> structured array (the .npy layout).
+def to_records(columns):
+    columns = { key: typed_column(col) for key, col in columns.items() }
+    n = len(next(iter(columns.values()))) if columns else 0
+    records = np.empty(n, dtype=[ (key, col.dtype) for key, col in columns.items() ])
+    for key, col in columns.items():
+        records[key] = col
+    return records
+
+def save_columns(filename, columns):
+    try:
+        ext = os.path.splitext(filename)[1].lower()
+        if ext == '.npy':
+            with open(filename + '.tmp', 'wb') as file:
+                np.save(file, to_records(columns))
+            os.replace(filename + '.tmp', filename)
+        elif ext in ['.parquet', '.feather']:
+            import pandas as pd
+            frame = pd.DataFrame({ key: typed_column(col) for key, col in columns.items() })
+            if ext == '.parquet':
+                frame.to_parquet(filename, index=False)
+            else:
+                frame.to_feather(filename)
+        else:
+            raise Exception('unknown columnar format: '+filename)
+    except Exception as e:
+        print(e)
+
+#file >>> dict of columns. for .npy the columns are views into the memory-mapped file (read-only).
+def load_columns(filename, mmap=True):
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.npy':
+        records = np.load(filename, mmap_mode='r' if mmap else None)
+        return { key: records[key] for key in records.dtype.names }
+    if ext in ['.parquet', '.feather']:
+        import pandas as pd
+        frame = pd.read_parquet(filename) if ext == '.parquet' else pd.read_feather(filename)
+        columns = {}
+        for key in frame.columns:
+            col = frame[key].to_numpy()
+            columns[key] = col.astype('datetime64[s]') if col.dtype.kind == 'M' else col
+        return columns
+    raise Exception('unknown columnar format: '+filename)
@@ -15,13 +15,17 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import dateutil.parser as dp
 import dateutil.tz as tz
 import datetime as dt
 import csv
 import io
-import matplotlib.pyplot as plt
+import os
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import columnstore
+import stationcatalog
+#imported where they are used, so that a stage only loads what it needs: matplotlib (plot, demonstration only),
+#scipy.linalg (Rad1h fit), dateutil.parser (fallback for unusual timestamps).
 
 
 #file2ram
@@ -37,11 +41,22 @@ def split(dwd_csvfile_content):
     csv_data = list(reader)
     return csv_data
 
+# timestamp strings of a whole column >>> datetimes. what save writes (myformat: '%Y-%m-%dT%H:%M:%S.000Z' for 't',
+# isoformat with offset for 'tLocal') is ISO-8601, so datetime.fromisoformat does it - orders of magnitude faster than
+# dateutil's heuristic parser, which is only the fallback for anything else. 'Z' becomes UTC (older pythons don't know it).
+def parse_dates(values):
+    try:
+        return [ dt.datetime.fromisoformat(v[:-1]+'+00:00' if v.endswith('Z') else v) for v in values ]
+    except ValueError:
+        import dateutil.parser as dp
+        return [ dp.parse(v) for v in values ]
+
 # parse strings inside list of dicts
 def parse(csv_data, floatColumns=[], dateColumns=['t']):
+    for el in dateColumns:
+        for linedict, value in zip(csv_data, parse_dates([ linedict[el] for linedict in csv_data ])):
+            linedict[el] = value
     for linedict in csv_data:
-        for el in dateColumns:
-            linedict[el] = dp.parse(linedict[el])
         for el in floatColumns:
             try:
                 linedict[el] = float(linedict[el])
@@ -49,34 +64,105 @@ def parse(csv_data, floatColumns=[], dateColumns=['t']):
                 continue
     return csv_data
 
+# columnar data (e.g. from dwd2csv.parseKML_columnar) >>> list of dicts, as load+split+parse would return it.
+# NaN becomes '-' again, timestamps become timezone-aware (UTC) datetimes.
+def from_columnar(timestamps, elements, values):
+    t = to_datetime(timestamps)
+    columns = [ [ '-' if v != v else v for v in row ] for row in np.asarray(values, dtype=np.float64).tolist() ]
+    csv_data = []
+    for i in range(0,len(t)):
+        row = {'t': t[i]}
+        for (key,column) in zip(elements,columns):
+            row[key] = column[i]
+        csv_data.append(row)
+    return csv_data
+
 # merge float values of two stations
 # nachdem ich ziemlich genau zwischen zwei stationen wohne, die Rad1h-Daten haben,
 # nehm ich den den mittelwert der beiden stationen zum weiterrechnen
+# (see merge_stations: aligned on the timestamps, '-' is left out of the mean)
 def merge(csv_data, csv_data2, floatColumns=[]):
-    if len(csv_data)!=len(csv_data2):
-        return None
-    for i in range(0,len(csv_data)):
-        t1 = csv_data[i]['t']
-        t2 = csv_data2[i]['t']
-        if t1!=t2:
-            return None
-        for el in floatColumns:
-            csv_data[i][el] = (csv_data[i][el] + csv_data2[i][el])*0.5
-    return csv_data
+    return merge_stations([csv_data, csv_data2], floatColumns)
 
 #overwrite a column by values from another station
 # weil in der mir am naechsten station Rad1h-Werte nicht geliefert werden.
+# (see overwrite_from: aligned on the timestamps, '-' in the other station keeps the own value)
 def overwrite(csv_data, csv_data_alternative_source, overwriteColumns=['Rad1h']):
-    if len(csv_data)!=len(csv_data_alternative_source):
-        return None
-    for i in range(0,len(csv_data)):
-        t1 = csv_data[i]['t']
-        t2 = csv_data_alternative_source[i]['t']
-        if t1!=t2:
-            return None
-        for el in overwriteColumns:
-            csv_data[i][el] = csv_data_alternative_source[i][el]
-    return csv_data
+    return overwrite_from(csv_data, [csv_data_alternative_source], overwriteColumns)
+
+#the stations are aligned on their timestamps (hash index), not on the row number: a missing hour in one station
+#is just a missing value there. the result has the union of all timestamps (sorted), rows of the first station are
+#reused, hours it does not have get new rows with '-'.
+def _align(datasets):
+    t = sorted(set(line['t'] for data in datasets for line in data))
+    index = { ts: i for i, ts in enumerate(t) }
+    return t, [ np.array([ index[line['t']] for line in data ], dtype=np.intp) for data in datasets ]
+
+def _rows_on(t, csv_data, pos):
+    keys = list(csv_data[0].keys()) if csv_data else ['t']
+    rows = [None]*len(t)
+    for line, p in zip(csv_data, pos):
+        rows[p] = line
+    for i in range(len(t)):
+        if rows[i] is None:
+            rows[i] = { key: '-' for key in keys }
+            rows[i]['t'] = t[i]
+    return rows
+
+#float columns of all stations on the common time index: stations x hours x columns, NaN for '-' and missing hours.
+def _float_values(datasets, positions, n, columns):
+    values = np.full((len(datasets), n, len(columns)), np.nan)
+    for k, (csv_data, pos) in enumerate(zip(datasets, positions)):
+        for j, el in enumerate(columns):
+            values[k, pos, j] = [ v if isinstance(v, float) else np.nan for v in (line.get(el) for line in csv_data) ]
+    return values
+
+def _write_float_values(rows, columns, values):
+    for j, el in enumerate(columns):
+        for line, v in zip(rows, values[:, j].tolist()):
+            line[el] = '-' if v != v else v
+
+#weighted mean of float columns of many stations (weights: one per station, e.g. inverse_distance_weights;
+#None: plain mean). per hour and column only the stations with a value count, weights are normalized over them.
+#'-' only if no station has a value.
+def merge_stations(datasets, floatColumns=[], weights=None):
+    t, positions = _align(datasets)
+    values = _float_values(datasets, positions, len(t), floatColumns)
+    valid = ~np.isnan(values)
+    w = np.ones(len(datasets)) if weights is None else np.asarray(weights, dtype=np.float64)
+    w = w[:, None, None] * valid
+    with np.errstate(invalid='ignore', divide='ignore'):
+        merged = np.sum(np.where(valid, values, 0) * w, axis=0) / np.sum(w, axis=0)
+    rows = _rows_on(t, datasets[0], positions[0])
+    _write_float_values(rows, floatColumns, merged)
+    return rows
+
+#fill columns from alternative sources, in the given order of priority: per hour and column the first source that has
+#a value wins. without any, the own value stays.
+def overwrite_from(csv_data, sources, overwriteColumns=['Rad1h']):
+    t, positions = _align([csv_data] + sources)
+    values = _float_values(sources, positions[1:], len(t), overwriteColumns)
+    valid = ~np.isnan(values)
+    first = np.argmax(valid, axis=0)
+    found = np.any(valid, axis=0)
+    filled = np.take_along_axis(values, first[None], axis=0)[0]
+    rows = _rows_on(t, csv_data, positions[0])
+    for j, el in enumerate(overwriteColumns):
+        for i in np.flatnonzero(found[:, j]).tolist():
+            rows[i][el] = filled[i, j]
+    return rows
+
+#weights for merge_stations from the distances of the stations to the site: 1/d^power, normalized.
+#a station right at the site (d=0) gets everything. (see stationcatalog for the distances)
+def inverse_distance_weights(distances, power=2):
+    return stationcatalog.inverse_distance_weights(distances, power)
+
+#stations for a site from the station catalogue: the k nearest stations offering Rad1h, blended with
+#inverse-distance weights, and the nearest station for everything else. (see refine_my_latest_csv)
+def site_stations(catalog, lat, lon, k=2, power=2):
+    ids, weights = catalog.idw(lat, lon, k, 'Rad1h', power)
+    base, _ = catalog.nearest(lat, lon, 1)
+    return {'Rad1h': (ids.tolist(), weights.tolist()), 'base': str(base[0])}
 
 #add a local date column next to 't'
 def addlocaldate(csv_data):
@@ -125,13 +211,47 @@ def save(csv_filename, data):
         print(e)    
     return 
 
+
+#stage output (list of dicts) >>> file. the format follows the extension: .csv as with save (the export format),
+#.npy/.parquet/.feather as typed columns (see columnstore).
+def save_data(filename, data):
+    if columnstore.is_columnar(filename):
+        columnstore.save_columns(filename, rows_to_columns(data))
+    else:
+        save(filename, data)
+
+#file >>> list of dicts, as parse(split(load(...))) returns it. the columnar formats are typed already
+#(floatColumns and dateColumns are only needed for csv); 'tLocal' gets the local timezone again.
+def load_data(filename, floatColumns=[], dateColumns=['t']):
+    if not columnstore.is_columnar(filename):
+        return parse(split(load(filename)), floatColumns, dateColumns)
+    columns = {}
+    for key, col in columnstore.load_columns(filename).items():
+        if col.dtype.kind == 'M':
+            col = to_datetime(col)
+            if key == 'tLocal':
+                col[:] = [ ts.astimezone(tz.tzlocal()) for ts in col ]
+        elif col.dtype.kind != 'f':
+            col = col.astype(object)
+        columns[key] = col
+    return columns_to_rows(columns)
+
+#file >>> dict of columns. for the columnar formats that is all there is to do (.npy: memory-mapped, datetimes
+#as datetime64 UTC), csv is parsed as in load_data.
+def load_data_columns(filename, floatColumns=[], dateColumns=['t']):
+    if columnstore.is_columnar(filename):
+        return columnstore.load_columns(filename)
+    return rows_to_columns(load_data(filename, floatColumns, dateColumns))
+
        
 #estimate intermediate values
 #Rad1h: by assuming a continous curve instead of 1 hour steps - without changing the integral
 #cont: by linear interpolation of floats
 #degr: linear, but shortest way modulo 360
 #else: '-', no interpolation at all.
-def interpolate(data, resolution_in_minutes=5, continuous_columns=['Neff','N','FF','PPPP','TTT','Td'], degree_columns=['DD']):
+#this is the original row-by-row implementation. interpolate (below) does the same on arrays, much faster.
+#kept as reference (see bench.py).
+def interpolate_rowwise(data, resolution_in_minutes=5, continuous_columns=['Neff','N','FF','PPPP','TTT','Td'], degree_columns=['DD']):
     #sanity check. we require values in 1h grid.
     for i in range(1,len(data)):
         if (data[i]['t']-data[i-1]['t']).total_seconds() != 3600:
@@ -172,7 +292,7 @@ def interpolate(data, resolution_in_minutes=5, continuous_columns=['Neff','N','F
             A[j*2:j*2+2,2*j-1:2*j+3] = np.array([[ 1/4, 1, -1/4,   1],[ 1/2,  1, 1/2,   -1]])
         for j in range(0,iLen-1):
             b[j*2] = 2*data[i0+j+1]['Rad1h']
-        x = np.linalg.solve(A, b)
+        x = np.linalg.solve(A, b)[:,0]   #scalars (newer numpy refuses float() of 1-element arrays)
         rangelines = [ {} for i in range(0,iLen)]
         rangelines[0]     = { 'a' : x[0],  'b' : 0}
         rangelines[-1]    = { 'a' : x[-1], 'b' : 0}
@@ -249,35 +369,466 @@ def interpolate(data, resolution_in_minutes=5, continuous_columns=['Neff','N','F
     return interpData
     
         
+#list of dicts >>> dict of columns (numpy arrays). columns that only contain numbers (float or int) and '-' become
+#float arrays with NaN for '-', everything else (e.g. dates, unparsed strings) object arrays.
+def rows_to_columns(csv_data):
+    columns = {}
+    for key in csv_data[0].keys():
+        values = [line[key] for line in csv_data]
+        if all((isinstance(v, (float, int)) and not isinstance(v, bool)) or (isinstance(v, str) and v == '-') for v in values):
+            columns[key] = np.array([np.nan if isinstance(v, str) else v for v in values], dtype=np.float64)
+        else:
+            columns[key] = np.empty(len(values), dtype=object)
+            columns[key][:] = values
+    return columns
+
+#dict of columns >>> list of dicts. NaN in float columns becomes '-' again.
+def columns_to_rows(columns):
+    lists = {}
+    for key, col in columns.items():
+        if col.dtype == np.float64:
+            lists[key] = [ '-' if v != v else v for v in col.tolist() ]
+        else:
+            lists[key] = list(col)
+    keys = list(lists.keys())
+    return [ dict(zip(keys, row)) for row in zip(*lists.values()) ]
+
+#float values and validity of a column. object columns: only real floats count (same as isinstance(...,float)).
+def _numeric(col):
+    if col.dtype == np.float64:
+        return col, ~np.isnan(col)
+    valid = np.array([isinstance(v, float) for v in col], dtype=bool)
+    numeric = np.full(len(col), np.nan)
+    numeric[valid] = col[valid].astype(np.float64)
+    return numeric, valid
+
+#the interpolation kernels all work on a (hours-1) x n_per_hour grid (per station, if there is a leading station axis):
+#row i holds the samples after t[i], up to and including t[i+1].
+#where no interpolation is possible, the samples are '-' (NaN), except the last one, which is the original value at t[i+1].
+def _fill_invalid(col, out, valid_pair):
+    if col.dtype == np.float64:
+        out[..., :-1] = np.where(valid_pair[..., None], out[..., :-1], np.nan)
+        out[..., -1]  = np.where(valid_pair, out[..., -1], col[..., 1:])
+        return out
+    result = out.astype(object)
+    result[~valid_pair, :-1] = '-'
+    result[~valid_pair, -1] = col[1:][~valid_pair]
+    return result
+
+def _interpolate_linear(col, f):
+    numeric, valid = _numeric(col)
+    out = numeric[..., :-1, None]*(1-f) + numeric[..., 1:, None]*(f)
+    return _fill_invalid(col, out, valid[..., :-1] & valid[..., 1:])
+
+def _interpolate_degree(col, f):
+    numeric, valid = _numeric(col)
+    delta = numeric[..., 1:] - numeric[..., :-1]
+    delta = np.where(delta > 180, delta - 360, delta)
+    delta = np.where(delta < -180, delta + 360, delta)
+    out = numeric[..., :-1, None] + delta[..., None]*(f)
+    return _fill_invalid(col, out, valid[..., :-1] & valid[..., 1:])
+
+def _interpolate_hold(col, n_per_hour):
+    shape = col.shape[:-1] + (col.shape[-1]-1, n_per_hour)
+    if col.dtype == np.float64:
+        out = np.full(shape, np.nan)
+    else:
+        out = np.full(shape, '-', dtype=object)
+    out[..., -1] = col[..., 1:]
+    return out
+
+#indices 0..n-1 within each of the consecutive segments of the given lengths, e.g. [2,3] -> [0,1,0,1,2]
+def _segment_index(lengths):
+    starts = np.cumsum(lengths) - lengths
+    return np.arange(np.sum(lengths)) - np.repeat(starts, lengths)
+
+#find connected data ranges not equal zero, for all stations (rows of R) at once.
+#a range starts with the 0 before a run of non-zero values and ends with the 0 after it (which does not really belong to it).
+#same results as the original scan in interpolate_rowwise, including its peculiarities:
+#a run of a single non-zero value is joined with the next run, a run at the very beginning or end of the data is ignored,
+#and a station whose first range would start at index 0 gets no ranges at all.
+#NaN (no station had a value for that hour, see merge_stations) breaks a range like a 0: it is never inside one.
+#returns three arrays: station (row) index, i0 (first index) and iN1 (last index) of every range.
+def connected_ranges(R):
+    R = np.atleast_2d(R)
+    S, n = R.shape
+    nonzero = (R != 0) & ~np.isnan(R)
+    #runs of non-zero values that have a 0 before and after them: start = index of the 0 before, end = index of the 0 after.
+    rises = np.argwhere(~nonzero[:, :-1] & nonzero[:, 1:])
+    falls = np.argwhere(nonzero[:, :-1] & ~nonzero[:, 1:])
+    rises = rises[rises[:, 1] + 1 <= n-2]
+    falls = falls[falls[:, 1] >= 1]
+    #pair every start with the first end after it (per station).
+    key_r = rises[:, 0]*n + rises[:, 1]
+    key_f = falls[:, 0]*n + falls[:, 1]
+    pos = np.searchsorted(key_f, key_r)
+    has_end = pos < len(key_f)
+    has_end[has_end] = falls[pos[has_end], 0] == rises[has_end, 0]
+    run_st = rises[:, 0]
+    run_s  = rises[:, 1]
+    run_e  = np.full(len(rises), -1)
+    run_e[has_end] = falls[pos[has_end], 1] + 1
+    #a run of length 1 is joined with the following run (of the same station). in a chain of such short runs,
+    #every second one is consumed by its predecessor.
+    short = has_end & (run_e - run_s == 2)
+    same_next = np.append(run_st[1:] == run_st[:-1], False)
+    chain_start = np.arange(len(rises))
+    newchain = ~short | ~np.append(False, short[:-1] & same_next[:-1])
+    chain_start = np.maximum.accumulate(np.where(newchain, chain_start, 0))
+    consumed = np.append(False, short[:-1] & same_next[:-1] & ((np.arange(len(rises)-1) - chain_start[:-1]) % 2 == 0)) if len(rises) else np.zeros(0, dtype=bool)
+    first = ~consumed
+    #the end of a range: its own end, or the end of the next run if it is short.
+    join = short & same_next & first
+    range_e = run_e.copy()
+    range_e[join] = run_e[np.flatnonzero(join) + 1]
+    ok = first & (range_e >= 0) & ~(short & ~same_next)
+    #a station whose first start is index 0 gets stuck in the original scan.
+    first_of_station = np.append(True, run_st[1:] != run_st[:-1])
+    stuck_stations = run_st[first_of_station & (run_s == 0)]
+    ok &= ~np.isin(run_st, stuck_stations)
+    return run_st[ok], run_s[ok], range_e[ok]
+
+#solve the equation system of the continous linear fit for connected ranges (the values between the two zeros).
+#unknowns are the lines (a,b) between the points: [a0, a1, b1, a2, b2, ..., a(n-1), b(n-1), an] (first and last line end in 0).
+#per value two equations: keep the integral (1/4*a0 + b0 - 1/4*a1 + b1 = 2*R) and continuity (1/2*a0 + b0 + 1/2*a1 - b1 = 0).
+#each equation touches at most the 2 neighbouring unknowns on either side, so the system is banded (l=u=2):
+#O(n) instead of O(n^3) for a dense solve, and no dense n x n matrix.
+#several ranges can be solved at once: Rvalues are their values one after the other, counts the number of values per range.
+#the systems are independent, stacked they are still banded.
+def _rad1h_fit(Rvalues, counts=None):
+    if counts is None:
+        counts = [len(Rvalues)]
+    counts = np.asarray(counts)
+    nb = np.repeat(counts, counts)
+    j  = _segment_index(counts)
+    o  = 2*np.repeat(np.cumsum(counts) - counts, counts)  #first unknown of the range
+    d  = 2*len(Rvalues)
+    r0 = o+2*j                      #integral equation of value j
+    r1 = o+2*j+1                    #continuity equation of value j
+    ca0 = o+np.maximum(2*j-1, 0)    #a of the line left of value j
+    cb0 = o+2*j                     #b of the line left of value j (not for the first line)
+    ca1 = o+2*j+1                   #a of the line right of value j
+    cb1 = o+2*j+2                   #b of the line right of value j (not for the last line)
+    hasb0 = j > 0
+    hasb1 = j < nb-1
+    ab = np.zeros((5, d))           #banded storage: ab[2+row-col, col] = A[row, col]
+    ab[2+r0-ca0, ca0] = 1/4
+    ab[2+r1-ca0, ca0] = 1/2
+    ab[2+r0[hasb0]-cb0[hasb0], cb0[hasb0]] = 1
+    ab[2+r1[hasb0]-cb0[hasb0], cb0[hasb0]] = 1
+    ab[2+r0-ca1, ca1] = -1/4
+    ab[2+r1-ca1, ca1] = 1/2
+    ab[2+r0[hasb1]-cb1[hasb1], cb1[hasb1]] = 1
+    ab[2+r1[hasb1]-cb1[hasb1], cb1[hasb1]] = -1
+    b = np.zeros(d)
+    b[r0] = 2*np.asarray(Rvalues)
+    from scipy.linalg import solve_banded
+    return solve_banded((2, 2), ab, b)
+
+#lines (slope a, offset b) left and right of every hourly point in time, as interpolate_rowwise determines them.
+#R is one station (1-D) or several stations (2-D, stations x hours); all ranges of all stations are solved in one go.
+#ranges (station, i0, iN1 as from connected_ranges) restricts the fit to these ranges, all other hours keep the plain lines.
+#hours without a value (NaN) keep the plain lines as well, so their samples are NaN; a range next to them ends in 0 there.
+def _rad1h_lines(R, ranges=None):
+    R2 = np.atleast_2d(R)
+    aL = np.zeros(R2.shape)
+    bL = R2.copy()
+    aR = np.zeros(R2.shape)
+    bR = np.concatenate((R2[:, 1:], np.zeros((R2.shape[0], 1))), axis=1)
+
+    st, i0, iN1 = connected_ranges(R2) if ranges is None else ranges
+    if len(st):
+        R2 = np.where(np.isnan(R2), 0, R2)     #only the ends of a range can be NaN
+        #determine continous linear fit
+        counts = iN1 - i0 - 1                   #values per range (between the zeros)
+        idx    = np.repeat(i0+1, counts) + _segment_index(counts)
+        x = _rad1h_fit(R2[np.repeat(st, counts), idx], counts)
+        #lines of the fit per range: first and last one through 0, the others (a,b) = (x[2m-1], x[2m])
+        xo = 2*(np.cumsum(counts) - counts)     #offset of the range in x
+        m  = _segment_index(counts+1)           #line index 0..counts
+        rm = np.repeat(counts, counts+1)
+        mo = np.repeat(xo, counts+1)
+        ra = x[mo + np.maximum(2*m-1, 0)]
+        rb = np.where((m > 0) & (m < rm), x[np.minimum(mo + 2*m, len(x)-1)], 0.0)
+
+        #choose between fit and original: the sign of the slope must be ok, left as well as right.
+        j   = _segment_index(counts) + 1        #1..counts per range
+        lo  = np.repeat(np.cumsum(counts+1) - (counts+1), counts)  #offset of the range in ra/rb
+        sj  = np.repeat(st, counts)
+        ij  = np.repeat(i0, counts) + j
+        dRLeft  = R2[sj, ij] - R2[sj, ij-1]
+        dRRight = R2[sj, ij+1] - R2[sj, ij]
+        ok = (dRLeft*ra[lo+j-1] >= 0) & (dRRight*ra[lo+j] >= 0)
+        sj, ij, lj = sj[ok], ij[ok], (lo+j)[ok]
+        aR[sj, ij-1] = ra[lj-1]
+        bR[sj, ij-1] = rb[lj-1]
+        aL[sj, ij]   = ra[lj]
+        bL[sj, ij]   = rb[lj]
+    if np.ndim(R) == 1:
+        return aL[0], bL[0], aR[0], bR[0]
+    return aL, bL, aR, bR
+
+#samples of the hours between t[i] and t[i+1]: first half on the line right of t[i] (aR, bR), second half on the line
+#left of t[i+1] (aL, bL). all four per hour.
+def _rad1h_samples(aR, bR, aL, bL, n_per_hour, resolution_in_minutes):
+    n_halfhour = n_per_hour // 2
+    dx = resolution_in_minutes/60
+    steps = np.arange(1, n_halfhour+1)*dx
+    out = np.empty(aR.shape + (n_per_hour,))
+    out[..., :n_halfhour] = aR[..., None]*(0+steps) + bR[..., None]
+    out[..., n_halfhour:] = aL[..., None]*(-0.5+steps) + bL[..., None]
+    return out
+
+def _interpolate_rad1h(col, n_per_hour, resolution_in_minutes):
+    R = np.asarray(col, dtype=np.float64)
+    aL, bL, aR, bR = _rad1h_lines(R)
+    return _rad1h_samples(aR[..., :-1], bR[..., :-1], aL[..., 1:], bL[..., 1:], n_per_hour, resolution_in_minutes)
+
+#sanity check. we require values in 1h grid.
+def _check_grid(t, resolution_in_minutes):
+    hour = np.timedelta64(1, 'h') if t.dtype.kind == 'M' else dt.timedelta(hours=1)
+    if len(t) > 1 and not np.all(np.diff(t) == hour):
+        raise Exception("interpolRad1h requires 1h grid")
+    if 30 % resolution_in_minutes != 0:
+        raise Exception("interpolRad1h requires that multiple of resolution_in_minutes result in 1/2hour")
+
+#array based version of the interpolation. columns: dict of numpy arrays (see rows_to_columns), 't' either
+#datetime64 or datetime objects. returns the same kind of dict on the fine time grid.
+def interpolate_columns(columns, resolution_in_minutes=5, continuous_columns=['Neff','N','FF','PPPP','TTT','Td'], degree_columns=['DD']):
+    t = columns['t']
+    _check_grid(t, resolution_in_minutes)
+
+    n_per_hour = int((60/resolution_in_minutes))
+    f = np.arange(1, n_per_hour+1)/n_per_hour
+    n_out = n_per_hour*(len(t)-1)
+    interp = {}
+    for key, col in columns.items():
+        if key == 't':
+            if t.dtype.kind == 'M':
+                interp[key] = t[0] + np.arange(1, n_out+1)*np.timedelta64(resolution_in_minutes, 'm')
+            else:
+                interp[key] = np.empty(n_out, dtype=object)
+                interp[key][:] = [ t[0] + dt.timedelta(minutes = (i+1)*resolution_in_minutes) for i in range(0,n_out) ]
+            continue
+        if key == 'Rad1h':
+            out = _interpolate_rad1h(col, n_per_hour, resolution_in_minutes)
+        elif key in continuous_columns:
+            out = _interpolate_linear(col, f)
+        elif key in degree_columns:
+            out = _interpolate_degree(col, f)
+        else:
+            out = _interpolate_hold(col, n_per_hour)
+        interp[key] = out.reshape(-1)
+    return interp
+
+#estimate intermediate values - same as interpolate_rowwise (identical results), but vectorized.
+def interpolate(data, resolution_in_minutes=5, continuous_columns=['Neff','N','FF','PPPP','TTT','Td'], degree_columns=['DD']):
+    columns = interpolate_columns(rows_to_columns(data), resolution_in_minutes, continuous_columns, degree_columns)
+    return columns_to_rows(columns)
+
+
+#interpolate many stations at once. values: float array stations x hours x columns (NaN for '-'), all stations on
+#the same hourly time grid t (datetime64). columns: the names of the columns (last axis).
+#returns the fine time grid and the interpolated values (stations x samples x columns), same results as interpolate per station.
+#with workers > 1, chunks of stations are distributed to a process pool.
+def interpolate_batch(t, values, columns, resolution_in_minutes=5, continuous_columns=['Neff','N','FF','PPPP','TTT','Td'], degree_columns=['DD'], workers=None, chunksize=64):
+    t = np.asarray(t)
+    values = np.asarray(values, dtype=np.float64)
+    if workers and workers > 1 and values.shape[0] > chunksize:
+        chunks = [ values[i:i+chunksize] for i in range(0, values.shape[0], chunksize) ]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(interpolate_batch, [t]*len(chunks), chunks, [columns]*len(chunks), [resolution_in_minutes]*len(chunks),
+                                    [continuous_columns]*len(chunks), [degree_columns]*len(chunks)))
+        return results[0][0], np.concatenate([ r[1] for r in results ], axis=0)
+
+    _check_grid(t, resolution_in_minutes)
+    n_per_hour = int((60/resolution_in_minutes))
+    f = np.arange(1, n_per_hour+1)/n_per_hour
+    S, H, C = values.shape
+    t_interp = t[0] + np.arange(1, n_per_hour*(H-1)+1)*np.timedelta64(resolution_in_minutes, 'm')
+    #work column by column on contiguous memory (columns x stations x time), the result is a transposed view of it.
+    values = np.ascontiguousarray(values.transpose(2, 0, 1))
+    interp = np.empty((C, S, n_per_hour*(H-1)))
+    for c, key in enumerate(columns):
+        col = values[c]
+        if key == 'Rad1h':
+            out = _interpolate_rad1h(col, n_per_hour, resolution_in_minutes)
+        elif key in continuous_columns:
+            out = _interpolate_linear(col, f)
+        elif key in degree_columns:
+            out = _interpolate_degree(col, f)
+        else:
+            out = _interpolate_hold(col, n_per_hour)
+        interp[c] = out.reshape(S, -1)
+    return t_interp, interp.transpose(1, 2, 0)
+
+
+#incremental interpolation, for frequent refreshes (e.g. MOSMIX_S every hour): most hours of a new forecast run are
+#unchanged, their interpolated samples can be taken from the previous result. previous: (columns, interp) of the last run,
+#as passed and returned here, 't' as datetime64 (see load_state). only hours where one of the two hourly values changed
+#(or which are new) are interpolated again. for Rad1h the fit couples all values of a connected range, so an hour inside
+#a range is only reused if the whole range is unchanged - and only the changed ranges are fitted again.
+#float columns only (as rows_to_columns makes them), other columns are always interpolated completely.
+#returns the same dict as interpolate_columns, and per column a bool array over the fine samples: recomputed or not.
+def interpolate_incremental(columns, previous=None, resolution_in_minutes=5, continuous_columns=['Neff','N','FF','PPPP','TTT','Td'], degree_columns=['DD']):
+    t = columns['t']
+    _check_grid(t, resolution_in_minutes)
+    n_per_hour = int((60/resolution_in_minutes))
+    f = np.arange(1, n_per_hour+1)/n_per_hour
+    H = len(t)
+    if previous is not None:
+        old_columns, old_interp = previous
+        old_t = old_columns['t']
+        if len(old_t) < 2 or len(old_interp['t']) != n_per_hour*(len(old_t)-1):
+            previous = None     #other resolution, or nothing to reuse
+    if previous is None or H < 2:
+        interp = interpolate_columns(columns, resolution_in_minutes, continuous_columns, degree_columns)
+        return interp, { key: np.ones(len(interp['t']), dtype=bool) for key in interp if key != 't' }
+
+    #hours of the new run in the old one: both are on the 1h grid, so it is a fixed offset d.
+    d = int((t[0] - old_t[0]) // np.timedelta64(1, 'h'))
+    pos = np.arange(H) + d
+    known = (pos >= 0) & (pos < len(old_t))
+    pos = np.clip(pos, 0, len(old_t)-1)
+    hour_known = known[:-1] & known[1:]
+    lo, hi = max(0, -d), max(0, min(H-1, len(old_t)-1-d))   #hours that exist in both runs
+    interp = {'t': t[0] + np.arange(1, n_per_hour*(H-1)+1)*np.timedelta64(resolution_in_minutes, 'm')}
+    recomputed = {}
+    for key, col in columns.items():
+        if key == 't':
+            continue
+        old_col = old_columns.get(key)
+        if col.dtype != np.float64 or old_col is None or old_col.dtype != np.float64 or key not in old_interp:
+            interp[key] = interpolate_columns({'t': t, key: col}, resolution_in_minutes, continuous_columns, degree_columns)[key]
+            recomputed[key] = np.ones(len(interp['t']), dtype=bool)
+            continue
+        old = old_col[pos]
+        same = known & ((col == old) | (np.isnan(col) & np.isnan(old)))
+        clean = hour_known & same[:-1] & same[1:]
+        if key == 'Rad1h':
+            clean, ranges = _rad1h_reusable(col, old_col, pos, same, clean)
+        out = np.empty((H-1, n_per_hour))
+        if lo < hi:
+            out[lo:hi] = old_interp[key].reshape(-1, n_per_hour)[lo+d:hi+d]
+        idx = np.flatnonzero(~clean)
+        if len(idx):
+            if key == 'Rad1h':
+                aL, bL, aR, bR = _rad1h_lines(col, ranges)
+                out[idx] = _rad1h_samples(aR[idx], bR[idx], aL[idx+1], bL[idx+1], n_per_hour, resolution_in_minutes)
+            else:
+                #the kernels take the hours as leading axis: every changed hour is a "station" of its two values.
+                pairs = np.stack((col[idx], col[idx+1]), axis=-1)
+                if key in continuous_columns:
+                    out[idx] = _interpolate_linear(pairs, f)[:, 0]
+                elif key in degree_columns:
+                    out[idx] = _interpolate_degree(pairs, f)[:, 0]
+                else:
+                    out[idx] = _interpolate_hold(pairs, n_per_hour)[:, 0]
+        interp[key] = out.reshape(-1)
+        recomputed[key] = np.repeat(~clean, n_per_hour)
+    return interp, recomputed
+
+#index of the connected range every hour (t[i]..t[i+1]) belongs to, -1 for none.
+def _range_id(i0, iN1, n_hours):
+    rid = np.full(n_hours, -1)
+    lengths = iN1 - i0
+    rid[np.repeat(i0, lengths) + _segment_index(lengths)] = np.repeat(np.arange(len(i0)), lengths)
+    return rid
+
+#hours of Rad1h that can be reused (clean: both values unchanged), restricted to hours whose connected range is unchanged
+#(same hours, same values) or which are in no range, then and now. also returns the changed ranges, to be fitted again.
+def _rad1h_reusable(R, R_old, pos, same, clean):
+    st, i0, iN1 = connected_ranges(R)
+    _, oi0, oiN1 = connected_ranges(R_old)
+    changes = np.concatenate(([0], np.cumsum(~same)))
+    unchanged = changes[iN1+1] - changes[i0] == 0
+    unchanged &= np.isin(pos[i0]*len(R_old) + pos[iN1], oi0*len(R_old) + oiN1)
+    rid = _range_id(i0, iN1, len(R)-1)
+    orid = _range_id(oi0, oiN1, len(R_old)-1)
+    clean = clean & np.where(rid >= 0, np.append(unchanged, False)[rid], orid[np.minimum(pos[:-1], len(orid)-1)] < 0)
+    return clean, (st[~unchanged], i0[~unchanged], iN1[~unchanged])
+
+#state of the last incremental run: hourly input and interpolated output (float and time columns only), as .npz.
+def save_state(state_filename, columns, interp):
+    try:
+        arrays = { 'in_'+key: col for key, col in columns.items() if col.dtype != object }
+        arrays.update({ 'out_'+key: col for key, col in interp.items() if col.dtype != object })
+        with open(state_filename + '.tmp', 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(state_filename + '.tmp', state_filename)
+    except Exception as e:
+        print(e)
+
+#(columns, interp) as saved by save_state, None if there is no (usable) state.
+def load_state(state_filename):
+    if not os.path.exists(state_filename):
+        return None
+    try:
+        with np.load(state_filename) as npz:
+            columns = { key[3:]: npz[key] for key in npz.files if key.startswith('in_') }
+            interp  = { key[4:]: npz[key] for key in npz.files if key.startswith('out_') }
+        if 't' in columns and 't' in interp:
+            return columns, interp
+    except Exception as e:
+        print(e)
+    return None
+
+#timezone-aware (UTC) datetimes >>> datetime64 and back.
+def to_datetime64(t):
+    return np.array([ int(ts.timestamp()) for ts in t ], dtype=np.int64).astype('datetime64[s]')
+
+def to_datetime(t64):
+    t = np.empty(len(t64), dtype=object)
+    t[:] = [ dt.datetime.fromtimestamp(sec, dt.timezone.utc) for sec in np.asarray(t64).astype('datetime64[s]').astype(np.int64).tolist() ]
+    return t
+
+
+#my stations: Rad1h from two stations, everything else from the nearest one.
+default_stations = {'Rad1h': (['10836','10850'], None), 'base': 'Q491'}  #ich wohne ziemlich genau dazwischen
+
 #combine everything in the way it makes sense for ME. not a general solution.
-def refine_my_latest_csv():
+#incremental: only interpolate what changed since the last run (see interpolate_incremental), the state is kept in state_filename.
+#ext: file format of input and output, see save_data.
+#stations: which stations to combine, e.g. from site_stations (default: my stations).
+def refine_my_latest_csv(incremental=False, state_filename='./data/cache/refined_state.npz', ext='.csv', stations=None):
     floatcolumns=['Rad1h','Neff','N','DD','FF','FX1','PPPP','DRR1','RR1c','RRad1','SunD1','SunD','TTT','Td','ww','WPc11']
     datenow = dt.datetime.now() #- dt.timedelta(days=7)
     datestart = dt.datetime(datenow.year, datenow.month, datenow.day, tzinfo=dt.timezone.utc)
     dateend   = datestart + dt.timedelta(days=3)
     todaystr  = datenow.strftime('%Y-%m-%d')
-    data10836 = parse(split(load('./data/mosmix_10836_'+todaystr+'.csv')), ['Rad1h'])
-    data10850 = parse(split(load('./data/mosmix_10850_'+todaystr+'.csv')), ['Rad1h'])
-    dataRad1h = merge(data10836,data10850, ['Rad1h'])
-    dataQ491 = parse(split(load('./data/mosmix_Q491_'+todaystr+'.csv')), floatcolumns)
-    dataCombined = overwrite(dataQ491, dataRad1h, ['Rad1h'])
+    if stations is None:
+        stations = default_stations
+    rad_ids, rad_weights = stations['Rad1h']
+    dataRad1h = merge_stations([ load_data('./data/mosmix_'+station+'_'+todaystr+ext, ['Rad1h']) for station in rad_ids ], ['Rad1h'], rad_weights)
+    dataBase = load_data('./data/mosmix_'+stations['base']+'_'+todaystr+ext, floatcolumns)
+    dataCombined = overwrite(dataBase, dataRad1h, ['Rad1h'])
     dataCombined = limit(dataCombined, datestart, dateend)
-    dataInterpol = interpolate(dataCombined)
+    if incremental:
+        columns = rows_to_columns(dataCombined)
+        columns['t'] = to_datetime64(columns['t'])
+        interp, recomputed = interpolate_incremental(columns, load_state(state_filename))
+        os.makedirs(os.path.dirname(state_filename), exist_ok=True)
+        save_state(state_filename, columns, interp)
+        interp['t'] = to_datetime(interp['t'])
+        dataInterpol = columns_to_rows(interp)
+    else:
+        dataInterpol = interpolate(dataCombined)
     dataInterpol = addlocaldate(dataInterpol)
-    save('./data/mosmix_refined_'+todaystr+'.csv', dataInterpol)
+    save_data('./data/mosmix_refined_'+todaystr+ext, dataInterpol)
 
 
 #reload what we have saved in plot some illustrative results - for demonstration only.
-def plot_my_latest_csv():
+def plot_my_latest_csv(ext='.csv'):
     floatcolumns=['Rad1h','Neff','N','DD','FF','FX1','PPPP','DRR1','RR1c','RRad1','SunD1','SunD','TTT','Td','ww','WPc11']
     datenow = dt.datetime.now()
     datenow = dt.datetime(2022,8,25)
     todaystr  = datenow.strftime('%Y-%m-%d')
-    data10836 = parse(split(load('./data/mosmix_10836_'+todaystr+'.csv')), ['Rad1h'])
-    data10850 = parse(split(load('./data/mosmix_10850_'+todaystr+'.csv')), ['Rad1h'])
-    dataQ491 = parse(split(load('./data/mosmix_Q491_'+todaystr+'.csv')), floatcolumns)
-    dataInterp = parse(split(load('./data/mosmix_refined_'+todaystr+'.csv')), floatcolumns)
+    data10836 = load_data('./data/mosmix_10836_'+todaystr+ext, ['Rad1h'])
+    data10850 = load_data('./data/mosmix_10850_'+todaystr+ext, ['Rad1h'])
+    dataQ491 = load_data('./data/mosmix_Q491_'+todaystr+ext, floatcolumns)
+    dataInterp = load_data('./data/mosmix_refined_'+todaystr+ext, floatcolumns)
                 
+    import matplotlib.pyplot as plt
     plt.close('all')
     f, axs = plt.subplots(3,1)
     
@@ -20,24 +20,63 @@
 
 import datetime as dt
 import math 
-import sunpos
+import calendar
+import hashlib
+import json
+import os
 import numpy as np
 import csv2csv #reuse load and save functions from previous file
-import matplotlib.pyplot as plt
-import pandas as pd
-import pytz
+#matplotlib is only needed for the plot (demonstration), it is imported there.
 
 ##plant-specific...
 location = (48.69978, 10.24177) # Nattheim. change it to your location.
 
-#wrapper for sunpos.
+#position of the sun (azimuth, elevation in degrees) for an array of points in time, in one go.
+#same algorithm as sunpos.sunpos from https://levelup.gitconnected.com/python-sun-position-for-solar-energy-and-research-7a4ead801777?gi=4826148a2672
+#(which this file used before), but on numpy arrays. accurate from 1901 to 2099.
+#t: datetime64 (UTC) array or a sequence of datetimes (timezone-aware; naive ones are taken as UTC).
+def sunpos_array(t, plant_location=None, refraction=False):
+    if plant_location is None:
+        plant_location = location
+    latitude, longitude = plant_location
+    rlat = math.radians(latitude)
+    rlon = math.radians(longitude)
+    # Days from J2000 (2000-01-01 12:00 UTC)
+    daynum = (epoch_seconds(t) - 946728000.0) / 86400.0
+    # Mean longitude, mean anomaly and ecliptic longitude of the sun
+    mean_long  = daynum * 0.01720279239 + 4.894967873
+    mean_anom  = daynum * 0.01720197034 + 6.240040768
+    eclip_long = mean_long + 0.03342305518 * np.sin(mean_anom) + 0.0003490658504 * np.sin(2 * mean_anom)
+    # Obliquity of the ecliptic, right ascension and declination of the sun
+    obliquity = 0.4090877234 - 0.000000006981317008 * daynum
+    rasc = np.arctan2(np.cos(obliquity) * np.sin(eclip_long), np.cos(eclip_long))
+    decl = np.arcsin(np.sin(obliquity) * np.sin(eclip_long))
+    # Local sidereal time and hour angle of the sun
+    sidereal = 4.894961213 + 6.300388099 * daynum + rlon
+    hour_ang = sidereal - rasc
+    # Local elevation and azimuth of the sun
+    elevation = np.arcsin(np.sin(decl) * math.sin(rlat) + np.cos(decl) * math.cos(rlat) * np.cos(hour_ang))
+    azimuth = np.arctan2(-np.cos(decl) * math.cos(rlat) * np.sin(hour_ang), np.sin(decl) - math.sin(rlat) * np.sin(elevation))
+    azimuth = np.mod(np.degrees(azimuth), 360)
+    elevation = np.mod(np.degrees(elevation) + 180, 360) - 180
+    if refraction:
+        targ = np.radians(elevation + (10.3 / (elevation + 5.11)))
+        elevation = elevation + (1.02 / np.tan(targ)) / 60
+    return np.round(azimuth, 2), np.round(elevation, 2)
+
+#seconds since 1970-01-01 UTC as float array
+def epoch_seconds(t):
+    if isinstance(t, np.ndarray) and t.dtype.kind == 'M':
+        return t.astype('datetime64[us]').astype(np.int64) / 1e6
+    return np.array([ calendar.timegm(ts.utctimetuple()) + ts.microsecond/1e6 for ts in t ], dtype=np.float64)
+
+#position of the sun for one point in time.
 def calc_sunpos(ts):
     elevation = 0.0
     azimuth = 0.0
     try:
-        when = (ts.year, ts.month, ts.day, ts.hour, ts.minute, ts.second, ts.utcoffset().total_seconds()/3600)    #when = (2021, 7, 13, 17, 00, 0, +2)
-        # sunpos implementation is available from https://levelup.gitconnected.com/python-sun-position-for-solar-energy-and-research-7a4ead801777?gi=4826148a2672
-        azimuth, elevation = sunpos.sunpos(when, location, False)
+        az, el = sunpos_array([ts])
+        azimuth, elevation = float(az[0]), float(el[0])
     except Exception as e:
         print(e)
     return azimuth, elevation
@@ -158,55 +197,446 @@ def add_pv_power(data):
     return data
 
 
+#precomputed solar geometry: for a fixed location, the position of the sun and the direct-beam tilt factor of every
+#plant only depend on time. so we compute them once per year on a fixed time grid and keep them on disk (./data/cache),
+#memory-mapped. a run then only needs an index lookup. the file name contains a hash of everything the table depends on,
+#so a changed location, plant geometry or resolution simply leads to a new table.
+solar_table_version = 1     #increase if the computation changes
+_solar_tables = {}          #filename >>> mapped table, per process
+
+def solar_table_filename(year, resolution_in_minutes, plants, plant_location, cache_dir):
+    key = repr((solar_table_version, tuple(plant_location), int(year), int(resolution_in_minutes), tuple(tuple(p[:2]) + tuple(shading_key(x) for x in p[2:]) for p in plants)))
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, 'solar_'+str(year)+'_'+digest+'.npy')
+
+#table for one year: rows az, el, then one row direct-beam tilt factor per plant; one column per time step from jan 1st 00:00 UTC.
+#plants: list of (plant_azimut, plant_elevat) or (plant_azimut, plant_elevat, shading), see direct_tiltfactor_array.
+def load_solar_table(year, resolution_in_minutes=5, plants=[(270, 20)], plant_location=None, cache_dir='./data/cache'):
+    if plant_location is None:
+        plant_location = location
+    filename = solar_table_filename(year, resolution_in_minutes, plants, plant_location, cache_dir)
+    if not os.path.exists(filename):
+        os.makedirs(cache_dir, exist_ok=True)
+        t = np.arange(np.datetime64(str(year)+'-01-01T00:00'), np.datetime64(str(year+1)+'-01-01T00:00'), np.timedelta64(resolution_in_minutes, 'm'))
+        az, el = sunpos_array(t, plant_location)
+        table = np.empty((2+len(plants), len(t)))
+        table[0] = az
+        table[1] = el
+        for i, plant in enumerate(plants):
+            table[2+i] = direct_tiltfactor_array(az, el, *plant)
+        with open(filename + '.tmp', 'wb') as file:
+            np.save(file, table)
+        os.replace(filename + '.tmp', filename)
+    #a long running process (see mosmixd.py) keeps the mapped tables.
+    if filename not in _solar_tables:
+        _solar_tables[filename] = np.load(filename, mmap_mode='r')
+    return _solar_tables[filename]
+
+#az, el and the direct-beam tilt factors (plants x samples) for arbitrary points in time.
+#samples on the table grid are looked up, all others (and everything if use_table is False) are computed.
+def solar_geometry(t, plants=[(270, 20)], resolution_in_minutes=5, plant_location=None, cache_dir='./data/cache', use_table=True, sunpos=None):
+    sec = epoch_seconds(t)
+    n = len(sec)
+    az = np.empty(n)
+    el = np.empty(n)
+    direct = np.empty((len(plants), n))
+    todo = np.ones(n, dtype=bool)
+    if use_table and sunpos is None and n:
+        step = 60*resolution_in_minutes
+        years = (np.datetime64('1970-01-01T00:00:00') + sec.astype('timedelta64[s]')).astype('datetime64[Y]').astype(int) + 1970
+        for year in np.unique(years):
+            t0 = calendar.timegm((int(year), 1, 1, 0, 0, 0))
+            idx = (sec - t0) / step
+            hit = (years == year) & (idx == np.floor(idx))
+            if not np.any(hit):
+                continue
+            table = load_solar_table(int(year), resolution_in_minutes, plants, plant_location, cache_dir)
+            cols = idx[hit].astype(np.int64)
+            az[hit] = table[0, cols]
+            el[hit] = table[1, cols]
+            direct[:, hit] = table[2:, cols]
+            todo &= ~hit
+    if np.any(todo):
+        if sunpos is not None:
+            az[todo], el[todo] = np.asarray(sunpos[0])[todo], np.asarray(sunpos[1])[todo]
+        else:
+            az[todo], el[todo] = sunpos_array(np.asarray(sec[todo]*1e6, dtype=np.int64).astype('datetime64[us]'), plant_location)
+        for i, plant in enumerate(plants):
+            direct[i, todo] = direct_tiltfactor_array(az[todo], el[todo], *plant)
+    return az, el, direct
+
+
+#array variants of the functions above: one call for all points in time instead of one call per sample.
+#same results as the scalar functions (within rounding).
+def angle_between_d_array(az1, el1, az2, el2):
+    az1, el1, az2, el2 = np.radians(az1), np.radians(el1), np.radians(az2), np.radians(el2)
+    cosbeta = np.cos(el1)*np.cos(el2)*np.cos(az1-az2) + np.sin(el1)*np.sin(el2)
+    return np.round(np.degrees(np.arccos(np.clip(cosbeta, -1.0, 1.0))), 2)
+
+#Neff outside 0..100 (or '-' = NaN) counts as 50% diffuse (default).
+def diffuse_normal_ratio_array(dwd_Neff, default=0.5):
+    Neff = np.asarray(dwd_Neff, dtype=np.float64)
+    diffus = np.where((Neff >= 0) & (Neff <= 100), Neff / 100.0, default)
+    return diffus, 1-diffus
+
+#shading of the direct light, per array. besides the simple rule (az_min, el_max) there are two kinds of masks:
+#- horizon: elevation of the horizon (degree) per azimuth bin, bins equally spaced from 0 (north) clockwise.
+#  the sun is blocked while it is below the horizon of its bin.
+#- raster: near-field obstructions (trees, chimney...) as a 2-D grid azimuth x elevation with the fraction of direct
+#  light that passes (0..1). azimuth bins cover 0..360, elevation bins 0..90 degree.
+#both are applied by plain index lookups, so a detailed mask costs about the same as the simple rule.
+horizon_bins = 360
+
+#a horizon profile: text file with two columns azimuth and elevation in degree (north = 0, clockwise),
+#separated by blanks, ',' or ';'. other azimuth conventions (e.g. south = 0) must be converted before.
+def load_horizon(filename):
+    with open(filename, 'r') as file:
+        lines = [ line.replace(';', ' ').replace(',', ' ') for line in file ]
+    profile = np.loadtxt(lines, comments='#', ndmin=2)
+    return resample_horizon(profile[:,0], profile[:,1])
+
+#resample an arbitrary (azimuth, elevation) profile to horizon_bins equally spaced bins (periodic interpolation).
+def resample_horizon(azimuth, elevation):
+    centers = (np.arange(horizon_bins) + 0.5) * 360.0 / horizon_bins
+    return np.interp(centers, np.asarray(azimuth, dtype=np.float64) % 360, np.asarray(elevation, dtype=np.float64), period=360)
+
+#shading spec from the plant configuration -> what direct_tiltfactor_array expects:
+#None, [az_min, el_max], or a dict with 'horizon' and/or 'raster'. the values are either inline lists or file names
+#(horizon: text/csv see load_horizon, raster: .npy).
+def load_shading(spec):
+    if spec is None:
+        return None
+    if not isinstance(spec, dict):
+        az_min, el_max = spec
+        return (az_min, el_max)
+    shading = {}
+    horizon = spec.get('horizon')
+    if horizon is not None:
+        if isinstance(horizon, str):
+            shading['horizon'] = load_horizon(horizon)
+        else:
+            horizon = np.asarray(horizon, dtype=np.float64)
+            shading['horizon'] = horizon if horizon.ndim == 1 else resample_horizon(horizon[:,0], horizon[:,1])
+    raster = spec.get('raster')
+    if raster is not None:
+        raster = np.load(raster) if isinstance(raster, str) else raster
+        shading['raster'] = np.clip(np.asarray(raster, dtype=np.float64), 0, 1)
+    return shading
+
+#fraction of direct light passing horizon and raster, for all samples at once.
+def shading_factor(az, el, shading):
+    factor = np.ones(len(az))
+    horizon = shading.get('horizon')
+    if horizon is not None:
+        ia = (np.asarray(az) * (len(horizon) / 360.0)).astype(np.intp) % len(horizon)
+        factor[el < horizon[ia]] = 0
+    raster = shading.get('raster')
+    if raster is not None:
+        n_az, n_el = raster.shape
+        ia = (np.asarray(az) * (n_az / 360.0)).astype(np.intp) % n_az
+        ie = np.clip((np.asarray(el) * (n_el / 90.0)).astype(np.intp), 0, n_el-1)
+        factor *= raster[ia, ie]
+    return factor
+
+#identifies a shading spec in the name of the solar table (masks by content, their repr would be truncated).
+def shading_key(shading):
+    if isinstance(shading, dict):
+        return tuple( (name, hashlib.sha1(np.ascontiguousarray(mask).tobytes()).hexdigest(), mask.shape) for name, mask in sorted(shading.items()) )
+    return shading
+
+#the direct-beam part of the tilt factor (tcf_norm in calc_tiltfactor). it only depends on the position of the sun
+#and the plant geometry, not on the weather - so it can be precomputed (see solar_geometry).
+#shading: (az_min, el_max) - no direct light if the sun is further west than az_min and lower than el_max -
+#or a dict of masks, see load_shading. None: no shading.
+def direct_tiltfactor_array(az, el, plant_azimut, plant_elevat, shading=(225, 17)):
+    tcf_norm = np.zeros(len(az))
+    up = el > 0.5
+    fsun = 1/np.sin(np.radians(el[up]))
+    beta = angle_between_d_array(az[up], el[up], plant_azimut, 90-plant_elevat)
+    tcf_norm[up] = np.where(beta < 90, np.cos(np.radians(beta))*fsun, 0)
+    if isinstance(shading, dict):
+        tcf_norm *= shading_factor(az, el, shading)
+    elif shading is not None:
+        #abschattung... der default (225, 17) stimmt natuerlich nur fuer genau meine anlage(n)
+        az_min, el_max = shading
+        tcf_norm[(az > az_min) & (el < el_max)] = 0
+    return tcf_norm
+
+#azimuth/elevation of the sun (sunpos) or the whole direct-beam factor (direct) can be passed in if they are known already.
+def calc_tiltfactor_array(t, Neff, plant_azimut, plant_elevat, sunpos=None, direct=None):
+    if direct is None:
+        az, el = sunpos if sunpos is not None else sunpos_array(t)
+        direct = direct_tiltfactor_array(az, el, plant_azimut, plant_elevat)
+    r_diff, r_norm = diffuse_normal_ratio_array(Neff)
+    tcf_diff = 1.0
+    return r_diff * tcf_diff + r_norm * direct
+
+def calc_pv_E_array(t, Rad1h, Neff, plant_azimut, plant_elevat, sunpos=None, direct=None):
+    rad_W = np.asarray(Rad1h, dtype=np.float64) / 3.6
+    tiltf = calc_tiltfactor_array(t, Neff, plant_azimut, plant_elevat, sunpos, direct)
+    return np.round(rad_W * tiltf, 2)
+
+def calc_pv_T_array(E, T_ambient, eps=0.85):
+    bol = 5.67e-8
+    A   = 1.0
+    with np.errstate(invalid='ignore'):
+        Tb  = np.power(E/(eps*bol*A), 1/4)
+    #same as max(T_ambient, Tb) per sample, also with NaN (e.g. negative E): Tb only if it is greater.
+    T_ambient = np.asarray(T_ambient, dtype=np.float64)
+    return np.where(Tb > T_ambient, Tb, T_ambient)
+
+def calc_pvpower_array(t, Rad1h, Neff, TTT, sunpos=None, direct=None):
+    ##plant-specific...
+    plant_name = 'West'
+    plant_azimut = 270              # 270° = West
+    plant_elevat = 20               # Dachneigung in Grad
+    ##...plant-specific
+
+    if direct is None:
+        direct = solar_geometry(t, [(plant_azimut, plant_elevat)], sunpos=sunpos)[2][0]
+    E = calc_pv_E_array(t, Rad1h, Neff, plant_azimut, plant_elevat, direct=direct)
+    T = calc_pv_T_array(E, TTT)
+
+    ##plant-specific...
+    temp_factor   = 1+(T-(273.15+25))*(-0.00375)
+    plant_area    = 28*1.65*0.99    #in m2
+    plant_eff    = 0.189 * 0.976    #optimistisch, nach datenblaetter
+    pwr = E * plant_area * plant_eff * temp_factor
+    pwr = np.minimum(pwr, 7000)     # Wechselrichter-limit in Watt
+    ##...plant-specific
+
+    pwr = np.round(pwr)
+    return plant_name, pwr, E, T
+
+#plant configuration: sites (with their location) -> inverters (with their power limit) -> arrays (module fields).
+#the default is my plant, as hardcoded in calc_pvpower. load_plants reads the same structure from a json file
+#(see plants_example.json). names of inverters and arrays are used for the output columns and must be unique.
+#array keys: azimut (degree, 270 = west), elevat (tilt in degree), area (m2), efficiency, temp_coeff (1/K),
+#shading ([az_min, el_max], {"horizon": ..., "raster": ...} or null, see load_shading).
+#optional: eps (emissivity in calc_pv_T, 0.85) and diffuse_default (diffuse share if Neff is missing, 0.5) -
+#what backtest.py fits besides efficiency and temp_coeff.
+default_plants = {'sites': [
+    {'name': 'Nattheim', 'location': location, 'inverters': [
+        {'name': 'West', 'limit': 7000, 'arrays': [
+            {'name': 'West', 'azimut': 270, 'elevat': 20, 'area': 28*1.65*0.99, 'efficiency': 0.189 * 0.976, 'temp_coeff': -0.00375, 'shading': [225, 17]},
+        ]},
+    ]},
+]}
+
+def load_plants(filename):
+    with open(filename, 'r') as file:
+        return json.load(file)
+
+#evaluate all arrays of all sites in one vectorized pass per site: the sun position (and the precomputed direct-beam
+#factors) are shared by all arrays of a site, arrays are summed per inverter before clipping to its limit.
+#returns a dict of output columns: per array 'pv<array>E' and 'pv<array>T', per inverter 'pv<inverter>P' (in this order).
+def evaluate_plants(t, Rad1h, Neff, TTT, plants=None, resolution_in_minutes=5, cache_dir='./data/cache'):
+    if plants is None:
+        plants = default_plants
+    rad_W = np.asarray(Rad1h, dtype=np.float64) / 3.6
+    TTT = np.asarray(TTT, dtype=np.float64)
+    columns = {}
+    for site in plants['sites']:
+        arrays = [ array for inverter in site['inverters'] for array in inverter['arrays'] ]
+        if not arrays:
+            continue
+        geometry = [ (a['azimut'], a['elevat'], load_shading(a.get('shading'))) for a in arrays ]
+        az, el, direct = solar_geometry(t, geometry, resolution_in_minutes, tuple(site.get('location', location)), cache_dir)
+        E, T, pwr = arrays_power(rad_W, Neff, TTT, direct, *array_parameters(arrays))
+        #sum per inverter (arrays are grouped by inverter), then clip.
+        inverters = [ inverter for inverter in site['inverters'] if inverter['arrays'] ]
+        counts = [ len(inverter['arrays']) for inverter in inverters ]
+        pwr = np.add.reduceat(pwr, np.cumsum(counts) - counts, axis=0)
+        limit = np.array([ [inverter.get('limit', np.inf)] for inverter in inverters ])
+        pwr = np.round(np.minimum(pwr, limit))
+        i = 0
+        for k, inverter in enumerate(inverters):
+            names = [ array['name'] for array in inverter['arrays'] ]
+            for j, name in enumerate(names):
+                columns['pv'+name+'E'] = E[i+j]
+            columns['pv'+inverter['name']+'P'] = pwr[k]
+            for j, name in enumerate(names):
+                columns['pv'+name+'T'] = T[i+j]
+            i += len(names)
+    return columns
+
+#the output columns of evaluate_plants for a plant configuration: {'E': ['pv<array>E', ...], 'P': ['pv<inverter>P', ...],
+#'T': ['pv<array>T', ...]}.
+def pv_columns(plants=None):
+    plants = plants or default_plants
+    inverters = [ inverter for site in plants['sites'] for inverter in site['inverters'] if inverter['arrays'] ]
+    arrays = [ array['name'] for inverter in inverters for array in inverter['arrays'] ]
+    return {'E': [ 'pv'+name+'E' for name in arrays ], 'P': [ 'pv'+inverter['name']+'P' for inverter in inverters ],
+            'T': [ 'pv'+name+'T' for name in arrays ]}
+
+#parameters of the arrays as column vectors (arrays x 1), in the order arrays_power takes them.
+array_parameter_keys = ['area', 'efficiency', 'temp_coeff', 'eps', 'diffuse_default']
+array_parameter_defaults = {'temp_coeff': -0.00375, 'eps': 0.85, 'diffuse_default': 0.5}
+
+def array_parameters(arrays):
+    return [ np.array([ [a.get(key, array_parameter_defaults.get(key))] for a in arrays ], dtype=np.float64) for key in array_parameter_keys ]
+
+#the model of calc_pvpower_array for several arrays at once (arrays x samples): irradiation in the plane E, panel
+#temperature T and power before the inverter. the parameters are column vectors (see array_parameters), direct the
+#direct-beam tilt factors of the arrays. rounded=False skips the rounding of E (smooth, for fitting).
+def arrays_power(rad_W, Neff, TTT, direct, area, eff, tc, eps=0.85, diffuse_default=0.5, rounded=True):
+    r_diff, r_norm = diffuse_normal_ratio_array(Neff, diffuse_default)
+    E = rad_W * (r_diff * 1.0 + r_norm * direct)
+    if rounded:
+        E = np.round(E, 2)
+    T = calc_pv_T_array(E, TTT, eps)
+    temp_factor = 1+(T-(273.15+25))*(tc)
+    return E, T, E * area * eff * temp_factor
+
+#identifies a plant configuration (incremental runs must start over if it changes).
+def plants_key(plants):
+    return hashlib.sha1(json.dumps(plants, sort_keys=True, default=lambda x: np.asarray(x).tolist()).encode('utf-8')).hexdigest()
+
+#incremental version of evaluate_plants: a sample only depends on its own t, Rad1h, Neff and TTT, so only samples whose
+#inputs changed since the last run (or which are new) are evaluated, all others are taken from previous.
+#previous: the state returned by the last run (see load_pv_state), or None. returns the columns and the new state.
+def evaluate_plants_incremental(t, Rad1h, Neff, TTT, previous=None, plants=None, resolution_in_minutes=5, cache_dir='./data/cache'):
+    if plants is None:
+        plants = default_plants
+    sec = epoch_seconds(t)
+    inputs = np.array([Rad1h, Neff, TTT], dtype=np.float64)
+    key = plants_key(plants)
+    todo = np.ones(len(sec), dtype=bool)
+    if previous is not None and previous['plants'] == key and len(previous['sec']):
+        old_sec = previous['sec']
+        pos = np.clip(np.searchsorted(old_sec, sec), 0, len(old_sec)-1)
+        old = previous['inputs'][:, pos]
+        same = (old_sec[pos] == sec) & np.all((inputs == old) | (np.isnan(inputs) & np.isnan(old)), axis=0)
+        todo = ~same
+    idx = np.flatnonzero(todo)
+    fresh = None
+    if len(idx) or previous is None:
+        fresh = evaluate_plants(np.asarray(t)[idx], inputs[0, idx], inputs[1, idx], inputs[2, idx], plants, resolution_in_minutes, cache_dir)
+    names = list(fresh.keys()) if fresh is not None else previous['names']
+    columns = {}
+    #the reused samples usually form one block (same grid, a bit later) - then copy it in one go.
+    reuse = np.flatnonzero(~todo)
+    block = len(reuse) and pos[reuse[-1]] - pos[reuse[0]] == reuse[-1] - reuse[0]
+    for name in names:
+        col = np.empty(len(sec))
+        if block:
+            col[reuse[0]:reuse[-1]+1] = previous['columns'][name][pos[reuse[0]]:pos[reuse[-1]]+1]
+        elif len(reuse):
+            col[reuse] = previous['columns'][name][pos[reuse]]
+        if fresh is not None:
+            col[idx] = fresh[name]
+        columns[name] = col
+    state = {'sec': sec, 'inputs': inputs, 'plants': key, 'names': names, 'columns': columns, 'evaluated': todo}
+    return columns, state
+
+def save_pv_state(state_filename, state):
+    try:
+        arrays = { 'out_'+name: state['columns'][name] for name in state['names'] }
+        with open(state_filename + '.tmp', 'wb') as file:
+            np.savez(file, sec=state['sec'], inputs=state['inputs'], plants=np.array(state['plants']), names=np.array(state['names']), **arrays)
+        os.replace(state_filename + '.tmp', state_filename)
+    except Exception as e:
+        print(e)
+
+def load_pv_state(state_filename):
+    if not os.path.exists(state_filename):
+        return None
+    try:
+        with np.load(state_filename) as npz:
+            names = [ str(name) for name in npz['names'] ]
+            return {'sec': npz['sec'], 'inputs': npz['inputs'], 'plants': str(npz['plants']), 'names': names,
+                    'columns': { name: npz['out_'+name] for name in names }}
+    except Exception as e:
+        print(e)
+    return None
+
+#output columns (see evaluate_plants) >>> rows. power as int, like add_pv_power. NaN (no Rad1h) becomes '-'
+#(save_data stores such a column as float64 with NaN again, see csv2csv.rows_to_columns).
+def add_columns(data, columns):
+    for key, values in columns.items():
+        values = [ '-' if v != v else (int(v) if key.endswith('P') else v) for v in values.tolist() ]
+        for line, v in zip(data, values):
+            line[key] = v
+    return data
+
+#inputs of the pv model from rows ('-' becomes NaN).
+def pv_inputs(data):
+    t    = [ line['t'] for line in data ]
+    Rad1h = [ np.nan if isinstance(line['Rad1h'], str) else line['Rad1h'] for line in data ]
+    Neff = [ np.nan if isinstance(line['Neff'], str) else line['Neff'] for line in data ]
+    TTT  = [ np.nan if isinstance(line['TTT'], str) else line['TTT'] for line in data ]
+    return t, Rad1h, Neff, TTT
+
+#same as add_pv_power, but the whole data in one vectorized pass - and for all configured plants.
+def add_pv_power_array(data, plants=None):
+    t, Rad1h, Neff, TTT = pv_inputs(data)
+    return add_columns(data, evaluate_plants(t, Rad1h, Neff, TTT, plants))
+
+
 #use latest csv2csv-output and translate the data to photovoltaic power. maybe not a generic solution for everybody.
-def evaluate_my_latest_csv():
+#incremental: only evaluate samples whose inputs changed since the last run, the state is kept in state_filename.
+#ext: file format of input and output, see csv2csv.save_data.
+def evaluate_my_latest_csv(incremental=False, state_filename='./data/cache/pvest_state.npz', ext='.csv'):
     datecolumns =['t', 'tLocal']
     floatcolumns=['Rad1h','Neff','N','DD','FF','PPPP','TTT']
     datenow = dt.datetime.now() #- dt.timedelta(days=7)
     todaystr  = datenow.strftime('%Y-%m-%d')
-    data = csv2csv.parse(csv2csv.split(csv2csv.load('./data/mosmix_refined_'+todaystr+'.csv')), floatcolumns, datecolumns)
-    data = add_pv_power(data)
-    csv2csv.save('./data/mosmix_pvest_'+todaystr+'.csv', data)
+    data = csv2csv.load_data('./data/mosmix_refined_'+todaystr+ext, floatcolumns, datecolumns)
+    plants = load_plants('./plants.json') if os.path.exists('./plants.json') else default_plants
+    if incremental:
+        t, Rad1h, Neff, TTT = pv_inputs(data)
+        columns, state = evaluate_plants_incremental(t, Rad1h, Neff, TTT, load_pv_state(state_filename), plants)
+        os.makedirs(os.path.dirname(state_filename), exist_ok=True)
+        save_pv_state(state_filename, state)
+        data = add_columns(data, columns)
+    else:
+        data = add_pv_power_array(data, plants)
+    csv2csv.save_data('./data/mosmix_pvest_'+todaystr+ext, data)
 
 
 
 #reload what we have saved in plot some illustrative results - for demonstration only.
-def plot_my_latest_csv():
+#works on columns: with a columnar ext (e.g. '.npy') the file is just mapped, nothing parsed.
+#the pv columns follow the plant configuration (plants.json if there, as in evaluate_my_latest_csv).
+def plot_my_latest_csv(ext='.csv', plants=None):
+    plants = plants or (load_plants('./plants.json') if os.path.exists('./plants.json') else default_plants)
+    pv = pv_columns(plants)
     datecolumns =['t', 'tLocal']
-    floatcolumns=['Rad1h','Neff','N','DD','FF','PPPP','TTT','pvWestP','pvWestE','pvWestT']
+    floatcolumns=['Rad1h','Neff','N','DD','FF','PPPP','TTT'] + pv['P'] + pv['E'] + pv['T']
     date0 = dt.datetime.now() #- dt.timedelta(days=2)
     datestr = date0.strftime('%Y-%m-%d')
-    data = csv2csv.parse(csv2csv.split(csv2csv.load('./data/mosmix_pvest_'+datestr+'.csv')), floatcolumns, datecolumns)
+    data = csv2csv.load_data_columns('./data/mosmix_pvest_'+datestr+ext, floatcolumns, datecolumns)
     
-    tu = [ line['t'] for line in data]
-    tl = [ line['tLocal'] for line in data]
-    rad = [ line['Rad1h']/3.6 for line in data]
-    ttt = [ line['TTT']-273.15 for line in data]
-    e = [ line['pvWestE'] for line in data]
-    p = [ line['pvWestP'] for line in data]
-    temppv = [ line['pvWestT']-273.15 for line in data]
+    tu = data['t']
+    tl = data['tLocal']
+    rad = data['Rad1h']/3.6
+    ttt = data['TTT']-273.15
     tumin = tu[0]
     tumax = tu[-1]
     tlmin = tl[0]
     tlmax = tl[-1]
     
+    import matplotlib.pyplot as plt
     plt.close('all')
     f, axs = plt.subplots(3,1)
     axs[0].plot(tu,rad,'-k',label='flat earth')
-    axs[0].plot(tu,e,'-r',label='in my pv plane')
+    for key in pv['E']:
+        axs[0].plot(tu,data[key],label='in pv plane '+key[2:-1])
     axs[0].legend()
     axs[0].set_xlabel("t [UTC]")
     axs[0].set_ylabel("E radiation [W/m²]")
     axs[0].grid()
     axs[0].set_xlim((tumin,tumax))
-    axs[1].plot(tl,p,'-r',label='estimation in advance')
+    for key in pv['P']:
+        axs[1].plot(tl,data[key],label='estimation in advance '+key[2:-1])
     axs[1].legend()
     axs[1].set_xlabel("t [local=MESZ]")
     axs[1].set_ylabel("PV AC Power [W]")
     axs[1].grid()
     axs[1].set_xlim((tlmin,tlmax))
     axs[2].plot(tu,ttt,'-k',label='TTT = ambient')
-    axs[2].plot(tu,temppv,'-b',label='estimation for pv panel')
+    for key in pv['T']:
+        axs[2].plot(tu,data[key]-273.15,label='estimation for pv panel '+key[2:-1])
     axs[2].legend()
     axs[2].set_xlabel("t [UTC]")
     axs[2].set_ylabel("Temperature [°C]")
@@ -19,9 +19,29 @@ import xml.etree.ElementTree as ET
 import csv
 from zipfile import ZipFile
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import io
+import shutil
+import json
+import hashlib
+import threading
+import re
 import os
+import numpy as np
 from datetime import datetime
+import columnstore
+
+
+# the following definition of ns is taken from https://github.com/kilianknoll/DWDForecast/blob/master/dwdforecast.py
+KML_NS = {'dwd': 'https://opendata.dwd.de/weather/lib/pointforecast_dwd_extension_V1_0.xsd', 'gx': 'http://www.google.com/kml/ext/2.2',
+          'kml': 'http://www.opengis.net/kml/2.2', 'atom': 'http://www.w3.org/2005/Atom', 'xal':'urn:oasis:names:tc:ciq:xsdschema:xAL:2.0'}
+
+dwd_base_url    = 'https://opendata.dwd.de/weather/local_forecasts/mos'
+default_timeout = 30    #seconds, per request (connect and read)
+#from this number of stations on, one all_stations download (~40 MB kmz, parsed once) is cheaper than many single_stations downloads.
+all_stations_threshold = 200
 
 
 # extract certain values from KML file
@@ -42,9 +62,7 @@ def parseKML(kml_content, elements):
     timestamps = []
     stationValues = {}
     try:
-        # the following definition of ns is taken from https://github.com/kilianknoll/DWDForecast/blob/master/dwdforecast.py
-        ns  = {'dwd': 'https://opendata.dwd.de/weather/lib/pointforecast_dwd_extension_V1_0.xsd', 'gx': 'http://www.google.com/kml/ext/2.2',
-                'kml': 'http://www.opengis.net/kml/2.2', 'atom': 'http://www.w3.org/2005/Atom', 'xal':'urn:oasis:names:tc:ciq:xsdschema:xAL:2.0'}
+        ns  = KML_NS
         xmlroot = ET.fromstring(kml_content)
 
         xtimestamps = xmlroot.findall('kml:Document/kml:ExtendedData/dwd:ProductDefinition/dwd:ForecastTimeSteps/dwd:TimeStep',ns)
@@ -62,10 +80,225 @@ def parseKML(kml_content, elements):
                 stationValues[stationname][key] =  valuesEl
     except Exception as e:
         print(e)
-        
+
+    return timestamps, stationValues
+
+
+#open a local kml or kmz file for streaming (binary). for kmz, the first (and only) member is opened without extracting it to ram.
+def open_kml(local_filename):
+    if local_filename.lower().endswith('.kmz'):
+        return open_kmz(local_filename)
+    return open(local_filename, 'rb')
+
+#open the kml inside a kmz as binary stream. kmz_source is a filename, the kmz content (bytes) or a binary file object.
+#the member is decompressed while it is read, so neither the kml bytes nor a decoded str are ever held in ram.
+def open_kmz(kmz_source):
+    if isinstance(kmz_source, (bytes, bytearray, memoryview)):
+        kmz_source = io.BytesIO(kmz_source)  #shares the buffer, no copy
+    zipfile = ZipFile(kmz_source)
+    return zipfile.open(zipfile.namelist()[0])
+
+
+# same as parseKML, but streaming: the xml is read in chunks and one Placemark is yielded at a time.
+# elements are freed as soon as they are evaluated, so memory stays bounded even for all_stations files.
+# kml_source is a filename (kml or kmz) or a binary file object.
+# if stations is given, all other stations are skipped (their values are never kept), and reading stops
+# as soon as all requested stations have been found.
+# yields (timestamps, stationname, valuesDict) - timestamps is the same list for all stations.
+# with split=False, the values are the unsplit text of dwd:value (for parsers that do the splitting themselves).
+def iterparseKML(kml_source, elements, stations=None, split=True):
+    ns = KML_NS
+    tag_document  = '{'+ns['kml']+'}Document'
+    tag_placemark = '{'+ns['kml']+'}Placemark'
+    tag_name      = '{'+ns['kml']+'}name'
+    tag_timestep  = '{'+ns['dwd']+'}TimeStep'
+    tag_forecast  = '{'+ns['dwd']+'}Forecast'
+    tag_value     = '{'+ns['dwd']+'}value'
+    att_element   = '{'+ns['dwd']+'}elementName'
+    wanted  = None if stations is None else set(stations)
+    wantedElements = set(elements)
+
+    if isinstance(kml_source, str):
+        kml_source = open_kml(kml_source)
+    with kml_source:
+        timestamps = []
+        document = None
+        stationname = None
+        valuesDict = None
+        skip = False
+        element = None
+        for event, xel in ET.iterparse(kml_source, events=('start', 'end')):
+            tag = xel.tag
+            if event == 'start':
+                if tag == tag_placemark:
+                    stationname = None
+                    valuesDict = {key: [] for key in elements}
+                    skip = False
+                elif tag == tag_forecast:
+                    element = xel.get(att_element)
+                elif tag == tag_document:
+                    document = xel
+                continue
+            if tag == tag_value:
+                if not skip and element in wantedElements:
+                    valuesDict[element] = xel.text.split() if split else xel.text
+                xel.clear()
+            elif tag == tag_name and valuesDict is not None and stationname is None:
+                stationname = xel.text
+                skip = wanted is not None and stationname not in wanted
+            elif tag == tag_timestep:
+                timestamps.append(xel.text)
+            elif tag == tag_placemark:
+                if not skip:
+                    yield timestamps, stationname, valuesDict
+                    if wanted is not None:
+                        wanted.discard(stationname)
+                        if not wanted:
+                            break
+                valuesDict = None
+                if document is not None:
+                    document.clear()  #drop processed placemarks (and everything before them)
+
+
+#convenience wrapper around iterparseKML with the same return values as parseKML.
+def parseKML_stream(kml_source, elements, stations=None):
+    timestamps = []
+    stationValues = {}
+    try:
+        for timestamps, stationname, valuesDict in iterparseKML(kml_source, elements, stations):
+            stationValues[stationname] = valuesDict
+    except Exception as e:
+        print(e)
     return timestamps, stationValues
 
 
+#dwd timestamps ('2021-07-11T16:00:00.000Z', always UTC) as datetime64 vector, parsed once for all stations.
+def timestamps_to_datetime64(timestamps):
+    return np.array([ts.rstrip('Z') for ts in timestamps], dtype='datetime64[ms]').astype('datetime64[s]')
+
+#dwd value string (or list of value strings) -> float array. the missing marker '-' becomes NaN.
+_missing_value = re.compile(r'(?<!\S)-(?!\S)')
+def values_to_array(values, dtype=np.float64):
+    text = values if isinstance(values, str) else ' '.join(values)
+    if '-' in text:
+        text = _missing_value.sub('nan', text)
+    return np.fromstring(text, dtype=dtype, sep=' ')
+
+# columnar variant of parseKML_stream: instead of lists of strings, every station gets one 2-D array
+# (elements x timesteps, NaN where dwd sends '-'), and the timestamps are a single datetime64 vector.
+# returns timestamps, {stationname: array}. row i of each array belongs to elements[i].
+def parseKML_columnar(kml_source, elements, stations=None, dtype=np.float64):
+    timestamps = np.array([], dtype='datetime64[s]')
+    stationArrays = {}
+    try:
+        n = None
+        for ts, stationname, valuesDict in iterparseKML(kml_source, elements, stations, split=False):
+            if n is None:
+                timestamps = timestamps_to_datetime64(ts)
+                n = len(timestamps)
+            #elements that are missing or have the wrong length stay NaN.
+            values = np.full((len(elements), n), np.nan, dtype=dtype)
+            for i, key in enumerate(elements):
+                if valuesDict[key]:
+                    row = values_to_array(valuesDict[key], dtype)
+                    if len(row) == n:
+                        values[i] = row
+            stationArrays[stationname] = values
+    except Exception as e:
+        print(e)
+    return timestamps, stationArrays
+
+
+# like iterparseKML(split=False), but without an xml parser: the raw bytes are scanned with regular expressions,
+# a block of whole placemarks at a time. this relies on the fixed layout of dwd's files (kml:/dwd: prefixes,
+# dwd:value right inside dwd:Forecast); if that does not match, nothing is yielded.
+# yields (timestamps, stationname, valuesDict) with the values as raw bytes (b'' for elements the station does not have).
+# with strict=True, a document that does not end with </kml:kml> (a truncated file) raises at the end instead of
+# passing silently with the placemarks found so far.
+_placemark_end = b'</kml:Placemark>'
+_kml_end = b'</kml:kml>'
+_re_timestep = re.compile(rb'<dwd:TimeStep>([^<]*)</dwd:TimeStep>')
+_re_name = re.compile(rb'<kml:name>([^<]*)</kml:name>')
+_re_forecast = re.compile(rb'<dwd:Forecast\s+dwd:elementName="([^"]*)"\s*>\s*<dwd:value>([^<]*)</dwd:value>')
+def iterscanKML(kml_source, elements, stations=None, blocksize=2**24, strict=False):
+    wanted = None if stations is None else set(stations)
+    keys = { el.encode(): el for el in elements }
+    if isinstance(kml_source, str):
+        kml_source = open_kml(kml_source)
+    with kml_source:
+        timestamps = None
+        rest = b''
+        eof = False
+        while not eof:
+            block = kml_source.read(blocksize)
+            data = rest + block
+            if block:
+                end = data.rfind(_placemark_end)
+                if end < 0:
+                    rest = data
+                    continue
+                end += len(_placemark_end)
+                data, rest = data[:end], data[end:]
+            else:
+                eof = True
+            if timestamps is None:
+                timestamps = [ ts.decode() for ts in _re_timestep.findall(data) ]
+            for placemark in data.split(_placemark_end):
+                name = _re_name.search(placemark)
+                if name is None:
+                    continue
+                stationname = name.group(1).decode('iso-8859-1')
+                if wanted is not None and stationname not in wanted:
+                    continue
+                valuesDict = { key: b'' for key in elements }
+                for forecast in _re_forecast.finditer(placemark, name.end()):
+                    key = keys.get(forecast.group(1))
+                    if key is not None:
+                        valuesDict[key] = forecast.group(2)
+                yield timestamps, stationname, valuesDict
+                if wanted is not None:
+                    wanted.discard(stationname)
+                    if not wanted:
+                        return
+            if eof and strict and not data.rstrip().endswith(_kml_end):
+                raise Exception('kml incomplete (truncated?)')
+
+#issue time of a MOSMIX run (dwd:IssueTime in the ProductDefinition at the top of the file) as datetime64 UTC, None if there is none.
+_re_issuetime = re.compile(rb'<dwd:IssueTime>([^<]*)</dwd:IssueTime>')
+def kml_issue_time(kml_source, head=2**16):
+    if isinstance(kml_source, str):
+        kml_source = open_kml(kml_source)
+    with kml_source:
+        found = _re_issuetime.search(kml_source.read(head))
+    return np.datetime64(found.group(1).decode().rstrip('Z'), 's') if found else None
+
+# parseKML_columnar on top of iterscanKML. if the scan finds nothing, the xml parser is used instead (filenames only).
+# strict=True: errors (incl. a truncated file, see iterscanKML) are raised instead of printed, and there is no fallback.
+def scanKML_columnar(kml_source, elements, stations=None, dtype=np.float64, strict=False):
+    timestamps = np.array([], dtype='datetime64[s]')
+    stationArrays = {}
+    source = kml_source
+    try:
+        n = None
+        for ts, stationname, valuesDict in iterscanKML(kml_source, elements, stations, strict=strict):
+            if n is None:
+                timestamps = timestamps_to_datetime64(ts)
+                n = len(timestamps)
+            values = np.full((len(elements), n), np.nan, dtype=dtype)
+            for i, key in enumerate(elements):
+                if valuesDict[key]:
+                    row = values_to_array(valuesDict[key].decode('iso-8859-1'), dtype)
+                    if len(row) == n:
+                        values[i] = row
+            stationArrays[stationname] = values
+    except Exception as e:
+        if strict:
+            raise
+        print(e)
+    if not stationArrays and isinstance(source, str) and not strict:
+        return parseKML_columnar(source, elements, stations, dtype)
+    return timestamps, stationArrays
+
 # save extracted values as csv
 def save_csv(csv_filename, stationname, timestamps, valuesDict):
     try: 
@@ -85,54 +318,279 @@ def save_csv(csv_filename, stationname, timestamps, valuesDict):
         print(e)
     return 
 
+#save extracted values: as csv (save_csv) or, for the columnar extensions (.npy, .parquet, .feather), as typed columns
+#with datetime64 timestamps and NaN for '-' (see columnstore).
+def save_station(filename, stationname, timestamps, valuesDict):
+    if not columnstore.is_columnar(filename):
+        return save_csv(filename, stationname, timestamps, valuesDict)
+    columns = {'t': timestamps_to_datetime64(timestamps)}
+    for key, values in valuesDict.items():
+        values = values_to_array(values) if len(values) else np.array([])
+        columns[key] = values if len(values) == len(columns['t']) else np.full(len(columns['t']), np.nan)
+    columnstore.save_columns(filename, columns)
+
+
+#one shared session for all downloads: keeps connections to opendata.dwd.de alive (pooling)
+#and retries failed requests with exponential backoff.
+def make_session(pool_size=8, retries=3, backoff=0.5):
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=['GET'])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+#download the raw kmz. raises on any error (unlike download_kml, which only prints).
+def download_kmz(dwd_url_kmz, session=None, timeout=default_timeout):
+    response = (session or requests).get(dwd_url_kmz, timeout=timeout)
+    response.raise_for_status()
+    return response.content
+
+#optionally save the kml file inside a kmz, and/or the kmz itself (with a timestamp suffix) locally.
+#kmz_source is the kmz content (bytes) or a local filename. both are copied as streams, not via ram.
+def store_kmz(kmz_source, dwd_url_kmz, local_folder_for_kml=None, local_folder_for_kmz=None):
+    outfilename_kml = None
+    outfilename_kmz = None
+    if local_folder_for_kml:
+        with open_kmz(kmz_source) as member:
+            outfilename_kml = os.path.join(local_folder_for_kml, member.name)
+            with open(outfilename_kml, 'wb') as file:
+                shutil.copyfileobj(member, file)
+    if local_folder_for_kmz:
+        outfilename_kmz = dwd_url_kmz.split('/')[-1]
+        nowstr = datetime.now().strftime('%Y%m%d_%H%M')
+        outfilename_kmz = outfilename_kmz[:-4] + '_' + nowstr + outfilename_kmz[-4:]
+        outfilename_kmz = os.path.join(local_folder_for_kmz, outfilename_kmz)
+        if isinstance(kmz_source, str):
+            shutil.copyfile(kmz_source, outfilename_kmz)
+        else:
+            with open(outfilename_kmz, 'bw') as file:
+                file.write(kmz_source)
+    return outfilename_kml, outfilename_kmz
+
+#de-zip the kml file inside a kmz (bytes or filename), and optionally save both locally.
+def extract_kml(kmz_content, dwd_url_kmz, local_folder_for_kml=None, local_folder_for_kmz=None):
+    with open_kmz(kmz_content) as member:
+        kml_content = member.read().decode("utf-8") 
+    outfilename_kml, outfilename_kmz = store_kmz(kmz_content, dwd_url_kmz, local_folder_for_kml, local_folder_for_kmz)
+    return kml_content, outfilename_kml, outfilename_kmz
+
+#local cache for kmz files, keyed by url. remembers the validators (ETag/Last-Modified) of the last download
+#and sends them with the next request. if dwd answers 304 (no new MOSMIX run), nothing is transferred.
+#counters: hits (304), misses (new content), bytes_downloaded, bytes_saved (size of the cached file on hits).
+#for download_kml it also keeps the kml last extracted per url in ram, so a 304 needs neither unzip nor decode.
+class KmzCache:
+    def __init__(self, cache_dir='./data/cache'):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self.bytes_downloaded = 0
+        self.bytes_saved = 0
+        self._extracted = {}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _filenames(self, dwd_url_kmz):
+        key = hashlib.sha1(dwd_url_kmz.encode('utf-8')).hexdigest()[:16]
+        name = dwd_url_kmz.split('/')[-1][:-4] + '_' + key
+        return os.path.join(self.cache_dir, name + '.kmz'), os.path.join(self.cache_dir, name + '.json')
+
+    #returns (local filename of the kmz, modified). modified is False if the cached file is still up to date.
+    def fetch(self, dwd_url_kmz, session=None, timeout=default_timeout):
+        kmz_filename, meta_filename = self._filenames(dwd_url_kmz)
+        meta = {}
+        if os.path.exists(kmz_filename) and os.path.exists(meta_filename):
+            with open(meta_filename, 'r') as file:
+                meta = json.load(file)
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        #the body is streamed to disk in chunks, it is never held in ram as a whole.
+        size = 0
+        with (session or requests).get(dwd_url_kmz, headers=headers, timeout=timeout, stream=True) as response:
+            if response.status_code == 304 and meta:
+                with self._lock:
+                    self.hits += 1
+                    self.bytes_saved += os.path.getsize(kmz_filename)
+                return kmz_filename, False
+            response.raise_for_status()
+            with open(kmz_filename + '.tmp', 'wb') as file:
+                for chunk in response.iter_content(chunk_size=2**16):
+                    file.write(chunk)
+                    size += len(chunk)
+            meta = {'url': dwd_url_kmz, 'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+        os.replace(kmz_filename + '.tmp', kmz_filename)
+        with open(meta_filename, 'w') as file:
+            json.dump(meta, file)
+        with self._lock:
+            self.misses += 1
+            self.bytes_downloaded += size
+        return kmz_filename, True
+
+    #(kml_content, local_folder_for_kml, outfilename_kml) as download_kml extracted it last time, None if not (yet) in ram.
+    def extracted(self, dwd_url_kmz):
+        with self._lock:
+            return self._extracted.get(dwd_url_kmz)
+
+    def remember_extracted(self, dwd_url_kmz, kml_content, local_folder_for_kml, outfilename_kml):
+        with self._lock:
+            self._extracted[dwd_url_kmz] = (kml_content, local_folder_for_kml, outfilename_kml)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'bytes_downloaded': self.bytes_downloaded, 'bytes_saved': self.bytes_saved}
 
 #download a certain kmz file, de-zip the kml file inside, and optionally save it locally.
-def download_kml(dwd_url_kmz, local_folder_for_kml=None, local_folder_for_kmz=None):
+#with a KmzCache, unchanged files are not transferred again, and not archived again to local_folder_for_kmz.
+#the kml extracted from them last time is returned as it is (same object, the kml file is written already).
+def download_kml(dwd_url_kmz, local_folder_for_kml=None, local_folder_for_kmz=None, session=None, timeout=default_timeout, cache=None):
     kml_content = ''
     outfilename_kml = None
     outfilename_kmz = None
     try: 
-        bytesio = io.BytesIO(requests.get(dwd_url_kmz).content)
-        zipfile = ZipFile(bytesio)
-        kml_content = zipfile.open(zipfile.namelist()[0]).read().decode("utf-8") 
-        if local_folder_for_kml:
-            outfilename_kml = os.path.join(local_folder_for_kml, zipfile.namelist()[0])
-            with open(outfilename_kml, "w") as f:
-                f.write(kml_content)
-        if local_folder_for_kmz:
-            outfilename_kmz = dwd_url_kmz.split('/')[-1]
-            nowstr = datetime.now().strftime('%Y%m%d_%H%M')
-            outfilename_kmz = outfilename_kmz[:-4] + '_' + nowstr + outfilename_kmz[-4:]
-            outfilename_kmz = os.path.join(local_folder_for_kmz, outfilename_kmz)
-            with open(outfilename_kmz, 'bw') as file:
-                file.write(bytesio.getvalue())
+        if cache is None:
+            kmz_content = download_kmz(dwd_url_kmz, session, timeout)
+        else:
+            kmz_content, modified = cache.fetch(dwd_url_kmz, session, timeout)
+            if not modified:
+                local_folder_for_kmz = None
+                extracted = cache.extracted(dwd_url_kmz)
+                if extracted is not None and extracted[1] == local_folder_for_kml:
+                    return extracted[0], extracted[2], None
+        kml_content, outfilename_kml, outfilename_kmz = extract_kml(kmz_content, dwd_url_kmz, local_folder_for_kml, local_folder_for_kmz)
+        if cache is not None:
+            cache.remember_extracted(dwd_url_kmz, kml_content, local_folder_for_kml, outfilename_kml)
     except Exception as e:
         print(e)
     return kml_content, outfilename_kml, outfilename_kmz
 
-#read content of a kml file to memory
-def read_kml(local_kml_filename):
+#read content of a kml file to memory. binary=True skips the text decoding (parseKML accepts bytes as well).
+def read_kml(local_kml_filename, binary=False):
     data = None
-    with open(local_kml_filename, 'r') as file:
+    with open(local_kml_filename, 'rb' if binary else 'r') as file:
         data = file.read()
     return data
 
-#all together as a single function for easy external usage.
-def download_latest_to_csv(station='10850', kml_elements=['Rad1h','Neff'], dir_csv='./data', dir_kml=None, dir_kmz=None):
+#url of the latest MOSMIX_L forecast for a single station
+def mosmix_url(station, base_url=dwd_base_url):
     #dwd_url        = 'https://opendata.dwd.de/weather/local_forecasts/mos/MOSMIX_L/single_stations/10836/kml/MOSMIX_L_LATEST_10836.kmz' 
-    dwd_url        = 'https://opendata.dwd.de/weather/local_forecasts/mos/MOSMIX_L/single_stations/' + station + '/kml/MOSMIX_L_LATEST_'+station+'.kmz' 
-    kml_content, kml_filename, kmz_filename = download_kml(dwd_url,dir_kml,dir_kmz)
-    timestamps, stationValuesDict = parseKML( kml_content, kml_elements)
-    if station not in stationValuesDict.keys():
-        print('station not included in data? strange.')
+    return base_url + '/MOSMIX_L/single_stations/' + station + '/kml/MOSMIX_L_LATEST_'+station+'.kmz' 
+
+#url of the latest MOSMIX_L forecast for all stations (one big file)
+def mosmix_all_stations_url(base_url=dwd_base_url):
+    return base_url + '/MOSMIX_L/all_stations/kml/MOSMIX_L_LATEST.kmz'
+
+#url of the latest MOSMIX_S forecast (hourly runs, all stations only)
+def mosmix_s_all_stations_url(base_url=dwd_base_url):
+    return base_url + '/MOSMIX_S/all_stations/kml/MOSMIX_S_LATEST_240.kmz'
+
+def csv_filename_for(station, dir_csv, ext='.csv'):
+    todaystr = datetime.now().strftime('%Y-%m-%d')
+    return os.path.join(dir_csv, 'mosmix_'+station+'_'+todaystr+ext)
+
+#an output file of save_station that can be kept for an unchanged forecast: it exists and has exactly the elements
+#asked for (the format is part of the file name already, see csv_filename_for).
+def station_file_current(filename, kml_elements):
+    if not os.path.exists(filename):
+        return False
+    try:
+        if columnstore.is_columnar(filename):
+            keys = list(columnstore.load_columns(filename).keys())
+        else:
+            with open(filename, 'r') as file:
+                keys = file.readline().strip().split(';')
+    except Exception as e:
+        print(e)
+        return False
+    return keys == ['t'] + list(kml_elements)
+
+#same as download_latest_to_csv, but raises instead of printing - for callers that collect errors.
+#with a KmzCache, an unchanged forecast is neither downloaded nor parsed again (as long as today's csv exists with the
+#same elements; otherwise it is extracted again from the cached kmz).
+def download_station_to_csv(station, kml_elements=['Rad1h','Neff'], dir_csv='./data', dir_kml=None, dir_kmz=None, session=None, timeout=default_timeout, base_url=dwd_base_url, cache=None, ext='.csv'):
+    dwd_url = mosmix_url(station, base_url)
+    csv_filename = csv_filename_for(station, dir_csv, ext)
+    if cache is None:
+        kmz_source = download_kmz(dwd_url, session, timeout)
     else:
-        valuesDict = stationValuesDict[station]
-        todaystr = datetime.now().strftime('%Y-%m-%d')
-        csv_filename = os.path.join(dir_csv, 'mosmix_'+station+'_'+todaystr+'.csv')
-        save_csv(csv_filename, station, timestamps, valuesDict)
+        kmz_source, modified = cache.fetch(dwd_url, session, timeout)
+        if not modified and station_file_current(csv_filename, kml_elements):
+            return csv_filename, None, None
+        if not modified:
+            dir_kmz = None  #this version is archived already
+    kml_filename, kmz_filename = store_kmz(kmz_source, dwd_url, dir_kml, dir_kmz)
+    #the zip member is streamed straight into the parser - no decoded copy of the kml.
+    #iterparseKML, not parseKML_stream: a corrupt or truncated file raises its parse error here, to the caller.
+    timestamps, stationValuesDict = [], {}
+    for timestamps, stationname, valuesDict in iterparseKML(open_kmz(kmz_source), kml_elements, [station]):
+        stationValuesDict[stationname] = valuesDict
+    if station not in stationValuesDict.keys():
+        raise Exception('station '+station+' not included in data? strange.')
+    valuesDict = stationValuesDict[station]
+    save_station(csv_filename, station, timestamps, valuesDict)
+    return csv_filename, kml_filename, kmz_filename
 
+#all together as a single function for easy external usage.
+def download_latest_to_csv(station='10850', kml_elements=['Rad1h','Neff'], dir_csv='./data', dir_kml=None, dir_kmz=None, session=None, cache=None, ext='.csv'):
+    csv_filename = kml_filename = kmz_filename = None
+    try:
+        csv_filename, kml_filename, kmz_filename = download_station_to_csv(station, kml_elements, dir_csv, dir_kml, dir_kmz, session, cache=cache, ext=ext)
+    except Exception as e:
+        print(e)
     return csv_filename, kml_filename, kmz_filename
 
+#many stations from one all_stations file: one download, one (streaming) parse, one csv per station
+#in the same format as save_station writes it. stations missing in the file are reported as errors.
+#returns results {station: (csv_filename, kml_filename, kmz_filename)} and errors {station: exception}.
+def download_all_stations_to_csv(stations, kml_elements=['Rad1h','Neff'], dir_csv='./data', dir_kml=None, dir_kmz=None, session=None, timeout=default_timeout, base_url=dwd_base_url, cache=None, ext='.csv'):
+    results = {}
+    errors = {}
+    dwd_url = mosmix_all_stations_url(base_url)
+    if cache is None:
+        kmz_source = download_kmz(dwd_url, session, timeout)
+    else:
+        kmz_source, modified = cache.fetch(dwd_url, session, timeout)
+        if not modified:
+            dir_kmz = None  #this version is archived already
+            if all(station_file_current(csv_filename_for(station, dir_csv, ext), kml_elements) for station in stations):
+                return {station: (csv_filename_for(station, dir_csv, ext), None, None) for station in stations}, errors
+    kml_filename, kmz_filename = store_kmz(kmz_source, dwd_url, dir_kml, dir_kmz)
+    for timestamps, station, valuesDict in iterparseKML(open_kmz(kmz_source), kml_elements, stations):
+        csv_filename = csv_filename_for(station, dir_csv, ext)
+        save_station(csv_filename, station, timestamps, valuesDict)
+        results[station] = (csv_filename, kml_filename, kmz_filename)
+    for station in stations:
+        if station not in results:
+            errors[station] = Exception('station '+station+' not included in data? strange.')
+    return results, errors
+
+#download_latest_to_csv for many stations at once.
+#mode 'single': one single_stations file per station, on a bounded thread pool that shares one pooled session.
+#mode 'all': one all_stations file, parsed once (see download_all_stations_to_csv).
+#mode 'auto': 'all' from all_stations_threshold stations on - then one big download is cheaper than many small ones.
+#returns results {station: (csv_filename, kml_filename, kmz_filename)} and errors {station: exception}.
+def download_many(stations, kml_elements=['Rad1h','Neff'], dir_csv='./data', dir_kml=None, dir_kmz=None, workers=8, session=None, timeout=default_timeout, base_url=dwd_base_url, cache=None, mode='auto', ext='.csv'):
+    results = {}
+    errors = {}
+    if session is None:
+        session = make_session(pool_size=workers)
+    if mode == 'all' or (mode == 'auto' and len(stations) >= all_stations_threshold):
+        try:
+            return download_all_stations_to_csv(stations, kml_elements, dir_csv, dir_kml, dir_kmz, session, timeout, base_url, cache, ext)
+        except Exception as e:
+            return results, {station: e for station in stations}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(download_station_to_csv, station, kml_elements, dir_csv, dir_kml, dir_kmz, session, timeout, base_url, cache, ext): station for station in stations}
+        for future in as_completed(futures):
+            station = futures[future]
+            try:
+                results[station] = future.result()
+            except Exception as e:
+                errors[station] = e
+    return results, errors
+
 
 if __name__ == "__main__":
     # example usage (executed when called directly - what I will do from a cron job)
@@ -143,5 +601,9 @@ if __name__ == "__main__":
     # or 3rd party services like https://wettwarn.de/mosmix/mosmix.html
     # or see readme.md for another option to visualize the stationlist.
     stations = ['10850','10836', 'Q491','Q485','P501']
-    for station in stations:
-        download_latest_to_csv(station, kml_elements, dir_kml=dir_kml, dir_kmz=dir_kmz, dir_csv=dir_csv)
\ No newline at end of file
+    #the cache makes frequent runs cheap: unchanged forecasts are answered with 304 by dwd.
+    cache = KmzCache(os.path.join(dir_kmz, 'cache'))
+    results, errors = download_many(stations, kml_elements, dir_kml=dir_kml, dir_kmz=dir_kmz, dir_csv=dir_csv, cache=cache)
+    for station, e in errors.items():
+        print(station + ': ' + str(e))
+    print(cache.stats())
\ No newline at end of file
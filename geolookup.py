@@ -0,0 +1,208 @@
+#geolookup: offline reverse geocoding of station coordinates to country and continent.
+#Copyright (C) 2022 makischu
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+#asking nominatim for thousands of stations takes about an hour (and a network). the countries of the world as polygons
+#answer it locally, in a fraction of a second. source: natural earth, admin 0 - countries (public domain), as geojson:
+#https://www.naturalearthdata.com/downloads/50m-cultural-vectors/  (e.g. ne_50m_admin_0_countries.geojson)
+#download it once to ./data, like mosmix_stations.cfg.
+#
+#point in polygon: even-odd rule (ray casting) over all rings of a country (holes included), vectorized over points and
+#edges; a bounding box test first selects the candidate countries per point. points that are in no polygon (coastal
+#stations, small islands - the polygons are simplified) get the country of the nearest border point within max_km.
+#the online lookup (nominatim) is only an optional fallback for the rest, its answers are kept in a local cache.
+
+import json
+import os
+import time
+import warnings
+import numpy as np
+import stationcatalog
+
+
+#natural earth continent >>> the names country_converter (and filter_stations) uses
+continent_names = {'North America': 'America', 'South America': 'America', 'Seven seas (open ocean)': 'not found'}
+
+class CountryIndex:
+    #features: list of (cc, country, continent, rings), rings: list of arrays (vertices x 2) of lon, lat.
+    def __init__(self, features):
+        self.features = [ (cc, country, continent) for cc, country, continent, rings in features ]
+        self.bbox = np.empty((len(features), 4))
+        self.edges = []
+        vertices = []
+        owners = []
+        for i, (cc, country, continent, rings) in enumerate(features):
+            rings = [ np.asarray(ring, dtype=np.float64) for ring in rings ]
+            points = np.concatenate(rings)
+            self.bbox[i] = [points[:,0].min(), points[:,1].min(), points[:,0].max(), points[:,1].max()]
+            #edges (x0, y0, x1, y1) of all rings, every ring closed.
+            self.edges.append(np.concatenate([ np.hstack((ring, np.roll(ring, -1, axis=0))) for ring in rings ]))
+            points = densify(self.edges[-1])
+            vertices.append(points)
+            owners.append(np.full(len(points), i))
+        vertices = np.concatenate(vertices) if vertices else np.zeros((0, 2))
+        self.owner = np.concatenate(owners) if owners else np.zeros(0, dtype=int)
+        from scipy.spatial import cKDTree
+        self.tree = cKDTree(stationcatalog.to_xyz(vertices[:,1], vertices[:,0])) if len(vertices) else None
+
+    #index of the feature that contains each point, -1 for none.
+    def contains(self, lat, lon, chunk=2**21):
+        lat, lon = np.atleast_1d(np.asarray(lat, dtype=np.float64)), np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        found = np.full(len(lat), -1)
+        for i, edges in enumerate(self.edges):
+            minx, miny, maxx, maxy = self.bbox[i]
+            cand = np.flatnonzero((found < 0) & (lon >= minx) & (lon <= maxx) & (lat >= miny) & (lat <= maxy))
+            if not len(cand):
+                continue
+            x0, y0, x1, y1 = edges[:,0], edges[:,1], edges[:,2], edges[:,3]
+            step = max(1, chunk // len(edges))
+            for s in range(0, len(cand), step):
+                c = cand[s:s+step]
+                px, py = lon[c, None], lat[c, None]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    crossing = ((y0 > py) != (y1 > py)) & (px < (x1-x0)*(py-y0)/(y1-y0) + x0)
+                inside = np.count_nonzero(crossing, axis=1) % 2 == 1
+                found[c[inside]] = i
+        return found
+
+    #like contains, plus the nearest border point within max_km for points that are in no polygon.
+    def lookup(self, lat, lon, max_km=25):
+        lat, lon = np.atleast_1d(np.asarray(lat, dtype=np.float64)), np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        found = self.contains(lat, lon)
+        rest = np.flatnonzero(found < 0)
+        if len(rest) and self.tree is not None and max_km > 0:
+            chord, idx = self.tree.query(stationcatalog.to_xyz(lat[rest], lon[rest]))
+            near = stationcatalog.chord_to_km(chord) <= max_km
+            found[rest[near]] = self.owner[idx[near]]
+        return found
+
+    #(cc, country, continent) per point, None where nothing was found.
+    def resolve(self, lat, lon, max_km=25):
+        return [ self.features[i] if i >= 0 else None for i in self.lookup(lat, lon, max_km).tolist() ]
+
+#points along the edges (x0, y0, x1, y1), at most step degrees apart, so that the nearest point is about the nearest border.
+def densify(edges, step=0.1):
+    n = np.maximum(1, np.ceil(np.hypot(edges[:,2]-edges[:,0], edges[:,3]-edges[:,1]) / step).astype(int))
+    f = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    f = f / np.repeat(n, n)
+    e = np.repeat(edges, n, axis=0)
+    return np.stack((e[:,0] + f*(e[:,2]-e[:,0]), e[:,1] + f*(e[:,3]-e[:,1])), axis=1)
+
+#natural earth geojson >>> CountryIndex. country code lower case, like nominatim's country_code.
+def load_countries(filename):
+    with open(filename, 'r', encoding='utf-8') as file:
+        collection = json.load(file)
+    features = []
+    for feature in collection['features']:
+        properties = feature['properties']
+        cc = properties.get('ISO_A2_EH', properties.get('ISO_A2', ''))
+        cc = '' if cc in ['-99', None] else cc.lower()
+        country = properties.get('NAME', properties.get('ADMIN', ''))
+        continent = properties.get('CONTINENT', '')
+        continent = continent_names.get(continent, continent)
+        geometry = feature['geometry']
+        polygons = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+        rings = [ ring for polygon in polygons for ring in polygon ]
+        features.append((cc, country, continent, rings))
+    return CountryIndex(features)
+
+
+#answers of the online lookup, persisted as json. key: coordinates rounded to 0.01 degree.
+class GeocodeCache:
+    def __init__(self, filename='./data/cache/geocode.json'):
+        self.filename = filename
+        self.entries = {}
+        if filename and os.path.exists(filename):
+            try:
+                with open(filename, 'r', encoding='utf-8') as file:
+                    self.entries = json.load(file)
+            except Exception as e:
+                print(e)
+
+    @staticmethod
+    def key(lat, lon):
+        return '{:.2f},{:.2f}'.format(lat, lon)
+
+    def get(self, lat, lon):
+        entry = self.entries.get(self.key(lat, lon))
+        return tuple(entry) if entry else None
+
+    def put(self, lat, lon, result):
+        self.entries[self.key(lat, lon)] = list(result)
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            with open(self.filename + '.tmp', 'w', encoding='utf-8') as file:
+                json.dump(self.entries, file)
+            os.replace(self.filename + '.tmp', self.filename)
+        except Exception as e:
+            print(e)
+
+#nominatim, as stationlist2csv did it before. needs network, geopy and country_converter (imported only here).
+_geolocator = None
+def online_lookup(lat, lon, retries=10):
+    global _geolocator
+    from geopy.geocoders import Nominatim
+    import country_converter as coco
+    if _geolocator is None:
+        _geolocator = Nominatim(user_agent="stationlist2csv.py")
+    location = None
+    for i in range(0, retries):
+        try:
+            location = _geolocator.reverse((lat, lon))
+        except: #timeout ReadTimeoutError MaxRetryError ConnectionError GeocoderUnavailable
+            print('geolocator failed.')
+            time.sleep(5)
+        else:
+            break
+    if not location:
+        return None
+    address = location.raw['address']
+    country_code = address.get('country_code', '')
+    return country_code, address.get('country', ''), coco.CountryConverter().convert(country_code.upper(), to='continent')
+
+#the polygons are not part of the repository. without them every station ends up as '-' (unless the cache or the
+#online lookup know it; station_cfg_to_umap_csv then asks online) - that must not go unnoticed, but one warning per
+#process is enough.
+_warned_no_countries = False
+def warn_no_countries(filename=None):
+    global _warned_no_countries
+    if not _warned_no_countries:
+        _warned_no_countries = True
+        warnings.warn('no country polygons'+(' ('+str(filename)+')' if filename else '')+': only the cache and the online lookup '
+                      +'know countries, the rest stays \'-\' (download ne_50m_admin_0_countries.geojson to ./data, see geolookup.py)', stacklevel=2)
+
+#(cc, country, continent) for many points: offline index first, then the cache, then (optional) online.
+#what is still unknown becomes ('-', '-', '-'). without index, warn_no_countries.
+def resolve(lat, lon, index=None, online=False, cache=None, max_km=25):
+    lat, lon = np.atleast_1d(np.asarray(lat, dtype=np.float64)), np.atleast_1d(np.asarray(lon, dtype=np.float64))
+    if index is None:
+        warn_no_countries()
+    results = index.resolve(lat, lon, max_km) if index is not None else [None]*len(lat)
+    for i in range(len(results)):
+        if results[i] is not None:
+            continue
+        if cache is not None:
+            results[i] = cache.get(lat[i], lon[i])
+        if results[i] is None and online:
+            results[i] = online_lookup(lat[i], lon[i])
+            if results[i] is not None and cache is not None:
+                cache.put(lat[i], lon[i], results[i])
+        if results[i] is None:
+            results[i] = ('-', '-', '-')
+    if cache is not None and online:
+        cache.save()
+    return results
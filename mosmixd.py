@@ -0,0 +1,192 @@
+#mosmixd: resident service that keeps the pv estimation up to date, aligned to DWD's MOSMIX runs.
+#Copyright (C) 2022 makischu
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+#instead of three cron jobs (each one starting python, importing everything and computing everything from scratch)
+#one process that stays:
+# - the parsed forecasts, the interpolation and pv results of the last run and the solar tables stay in ram
+#   (see pipeline.Pipeline), the http session and the KmzCache as well.
+# - it wakes up when a new MOSMIX run is due: MOSMIX_L is issued 4 times a day (03, 09, 15, 21 UTC), MOSMIX_S every hour.
+#   from then on it asks dwd every retry_seconds (conditional requests: while nothing is new, dwd answers 304 and nothing
+#   is transferred) until the new run is there, or window_minutes are over. then it sleeps until the next run is due.
+# - a new run goes through all stages in this process, typically within seconds after dwd has published it.
+# - the latest result is written to output (optional) and served via http:
+#   /forecast (json: columns, NaN as null), /forecast.csv, /status.
+
+import datetime as dt
+import json
+import math
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import dwd2csv
+import pipeline
+
+
+release_hours = {'L': [3, 9, 15, 21], 'S': list(range(24))}
+
+#the next point in time (UTC, >= now) at which a run of product is due: issue hour + delay_minutes.
+def next_release(now, product='L', delay_minutes=0):
+    day = dt.datetime(now.year, now.month, now.day, tzinfo=dt.timezone.utc)
+    for days in [0, 1]:
+        for hour in release_hours[product]:
+            release = day + dt.timedelta(days=days, hours=hour, minutes=delay_minutes)
+            if release >= now:
+                return release
+    return day + dt.timedelta(days=2)
+
+#the last point in time (UTC, <= now) at which a run of product was due.
+def last_release(now, product='L', delay_minutes=0):
+    day = dt.datetime(now.year, now.month, now.day, tzinfo=dt.timezone.utc)
+    for days in [0, 1]:
+        for hour in reversed(release_hours[product]):
+            release = day - dt.timedelta(days=days) + dt.timedelta(hours=hour, minutes=delay_minutes)
+            if release <= now:
+                return release
+    return day - dt.timedelta(days=2)
+
+
+#the service: fetch, run the pipeline, keep and expose the latest result.
+class ForecastService:
+    def __init__(self, pipe=None, product='L', elements=pipeline.default_elements, output=None, cache_dir='./data/cache', base_url=dwd2csv.dwd_base_url):
+        self.pipe = pipe or pipeline.Pipeline(cache_dir=cache_dir)
+        self.product = product
+        self.elements = elements
+        self.output = output
+        self.base_url = base_url
+        self.session = dwd2csv.make_session()
+        self.cache = dwd2csv.KmzCache(cache_dir)
+        self.forecasts = {}
+        self.latest = None
+        self.updated = None
+        self.horizon_start = None
+        self.runs = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_seconds = None
+        self._lock = threading.Lock()
+
+    #one update. returns True if there is a new result (new forecast, or a new day for the horizon).
+    def refresh(self, now=None):
+        t0 = dt.datetime.now(dt.timezone.utc)
+        stations = pipeline.needed_stations(self.pipe.stations)
+        forecasts, modified = pipeline.fetch_forecasts(stations, self.elements, self.product, self.session, self.cache, self.forecasts, self.base_url)
+        horizon_start, horizon_end = pipeline.horizon(self.pipe.horizon_days, now)
+        if not modified and self.latest is not None and horizon_start == self.horizon_start:
+            return False
+        result = self.pipe.run(forecasts, now)
+        if self.output:
+            pipeline.save_output(self.output, result)
+        with self._lock:
+            self.forecasts = forecasts
+            self.latest = result
+            self.horizon_start = horizon_start
+            self.updated = dt.datetime.now(dt.timezone.utc)
+            self.runs += 1
+            self.last_seconds = (self.updated - t0).total_seconds()
+        return True
+
+    #a failed update, counted under the lock like everything the http thread reads.
+    def record_error(self, e):
+        with self._lock:
+            self.errors += 1
+            self.last_error = str(e)
+
+    def snapshot(self):
+        with self._lock:
+            return self.latest, self.status()
+
+    def status(self):
+        return {'product': self.product, 'updated': self.updated.isoformat() if self.updated else None, 'runs': self.runs,
+                'errors': self.errors, 'last_error': self.last_error, 'last_seconds': self.last_seconds, 'cache': self.cache.stats()}
+
+#seconds until the next attempt: while a due run is not there yet, every retry_seconds (within window_minutes after it was due),
+#otherwise until the next run is due.
+def wait_seconds(now, updated, product='L', delay_minutes=0, retry_seconds=60, window_minutes=120):
+    due = last_release(now, product, delay_minutes)
+    if not updated and now - due < dt.timedelta(minutes=window_minutes):
+        return retry_seconds
+    return max(1.0, (next_release(now + dt.timedelta(seconds=1), product, delay_minutes) - now).total_seconds())
+
+#the main loop. runs until stop (a threading.Event) is set.
+def run_daemon(service, delay_minutes=0, retry_seconds=60, window_minutes=120, stop=None):
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        updated = False
+        try:
+            updated = service.refresh()
+            if updated:
+                print(dt.datetime.now().isoformat()+' updated in '+str(round(service.last_seconds, 2))+' s')
+        except Exception as e:
+            service.record_error(e)
+            print(e)
+        stop.wait(wait_seconds(dt.datetime.now(dt.timezone.utc), updated, service.product, delay_minutes, retry_seconds, window_minutes))
+
+
+#result columns >>> json-able dict: timestamps as iso strings, NaN as None.
+def to_json(columns):
+    out = {}
+    for key, col in columns.items():
+        if col.dtype.kind == 'M':
+            out[key] = [ str(ts)+'Z' for ts in col.astype('datetime64[s]') ]
+        else:
+            out[key] = [ None if (isinstance(v, float) and math.isnan(v)) else v for v in col.tolist() ]
+    return out
+
+def make_server(service, host='127.0.0.1', port=8080):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            latest, status = service.snapshot()
+            path = self.path.split('?')[0]
+            if path == '/status':
+                self.reply(200, 'application/json', json.dumps(status))
+            elif path in ['/forecast', '/forecast.json', '/forecast.csv']:
+                if latest is None:
+                    self.reply(503, 'text/plain', 'no forecast yet')
+                elif path.endswith('.csv'):
+                    self.reply(200, 'text/csv', pipeline.to_csv(latest))
+                else:
+                    self.reply(200, 'application/json', json.dumps(to_json(latest)))
+            else:
+                self.reply(404, 'text/plain', 'not found')
+
+        def reply(self, code, content_type, body):
+            body = body.encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+    return ThreadingHTTPServer((host, port), Handler)
+
+#http server in a background thread, the daemon loop in this one.
+def serve(service, host='127.0.0.1', port=8080, delay_minutes=0, retry_seconds=60, window_minutes=120, stop=None):
+    server = make_server(service, host, port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        run_daemon(service, delay_minutes, retry_seconds, window_minutes, stop)
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    # example usage: instead of the cron jobs. my stations and plants, MOSMIX_L, result also as file.
+    plants = pipeline.csv2pv.load_plants('./plants.json') if os.path.exists('./plants.json') else None
+    service = ForecastService(pipeline.Pipeline(plants=plants), product='L', output='./data/mosmix_pvest_latest.csv')
+    serve(service, port=8080)
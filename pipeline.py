@@ -0,0 +1,270 @@
+#pipeline: the three stages dwd2csv >>> csv2csv >>> csv2pv in one process, on columns in ram.
+#Copyright (C) 2022 makischu
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+#the scripts hand their results over as files (mosmix_<station>_<date>.csv >>> mosmix_refined_<date>.csv >>> mosmix_pvest_<date>.csv),
+#every stage parses what the one before has formatted. here the same steps work on dicts of numpy columns
+#({'t': datetime64[s] UTC, element: float64 with NaN for '-'}) that are passed on directly:
+# fetch_forecasts  kmz (download with KmzCache, or local files) >>> columns per station      (dwd2csv)
+# combine          Rad1h of the Rad1h stations (weighted mean), the rest from the base station (csv2csv.merge_stations/overwrite_from)
+# Pipeline.run     limit to the horizon, interpolate, pv estimation - incremental against the last run (csv2csv, csv2pv)
+#results are the same as with the files, except that nothing is rounded to 2 decimals in between.
+#files are only written if asked for (run: raw_dir, refined, pvest). as a script:
+# python pipeline.py --rad1h 10836 10850 --base Q491 --plants plants.json --resolution 5 --horizon 2 --pvest ./data/pvest.csv
+# python pipeline.py --kmz ./test/MOSMIX_L_fixture.kmz --start 2022-09-01      (local kmz/kml files instead of downloading)
+
+import datetime as dt
+import io
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import dateutil.tz as tz
+import dwd2csv
+import csv2csv
+import csv2pv
+import columnstore
+
+
+default_elements = ['Rad1h','Neff','N','DD','FF','FX1','PPPP','DRR1','RR1c','RRad1','SunD1','SunD','TTT','Td','ww','WPc11']
+
+#all stations a site needs (see csv2csv.site_stations).
+def needed_stations(stations):
+    rad_ids, rad_weights = stations['Rad1h']
+    return list(dict.fromkeys(list(rad_ids) + [stations['base']]))
+
+#parsed forecast of one station >>> columns.
+def station_columns(timestamps, elements, values):
+    columns = {'t': timestamps}
+    for i, el in enumerate(elements):
+        columns[el] = np.asarray(values[i], dtype=np.float64)
+    return columns
+
+#latest forecasts of the stations as columns, {station: columns}. product 'L': one single_stations file per station
+#(in parallel), 'S': the all_stations file of MOSMIX_S (there are no single station files). with a KmzCache only
+#changed files are downloaded and parsed again; known: the forecasts of the last call, reused for unchanged files.
+#returns the forecasts and whether anything changed.
+def fetch_forecasts(stations, elements=default_elements, product='L', session=None, cache=None, known=None, base_url=dwd2csv.dwd_base_url, workers=8):
+    known = known or {}
+    if product == 'S':
+        url = dwd2csv.mosmix_s_all_stations_url(base_url)
+        sources = { url: stations }
+    else:
+        sources = { dwd2csv.mosmix_url(station, base_url): [station] for station in stations }
+    def fetch(url):
+        if cache is None:
+            return dwd2csv.download_kmz(url, session), True
+        return cache.fetch(url, session)
+    forecasts = {}
+    modified = False
+    with ThreadPoolExecutor(max_workers=min(workers, len(sources)) or 1) as pool:
+        fetched = dict(zip(sources.keys(), pool.map(fetch, sources.keys())))
+    for url, (kmz_source, changed) in fetched.items():
+        wanted = sources[url]
+        if not changed and all(station in known for station in wanted):
+            forecasts.update({ station: known[station] for station in wanted })
+            continue
+        modified = True
+        forecasts.update(parse_kmz(kmz_source, elements, wanted))
+    for station in stations:
+        if station not in forecasts:
+            raise Exception('station '+station+' not included in data? strange.')
+    return forecasts, modified
+
+#a kmz (filename or bytes; or a kml filename) >>> {station: columns} for the given stations.
+def parse_kmz(kmz_source, elements, stations):
+    if not isinstance(kmz_source, str):
+        kmz_source = dwd2csv.open_kmz(kmz_source)
+    timestamps, stationArrays = dwd2csv.scanKML_columnar(kmz_source, elements, stations)
+    return { station: station_columns(timestamps, elements, values) for station, values in stationArrays.items() }
+
+#forecasts from local files (e.g. fixtures, archived kmz, an all_stations file): the stations are taken from the first
+#file that has them.
+def load_forecasts(filenames, stations, elements=default_elements):
+    forecasts = {}
+    for filename in filenames:
+        missing = [ station for station in stations if station not in forecasts ]
+        if not missing:
+            break
+        forecasts.update(parse_kmz(filename, elements, missing))
+    for station in stations:
+        if station not in forecasts:
+            raise Exception('station '+station+' not included in data? strange.')
+    return forecasts
+
+#one dataset from the stations of a site, same rules as refine_my_latest_csv: Rad1h is the (weighted) mean of the Rad1h
+#stations where any of them has a value, all other columns come from the base station. the stations are aligned on the
+#union of their timestamps (as csv2csv._align), hours a station does not have are NaN.
+def combine(forecasts, stations, overwriteColumns=['Rad1h']):
+    rad_ids, rad_weights = stations['Rad1h']
+    base = forecasts[stations['base']]
+    sources = [ forecasts[station] for station in rad_ids ]
+    t = np.unique(np.concatenate([ c['t'] for c in [base] + sources ]))
+    columns = {'t': t}
+    pos = np.searchsorted(t, base['t'])
+    for key, col in base.items():
+        if key != 't':
+            columns[key] = np.full(len(t), np.nan)
+            columns[key][pos] = col
+    w = np.ones(len(sources)) if rad_weights is None else np.asarray(rad_weights, dtype=np.float64)
+    for key in overwriteColumns:
+        values = np.full((len(sources), len(t)), np.nan)
+        for k, source in enumerate(sources):
+            values[k, np.searchsorted(t, source['t'])] = source[key]
+        valid = ~np.isnan(values)
+        wk = w[:, None] * valid
+        with np.errstate(invalid='ignore', divide='ignore'):
+            merged = np.sum(np.where(valid, values, 0) * wk, axis=0) / np.sum(wk, axis=0)
+        found = np.any(valid, axis=0)
+        if key not in columns:
+            columns[key] = np.full(len(t), np.nan)
+        columns[key][found] = merged[found]
+    return columns
+
+#rows date_start <= t <= date_end (as csv2csv.limit).
+def limit(columns, date_start, date_end):
+    t = columns['t']
+    keep = (t >= np.datetime64(int(date_start.timestamp()), 's')) & (t <= np.datetime64(int(date_end.timestamp()), 's'))
+    return { key: col[keep] for key, col in columns.items() }
+
+#horizon as refine_my_latest_csv uses it: from today 00:00 (UTC) on, for days.
+def horizon(days=3, now=None):
+    now = now or dt.datetime.now()
+    date_start = dt.datetime(now.year, now.month, now.day, tzinfo=dt.timezone.utc)
+    return date_start, date_start + dt.timedelta(days=days)
+
+
+#the stages 2 and 3 with their state: the interpolation and the pv estimation of the last run are kept, so a new run
+#only computes what changed (see csv2csv.interpolate_incremental, csv2pv.evaluate_plants_incremental).
+class Pipeline:
+    def __init__(self, stations=None, plants=None, resolution_in_minutes=5, horizon_days=3, cache_dir='./data/cache'):
+        self.stations = stations or csv2csv.default_stations
+        self.plants = plants or csv2pv.default_plants
+        self.resolution_in_minutes = resolution_in_minutes
+        self.horizon_days = horizon_days
+        self.cache_dir = cache_dir
+        self.refined_state = None
+        self.pv_state = None
+
+    #forecasts {station: columns} >>> refined columns plus the pv columns (as in mosmix_pvest_<date>).
+    def run(self, forecasts, now=None):
+        date_start, date_end = horizon(self.horizon_days, now)
+        columns = limit(combine(forecasts, self.stations), date_start, date_end)
+        interp, recomputed = csv2csv.interpolate_incremental(columns, self.refined_state, self.resolution_in_minutes)
+        self.refined_state = (columns, interp)
+        t, Rad1h, Neff, TTT = interp['t'], interp['Rad1h'], interp['Neff'], interp['TTT']
+        pv, self.pv_state = csv2pv.evaluate_plants_incremental(t, Rad1h, Neff, TTT, self.pv_state, self.plants, self.resolution_in_minutes, self.cache_dir)
+        result = dict(interp)
+        result.update(pv)
+        return result
+
+#result columns >>> file, in the format of the extension (see csv2csv.save_data). like the stage files, with 'tLocal'
+#(refined, pvest) or without (raw).
+def save_output(filename, columns, local_time=True):
+    out = output_columns(columns, local_time)
+    if columnstore.is_columnar(filename):
+        columnstore.save_columns(filename, out)
+    else:
+        csv2csv.save(filename, csv2csv.columns_to_rows(out))
+
+def output_columns(columns, local_time=True):
+    t = csv2csv.to_datetime(columns['t'])
+    out = {'t': t}
+    if local_time:
+        out['tLocal'] = np.empty(len(t), dtype=object)
+        out['tLocal'][:] = [ ts.astimezone(tz.tzlocal()) for ts in t ]
+    out.update({ key: col for key, col in columns.items() if key != 't' })
+    return out
+
+#result columns >>> csv text, as csv2csv.save writes it.
+def to_csv(columns, local_time=True):
+    rows = csv2csv.columns_to_rows(output_columns(columns, local_time))
+    with io.StringIO() as file:
+        if rows:
+            file.write(';'.join(rows[0].keys())+'\r\n')
+        for row in rows:
+            file.write(';'.join(str(csv2csv.myformat(key, val)) for key, val in row.items())+'\r\n')
+        return file.getvalue()
+
+
+#the whole chain for one site, in one go. stations: see csv2csv.site_stations (default: csv2csv.default_stations),
+#plants: see csv2pv (default: csv2pv.default_plants). start: first day of the horizon (datetime, default today).
+#kmz_files: local files instead of downloading. raw_dir/refined/pvest: which results to write (the format follows ext
+#or the file extension), nothing is written by default. returns the refined columns plus the pv columns.
+def run(stations=None, plants=None, resolution_in_minutes=5, horizon_days=3, start=None, kmz_files=None, product='L',
+        elements=default_elements, raw_dir=None, refined=None, pvest=None, ext='.csv', cache_dir='./data/cache', session=None, cache=None):
+    pipe = Pipeline(stations, plants, resolution_in_minutes, horizon_days, cache_dir)
+    needed = needed_stations(pipe.stations)
+    if kmz_files:
+        forecasts = load_forecasts(kmz_files, needed, elements)
+    else:
+        forecasts, modified = fetch_forecasts(needed, elements, product, session, cache)
+    result = pipe.run(forecasts, start)
+    for directory in [raw_dir] + [ os.path.dirname(f) for f in [refined, pvest] if f ]:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    if raw_dir:
+        for station in needed:
+            save_output(dwd2csv.csv_filename_for(station, raw_dir, ext), forecasts[station], local_time=False)
+    if refined:
+        save_output(refined, pipe.refined_state[1])
+    if pvest:
+        save_output(pvest, result)
+    return result
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='dwd forecast >>> refined forecast >>> pv estimation, in one process.')
+    parser.add_argument('--rad1h', nargs='+', metavar='STATION', help='stations for Rad1h (mean), default: '+' '.join(csv2csv.default_stations['Rad1h'][0]))
+    parser.add_argument('--weights', nargs='+', type=float, help='weights of the Rad1h stations (default: equal)')
+    parser.add_argument('--base', metavar='STATION', help='station for all other elements, default: '+csv2csv.default_stations['base'])
+    parser.add_argument('--site', nargs=2, type=float, metavar=('LAT', 'LON'), help='choose the stations from the catalogue instead (see stationcatalog.catalog)')
+    parser.add_argument('--offers', default='./data/stationoffers.csv', help='station offers for --site (see stationlist2csv)')
+    parser.add_argument('--plants', help='plant configuration (json), default: ./plants.json if it exists, else the one in csv2pv')
+    parser.add_argument('--resolution', type=int, default=5, help='minutes (default 5)')
+    parser.add_argument('--horizon', type=float, default=3, help='days from --start on (default 3)')
+    parser.add_argument('--start', help='first day YYYY-MM-DD (UTC), default today')
+    parser.add_argument('--product', choices=['L', 'S'], default='L', help='MOSMIX_L (single stations) or MOSMIX_S (all stations)')
+    parser.add_argument('--kmz', nargs='+', metavar='FILE', help='local kmz/kml files instead of downloading')
+    parser.add_argument('--raw', metavar='DIR', help='write the forecasts of the stations (mosmix_<station>_<date><ext>)')
+    parser.add_argument('--refined', metavar='FILE', help='write the refined forecast')
+    parser.add_argument('--pvest', metavar='FILE', help='write the pv estimation')
+    parser.add_argument('--ext', default='.csv', help='format of --raw (.csv, .npy, .parquet, .feather)')
+    parser.add_argument('--cache', default='./data/cache', help='cache directory (kmz, solar tables)')
+    args = parser.parse_args(argv)
+
+    stations = None
+    if args.site:
+        import stationcatalog
+        if not os.path.exists(args.offers):
+            raise Exception('--site needs the station offers, '+args.offers+' does not exist (see stationlist2csv.mosmix_stationoffers)')
+        cat = stationcatalog.catalog(filename_offers=args.offers)
+        stations = csv2csv.site_stations(cat, args.site[0], args.site[1])
+    elif args.rad1h or args.base:
+        stations = {'Rad1h': (args.rad1h or csv2csv.default_stations['Rad1h'][0], args.weights), 'base': args.base or csv2csv.default_stations['base']}
+    plants = args.plants or ('./plants.json' if os.path.exists('./plants.json') else None)
+    plants = csv2pv.load_plants(plants) if plants else None
+    start = dt.datetime.strptime(args.start, '%Y-%m-%d') if args.start else None
+    cache = None
+    if not args.kmz:
+        os.makedirs(args.cache, exist_ok=True)
+        cache = dwd2csv.KmzCache(args.cache)
+    result = run(stations, plants, args.resolution, args.horizon, start, args.kmz, args.product, raw_dir=args.raw,
+                 refined=args.refined, pvest=args.pvest, ext=args.ext, cache_dir=args.cache, cache=cache)
+    if not (args.raw or args.refined or args.pvest):
+        print(to_csv(result), end='')
+
+
+if __name__ == "__main__":
+    main()
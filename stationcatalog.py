@@ -0,0 +1,191 @@
+#stationcatalog: the MOSMIX station catalogue as arrays, with a spatial index to find the nearest stations.
+#Copyright (C) 2022 makischu
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+#source of the catalogue (see stationlist2csv.py as well):
+#https://www.dwd.de/EN/ourservices/met_application_mosmix/mosmix_stations.html
+#which stations offer which element (e.g. Rad1h) comes from the forecast itself, see stationlist2csv.mosmix_stationoffers.
+#
+#nearest stations: the coordinates are points on the unit sphere (x,y,z). the straight (chord) distance between two
+#such points grows monotonically with the great circle (haversine) distance, so a plain KD-tree over x,y,z finds
+#exactly the nearest stations on the earth's surface. one tree per element, over the stations that offer it.
+
+import csv
+import os
+import numpy as np
+
+
+earth_radius_km = 6371.0
+
+#cfg: degrees and minutes ("52.23 bedeutet 52°23'") >>> decimal degrees.
+def degmin_to_deg(value):
+    value = np.asarray(value, dtype=np.float64)
+    deg = np.trunc(value)
+    minutes = np.round((np.abs(value) - np.abs(deg)) * 100)
+    return np.sign(value) * (np.abs(deg) + minutes/60)
+
+def to_xyz(lat, lon):
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.stack((np.cos(lat)*np.cos(lon), np.cos(lat)*np.sin(lon), np.sin(lat)), axis=-1)
+
+def chord_to_km(chord):
+    return 2 * earth_radius_km * np.arcsin(np.clip(chord / 2, 0, 1))
+
+#great circle distance in km, for reference.
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+    a = np.sin((lat2-lat1)/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin((lon2-lon1)/2)**2
+    return 2 * earth_radius_km * np.arcsin(np.sqrt(a))
+
+
+#the catalogue: one entry per station in parallel arrays. offers: stations x elements (bool).
+class StationCatalog:
+    def __init__(self, ids, names, lat, lon, elevation, elements=[], offers=None):
+        self.ids = np.asarray(ids, dtype=str)
+        self.names = np.asarray(names, dtype=str)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.elevation = np.asarray(elevation, dtype=np.float32)
+        self.elements = list(elements)
+        self.offers = np.zeros((len(self.ids), len(self.elements)), dtype=bool) if offers is None else np.asarray(offers, dtype=bool)
+        self.xyz = to_xyz(self.lat, self.lon)
+        self._trees = {}
+        self._index = { station: i for i, station in enumerate(self.ids.tolist()) }
+
+    def __len__(self):
+        return len(self.ids)
+
+    #set the offered elements from stationlist2csv.mosmix_stationoffers ({station: {element: (once, all)}}).
+    #a station offers an element if it has at least one value.
+    def set_offers(self, stationOffers, elements):
+        self.elements = list(elements)
+        self.offers = np.zeros((len(self.ids), len(self.elements)), dtype=bool)
+        for station, offered in stationOffers.items():
+            i = self._index.get(station)
+            if i is None:
+                continue
+            for j, el in enumerate(self.elements):
+                self.offers[i, j] = el in offered and bool(offered[el][0])
+        self._trees = {}
+
+    def position(self, station):
+        return self._index[station]
+
+    #KD-tree over all stations (element None) or the stations offering element, and their positions in the catalogue.
+    #which station offers what is only known with the station offers (see catalog, filename_offers).
+    def _tree(self, element=None):
+        if element not in self._trees:
+            from scipy.spatial import cKDTree    #only here, importing the catalogue stays cheap
+            if element is not None and element not in self.elements:
+                raise Exception('the station catalogue knows no offers for '+element+': build it with the station offers '
+                                +'(catalog(filename_offers=...), e.g. ./data/stationoffers.csv from stationlist2csv.mosmix_stationoffers)')
+            members = np.arange(len(self.ids)) if element is None else np.flatnonzero(self.offers[:, self.elements.index(element)])
+            self._trees[element] = (cKDTree(self.xyz[members]), members)
+        return self._trees[element]
+
+    #the k nearest stations (offering element, if given) for one or many locations.
+    #returns station ids and distances in km, shape (k,) for one location, (locations, k) for arrays of lat/lon.
+    def nearest(self, lat, lon, k=1, element=None):
+        tree, members = self._tree(element)
+        chord, idx = tree.query(to_xyz(lat, lon), k=list(range(1, min(k, len(members))+1)))
+        return self.ids[members[idx]], chord_to_km(chord)
+
+    #stations and inverse-distance weights (1/d^power, normalized per location) to blend element at the given location(s).
+    def idw(self, lat, lon, k=2, element='Rad1h', power=2):
+        ids, distances = self.nearest(lat, lon, k, element)
+        return ids, inverse_distance_weights(distances, power)
+
+    #sources: what the catalogue was built from (strings, see catalog), stored along to validate the file later.
+    def save(self, filename, sources=[]):
+        try:
+            with open(filename + '.tmp', 'wb') as file:
+                np.savez(file, ids=self.ids, names=self.names, lat=self.lat, lon=self.lon, elevation=self.elevation,
+                         elements=np.array(self.elements, dtype=str), offers=self.offers, sources=np.array(sources, dtype=str))
+            os.replace(filename + '.tmp', filename)
+        except Exception as e:
+            print(e)
+
+#1/d^power along the last axis, normalized. a station right at the location (d=0) gets everything.
+def inverse_distance_weights(distances, power=2):
+    d = np.asarray(distances, dtype=np.float64)
+    zero = d == 0
+    with np.errstate(divide='ignore'):
+        w = np.where(np.any(zero, axis=-1, keepdims=True), zero*1.0, 1 / d**power)
+    return w / np.sum(w, axis=-1, keepdims=True)
+
+def load_catalog(filename):
+    with np.load(filename) as npz:
+        return StationCatalog(npz['ids'], npz['names'], npz['lat'], npz['lon'], npz['elevation'], npz['elements'].tolist(), npz['offers'])
+
+#parse dwd's mosmix_stations.cfg (fixed columns, as in stationlist2csv.station_cfg_to_umap_csv).
+#lines without valid coordinates (header, separators) are skipped.
+def parse_station_cfg(filename):
+    ids, names, lat, lon, elevation = [], [], [], [], []
+    with open(filename, 'r', errors='ignore') as file:
+        for l in file:
+            try:
+                latf = float(l[44:51])
+                lonf = float(l[51:59])
+            except:
+                continue
+            try:
+                elev = float(l[59:].split()[0])
+            except:
+                elev = np.nan
+            ids.append(l[12:18].strip())
+            names.append(l[23:43].strip())
+            lat.append(latf)
+            lon.append(lonf)
+            elevation.append(elev)
+    return StationCatalog(ids, names, degmin_to_deg(lat), degmin_to_deg(lon), elevation)
+
+#offers as written by stationlist2csv.mosmix_stationoffers(csv_filename=...): stationid;Rad1h;... with 0/1.
+def read_stationoffers_csv(filename):
+    stationOffers = {}
+    with open(filename, 'r') as file:
+        reader = csv.DictReader(file, delimiter=';')
+        elements = [ el for el in reader.fieldnames if el != 'stationid' ]
+        for row in reader:
+            stationOffers[row['stationid']] = { el: (row[el] == '1', row[el] == '1') for el in elements }
+    return stationOffers, elements
+
+#elements in the header of a stationoffers csv (without reading the rest).
+def stationoffers_elements(filename):
+    with open(filename, 'r') as file:
+        return [ el for el in file.readline().strip().split(';') if el != 'stationid' ]
+
+#the catalogue from cfg (and the stationoffers csv, if given), parsed once and then kept as .npz next to it.
+#the npz records its inputs (file names and mtimes of cfg and offers); it is only used for the same inputs, with
+#the elements of the offers file. otherwise (e.g. cached without offers, now with) it is built again.
+def catalog(filename_cfg='./data/mosmix_stations.cfg', filename_offers=None, filename_npz='./data/cache/stations.npz'):
+    sources = [ str(item) for f in [filename_cfg, filename_offers] if f for item in (os.path.abspath(f), os.path.getmtime(f)) ]
+    elements = stationoffers_elements(filename_offers) if filename_offers else []
+    if os.path.exists(filename_npz):
+        try:
+            with np.load(filename_npz) as npz:
+                cached = npz['sources'].tolist() if 'sources' in npz.files else None
+            if cached == sources:
+                cat = load_catalog(filename_npz)
+                if cat.elements == elements:
+                    return cat
+        except Exception as e:
+            print(e)
+    cat = parse_station_cfg(filename_cfg)
+    if filename_offers:
+        stationOffers, elements = read_stationoffers_csv(filename_offers)
+        cat.set_offers(stationOffers, elements)
+    os.makedirs(os.path.dirname(filename_npz), exist_ok=True)
+    cat.save(filename_npz, sources)
+    return cat
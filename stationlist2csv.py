@@ -26,69 +26,113 @@
 #https://umap.openstreetmap.fr/de/map/dwd-stations_802117
 #Komma-, tabulator-, oder semikolongetrennte Werte. SRS WGS84 ist impliziert. Nur Punktgeometrien werden importiert. Beim Import wird nach Spaltenüberschriften mit jeder Nennung von „lat“ und „lon“ am Anfang der Überschrift gesucht (ohne Beachtung von Groß-/Kleinschreibung). Alle anderen Spalten werden als Merkmale importiert.
 #destination 2: counting (binning to country/continent)
+#offline, see geolookup.py (needs a natural earth countries geojson in ./data).
+#the online lookup is optional (online=True; without the geojson it is the default), it needs:
 #conda install -c conda-forge geopy
 #conda install -c konstantinstadler country_converter
-from geopy.geocoders import Nominatim
-import country_converter as coco
-import time
-geolocator = Nominatim(user_agent="stationlist2csv.py")
-cc = coco.CountryConverter()
+import geolookup
+import stationcatalog
+import os
 
 #for Filtering (Find out which station offers Rad1h-values (and which not))
 import dwd2csv
 import csv
-import pandas as pd
+import numpy as np
 
 #not all stations provide all data.
+#which value of many dwd:value texts (bytes) is present, all texts at once: a value is a run of non-blank bytes,
+#a missing one is a lone '-'. returns texts x n (bool); texts with another number of values than n are never present.
+def values_present(texts, n):
+    offsets = np.cumsum([ len(text)+1 for text in texts ])
+    b = np.frombuffer(b' '.join(texts) + b' ', dtype=np.uint8)
+    blank = b <= 32
+    start = ~blank & np.concatenate(([True], blank[:-1]))
+    lone = np.concatenate((blank[1:], [True]))
+    pos = np.flatnonzero(start)
+    text = np.searchsorted(offsets, pos, side='right')
+    count = np.bincount(text, minlength=len(texts))
+    ok = count == n
+    present = np.zeros((len(texts), n), dtype=bool)
+    keep = ok[text]
+    present[ok] = ~((b[pos[keep]] == 45) & lone[pos[keep]]).reshape(-1, n)
+    return present
+
+#which station offers which element, for all stations and elements in one pass over the raw kml:
+#present[station, element, timestep] is True where dwd sends a value (not '-').
+#an element that a station does not have at all (or with the wrong number of values) is never present.
+#returns stationids, present.
+def stationoffers_matrix(kml_source, elements, batch=1000):
+    stationids = []
+    blocks = []
+    texts = []
+    n = 0
+    source = kml_source
+    try:
+        for timestamps, stationname, valuesDict in dwd2csv.iterscanKML(kml_source, elements):
+            n = len(timestamps)
+            stationids.append(stationname)
+            texts.extend(valuesDict[el] for el in elements)
+            if len(texts) >= batch*len(elements):
+                blocks.append(values_present(texts, n))
+                texts = []
+        if texts:
+            blocks.append(values_present(texts, n))
+    except Exception as e:
+        print(e)
+    if not stationids and isinstance(source, str):
+        timestamps, stationArrays = dwd2csv.parseKML_columnar(source, elements, dtype=np.float32)
+        stationids = list(stationArrays.keys())
+        return stationids, ~np.isnan(np.stack(list(stationArrays.values()))) if stationids else np.zeros((0, len(elements), len(timestamps)), dtype=bool)
+    if not blocks:
+        return stationids, np.zeros((0, len(elements), n), dtype=bool)
+    return stationids, np.concatenate(blocks).reshape(len(stationids), len(elements), n)
+
+#present >>> per station and element: any value, all values, fraction of values (stations x elements each).
+def stationoffers_summary(present):
+    count = np.count_nonzero(present, axis=-1)
+    n = present.shape[-1]
+    return count > 0, (count == n) & (n > 0), count / max(n, 1)
+
 #generate a list of stations, aggregated with the information wether it offers certain data, e.g. Rad1h
-def mosmix_stationoffers(elements=['Rad1h'], csv_filename = None):
-    stations = {}
-    
+#returns {stationid: {element: (dataExistsOnce, dataExistsAll)}}
+def mosmix_stationoffers(elements=['Rad1h'], csv_filename = None, kml_source = None):
     #we use a local cache... (the date doesn't matter). preparation:
     #download and extract from https://opendata.dwd.de/weather/local_forecasts/mos/MOSMIX_S/all_stations/kml/
-    a_local_allstations_kml_filename = './data/MOSMIX_S_2022090109_240.kml'
+    #(the latest MOSMIX_S kmz works as well, so the offers can be refreshed with every update.)
+    if kml_source is None:
+        kml_source = './data/MOSMIX_S_2022090109_240.kml'
     
-    with open(a_local_allstations_kml_filename, 'r', errors='ignore') as file:
-        mosmix_s_kml_content = file.read()
-    timestamps, stationValues = dwd2csv.parseKML(mosmix_s_kml_content, ['Rad1h'])
-
-    for (stationName,stationData) in stationValues.items():
-        stationDict = {}
-        for el in elements:
-            if el in stationData.keys():
-                elementValues = stationData[el]
-                dataExistsOnce = False
-                dataExistsAll  = True
-                for val in elementValues:
-                    if val != '-':
-                        dataExistsOnce = True
-                    else:
-                        dataExistsAll = False
-                stationDict[el] = (dataExistsOnce,dataExistsAll)
-        stations[stationName] = stationDict
+    stationids, present = stationoffers_matrix(kml_source, elements)
+    once, every, fraction = stationoffers_summary(present)
+    stations = { stationid: { el: (bool(once[i, j]), bool(every[i, j])) for j, el in enumerate(elements) }
+                 for i, stationid in enumerate(stationids) }
         
     if csv_filename:
         with open(csv_filename, 'w') as file:
             mywriter = csv.writer(file, delimiter=';')
             header = ['stationid'] + elements
             mywriter.writerow(header)
-            for statName, statElements in stations.items():
-                mywriter.writerow([statName] + [1 if exO else 0 for (exO,exA) in statElements.values()])
+            for i, statName in enumerate(stationids):
+                mywriter.writerow([statName] + once[i].astype(int).tolist())
         
     return stations     
 
 #dwd's station.cfg-file is not directly importable to umap.openstreetmap.fr
 #convert it that it is. and aggregate additional information.
-def station_cfg_to_umap_csv(filename_i = './mosmix_stations.cfg', filename_o = './mosmix_stations.csv', stationOffers=None):
+#country/continent come from the offline index (filename_countries); online=True asks nominatim for the stations
+#the index does not know (cached in filename_cache). online=None: only without the polygons - then every station is
+#asked online, as before the offline index existed.
+def station_cfg_to_umap_csv(filename_i = './mosmix_stations.cfg', filename_o = './mosmix_stations.csv', stationOffers=None,
+                            filename_countries = './data/ne_50m_admin_0_countries.geojson', online=None,
+                            filename_cache = './data/cache/geocode.json'):
     #filename_i shall point to a local copy of the file downloaded from
     #https://www.dwd.de/EN/ourservices/met_application_mosmix/mosmix_stations.html 
     
     filecontent = None
     with open(filename_i, 'r', errors='ignore') as file:
         filecontent = file.read()
-    fileo = open(filename_o, 'w')
-    fileo.write('lat;lon;id;name;cc;country;continent;offersRad1h\n')
         
+    rows = []
     lines = filecontent.splitlines()
     for l in lines:
         ids = l[12:18].strip()
@@ -108,45 +152,37 @@ def station_cfg_to_umap_csv(filename_i = './mosmix_stations.cfg', filename_o = '
             lats = lats[0]+'°'+lats[1]+'\''
             lons = lon.strip().split('.')
             lons = lons[0]+'°'+lons[1]+'\''
-            #e.g. 44°27', 12°18' results in 'nominatim.openstreetmap.org:443/reverse?lat=44.45&lon=12.3&format=json&addressdetails=1
-            
-            coordinates = lats + ', ' + lons #"48.69978, 10.24177"
-            print(coordinates)
-            location = None
-            for i in range(0,10):
-                try:
-                    location = geolocator.reverse(coordinates)
-                except: #timeout ReadTimeoutError MaxRetryError ConnectionError GeocoderUnavailable
-                    print('geolocator failed.')
-                    time.sleep(5)
-                else:
-                    break
-            if location:
-                address = location.raw['address']
-                country = address.get('country', '')
-                country_code = address.get('country_code', '')
-                print(country_code)
-                
-                continent = cc.convert(country_code.upper(),to='continent')
-                print(continent)
-            else:
-                country='-'
-                country_code='-'
-                continent='-'
-            
+            rows.append((lats, lons, ids, nam, latf, lonf))
+    
+    #all stations at once.
+    index = None
+    if filename_countries and os.path.exists(filename_countries):
+        index = geolookup.load_countries(filename_countries)
+    else:
+        geolookup.warn_no_countries(filename_countries)
+    if online is None:
+        online = index is None
+    cache = geolookup.GeocodeCache(filename_cache) if filename_cache else None
+    lat = stationcatalog.degmin_to_deg([ r[4] for r in rows ])
+    lon = stationcatalog.degmin_to_deg([ r[5] for r in rows ])
+    places = geolookup.resolve(lat, lon, index=index, online=online, cache=cache)
+    
+    with open(filename_o, 'w') as fileo:
+        fileo.write('lat;lon;id;name;cc;country;continent;offersRad1h\n')
+        for (lats, lons, ids, nam, latf, lonf), (country_code, country, continent) in zip(rows, places):
             offersRad1h = '-'
             if stationOffers and ids in stationOffers.keys() and 'Rad1h' in stationOffers[ids].keys():
                 (exO,exA) = stationOffers[ids]['Rad1h']
                 offersRad1h = '1' if exO else '0' 
-            print(offersRad1h)
             fileo.write(lats+';'+lons+';'+ids+';'+nam+';'+country_code+';'+country+';'+continent+';'+offersRad1h+'\n')
-            
-    fileo.close()
 
 
 #filter the stations. for example assume that we only want to keep european stations that offer radiation data.
 def filter_stations( filename_i = './mosmix_stations_all.csv',  filename_o = './mosmix_stations_filtered.csv'):
+    import pandas as pd
     alls = pd.read_csv(filename_i, sep=';', dtype=str)
+    if not ((alls['continent'] != 'not found')&(alls['continent'] != '-')).any():
+        raise Exception('no station in '+filename_i+' has a continent: country polygons or online lookup needed, see station_cfg_to_umap_csv')
     myst  = alls[(alls['offersRad1h'] == '1')&(alls['continent'] == 'Europe')]
     myst.to_csv(filename_o, sep=';', index=False) #encoding='latin1', errors='replace', 
     
@@ -174,7 +210,7 @@ if __name__ == "__main__":
     # #[...]
     # #04097;1
     # #[...]
-    # (the following takes ~1hour because the geo-lookup is done online for thousends of entries)
+    # (offline this takes about a second; with online=True the stations outside the polygons are asked online)
     station_cfg_to_umap_csv(stationOffers = stations, filename_i = './data/mosmix_stations.cfg', filename_o = './data/mosmix_stations_all.csv')
     
     filter_stations(filename_i = './data/mosmix_stations_all.csv', filename_o = './data/mosmix_stations_filtered.csv')